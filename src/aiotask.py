@@ -0,0 +1,465 @@
+'''!@file       aiotask.py
+    An adapter which runs a @c cotask task list inside an @c asyncio event
+    loop on the PC, so that the tasks written for the Nucleo can share one
+    thread with asyncio code such as serial I/O, telemetry decoding, plotting
+    and test harnesses.
+
+    An @ref Adapter runs the task list's scheduler as a coroutine. Whenever
+    no task is ready, it awaits until the next timed task is due, a simulated
+    timer interrupt comes due, or a task's @c go() method is called, so the
+    tasks keep their periods and priorities and nothing busy-polls. With a
+    @c simhal.Clock, simulated time is kept in step with the event loop's
+    time, optionally sped up, or jumps ahead whenever the tasks are idle so a
+    simulation runs as fast as it can.
+
+    Coroutines use the task list's queues and shares through
+    @ref AsyncQueue and @ref AsyncShare objects, which can be awaited until
+    data arrives or a value changes, and a @ref Pipe can be given to
+    @c print_task.set_stream() so that a coroutine can await what the tasks
+    print:
+    @code
+    board = simhal.install()
+    ...
+    import aiotask, cotask, print_task, main
+    main.create_tasks()
+    adapter = aiotask.Adapter(cotask.task_list, board.clock, speed=4.0)
+    pipe = aiotask.Pipe(adapter)
+    print_task.set_stream(pipe)
+
+    async def decode():
+        while True:
+            records, used = telemetry.decode(await pipe.read())
+            ...
+
+    async def session():
+        decoder = asyncio.create_task(decode())
+        await adapter.run(1500)
+        decoder.cancel()
+
+    asyncio.run(session())
+    @endcode
+'''
+
+import asyncio
+import threading
+
+##  @brief      The number of times the event loop is let run before
+#               simulated time jumps ahead, when running as fast as possible.
+_SETTLE_TURNS = 4
+
+
+class _Waiter:
+    '''!Stands in for a task in the list of a @c cotask.Wait, so that a
+        coroutine is woken when the wait is.
+    '''
+
+    def __init__(self, adapter):
+        self._adapter = adapter
+        self._wait = None
+
+        ##  @brief  Set when the wait has been woken
+        self.event = asyncio.Event()
+
+    def go(self):
+        '''!Called by @c cotask.Wait.wake(), possibly from a simulated
+            interrupt or another thread.
+        '''
+        self._adapter._call(self.event.set)
+
+    async def wait(self, wait, timeout):
+        '''!Waits until a @c cotask.Wait object is woken.
+            @param wait     The @c cotask.Wait object
+            @param timeout  The longest time to wait in seconds of the event
+                            loop's time, or @c None to wait as long as it takes
+            @return         @c True if the wait was woken or had already
+                            happened, @c False if the timeout ran out
+        '''
+        self.event.clear()
+        if not wait._add_waiter(self):
+            return True
+        try:
+            await asyncio.wait_for(self.event.wait(), timeout)
+        except asyncio.TimeoutError:
+            # Waking the wait skips anything which no longer waits for it
+            self._wait = None
+            return False
+        return True
+
+
+class Adapter:
+    '''!Runs a @c cotask.TaskList in an asyncio event loop.
+    '''
+
+    def __init__(self, task_list, clock=None, speed=1.0, sched=None,
+                 pass_us=20):
+        '''!Creates an adapter for a task list.
+            @param task_list    The @c cotask.TaskList to be run
+            @param clock        The @c simhal.Clock which the tasks' time
+                                comes from, or @c None if @c utime keeps real
+                                time by itself
+            @param speed        The number of simulated seconds which pass in
+                                each second of the event loop's time, or
+                                @c None to jump ahead to the next event
+                                whenever the tasks are idle
+            @param sched        The scheduler method, by default the task
+                                list's @c event_sched, which lets a call to a
+                                task's @c go() wake the adapter at once
+            @param pass_us      Simulated time taken by each scheduler pass
+                                when @c speed is @c None
+        '''
+        self.task_list = task_list
+        self.clock = clock
+        self.speed = speed
+        self._sched = sched if sched is not None else task_list.event_sched
+        self._pass_us = pass_us
+        self._loop = None
+        self._thread = None
+        self._wakeup = asyncio.Event()
+        self._passed = asyncio.Event()
+
+        ##  @brief  The number of scheduler passes which ran a task
+        self.passes = 0
+
+    def _call(self, fun):
+        '''!Calls a function in the event loop's thread: now if this is that
+            thread, or soon if it's another, such as a serial reader's.
+        '''
+        if self._loop is None or threading.get_ident() == self._thread:
+            fun()
+        else:
+            self._loop.call_soon_threadsafe(fun)
+
+    def _post(self, task):
+        '''!Set as the task list's @c on_post hook while the adapter runs,
+            so that making a task ready wakes the adapter.
+        '''
+        self._call(self._wakeup.set)
+
+    def _sync(self):
+        '''!Moves the simulated clock up to the event loop's time.
+        '''
+        if self.clock is None or self.speed is None:
+            return
+        target = self._start_sim + int((self._loop.time() - self._start_loop)
+                                       * 1000000*self.speed)
+        if target > self.clock.now:
+            self.clock.advance(target - self.clock.now)
+
+    def _time_to_next(self):
+        '''!Finds how long the tasks may sleep, in simulated microseconds,
+            or @c None if only a call to a task's @c go() can wake them.
+        '''
+        wait = self.task_list.time_to_next()
+        if self.clock is not None:
+            until = self.clock.next_event()
+            if until is not None and (wait is None or until < wait):
+                wait = until
+        return wait
+
+    async def _sleep(self, wait_us):
+        '''!Waits for a number of simulated microseconds, or until a task is
+            made ready.
+        '''
+        if self.clock is not None and self.speed is None:
+            # Let the coroutines catch up before time jumps ahead; those they
+            # await may take a few turns of the event loop to finish
+            for _ in range(_SETTLE_TURNS):
+                await asyncio.sleep(0)
+            if self._wakeup.is_set():
+                return
+            if wait_us is None:
+                await self._wakeup.wait()
+            else:
+                self.clock.advance(wait_us, wake=True)
+            return
+
+        speed = self.speed if self.clock is not None else 1.0
+        try:
+            await asyncio.wait_for(
+                self._wakeup.wait(),
+                wait_us/1000000/speed if wait_us is not None else None)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, duration_ms=None):
+        '''!Runs the task list's scheduler, yielding to the other coroutines
+            after each task runs and while the tasks are idle.
+            @param duration_ms  The time to run for in ms of the tasks' time,
+                                or @c None to run until cancelled
+        '''
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.get_ident()
+        self._start_loop = self._loop.time()
+        clock = self.clock
+        if clock is not None:
+            self._start_sim = clock.now
+            end = clock.now + int(duration_ms*1000) \
+                if duration_ms is not None else None
+        else:
+            end = self._start_loop + duration_ms/1000 \
+                if duration_ms is not None else None
+
+        # Have a task's go() wake the adapter, as an interrupt wakes the CPU
+        self.task_list.on_post = self._post
+        try:
+            while True:
+                self._sync()
+                now = clock.now if clock is not None else self._loop.time()
+                if end is not None and now >= end:
+                    break
+                if clock is not None and self.speed is None:
+                    clock.advance(self._pass_us)
+
+                self._wakeup.clear()
+                if self._sched():
+                    self.passes += 1
+                    self._passed.set()
+                    self._passed.clear()
+                    await asyncio.sleep(0)
+                    continue
+
+                wait = self._time_to_next()
+                if end is not None:
+                    left = end - now if clock is not None \
+                        else int((end - now)*1000000)
+                    if wait is None or left < wait:
+                        wait = left
+                if wait == 0:
+                    await asyncio.sleep(0)
+                else:
+                    await self._sleep(wait)
+        finally:
+            self.task_list.on_post = None
+
+    async def next_pass(self):
+        '''!Waits until the scheduler has next run a task, such as to let a
+            task make room in a full queue.
+        '''
+        await self._passed.wait()
+
+    def queue(self, queue):
+        '''!Makes an awaitable view of a @c task_share.Queue.
+            @param queue    The queue
+            @return         An @ref AsyncQueue
+        '''
+        return AsyncQueue(queue, self)
+
+    def share(self, share):
+        '''!Makes an awaitable view of a @c task_share.Share or
+            @c task_share.RecordShare.
+            @param share    The share
+            @return         An @ref AsyncShare
+        '''
+        return AsyncShare(share, self)
+
+
+class AsyncQueue:
+    '''!A @c task_share.Queue which coroutines can await. Items can be read
+        one at a time with @c get() or with @c async @c for.
+    '''
+
+    def __init__(self, queue, adapter):
+        '''!Wraps a queue; @c Adapter.queue() is the usual way to do this.
+            @param queue    The @c task_share.Queue
+            @param adapter  The @ref Adapter running the task list
+        '''
+        ##  @brief  The queue
+        self.queue = queue
+        self._adapter = adapter
+        self._waiter = _Waiter(adapter)
+
+    async def wait_data(self, timeout=None):
+        '''!Waits until the queue holds data.
+            @param timeout  The longest time to wait in seconds, or @c None
+            @return         @c True if there's data, @c False if the timeout
+                            ran out first
+        '''
+        if self.queue.any():
+            return True
+        await self._waiter.wait(self.queue.wait_data(), timeout)
+        return self.queue.any()
+
+    async def get(self):
+        '''!Gets the next item, waiting for one if the queue is empty.
+            @return         The item
+        '''
+        while not self.queue.any():
+            await self.wait_data()
+        return self.queue.get()
+
+    async def get_many(self, buf):
+        '''!Waits for data, then copies as many items as there are, up to
+            the length of a buffer, out of the queue.
+            @param buf      A buffer with the queue's item type
+            @return         The number of items copied into @c buf
+        '''
+        while not self.queue.any():
+            await self.wait_data()
+        return self.queue.get_many(buf)
+
+    async def put(self, item):
+        '''!Puts an item into the queue, first letting the tasks run until
+            there's room for it if the queue is full.
+            @param item     The item
+        '''
+        while self.queue.full():
+            await self._adapter.next_pass()
+        self.queue.put(item)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+
+class AsyncShare:
+    '''!A @c task_share.Share or @c task_share.RecordShare which coroutines
+        can await. Each change can be followed with @c async @c for.
+    '''
+
+    def __init__(self, share, adapter):
+        '''!Wraps a share; @c Adapter.share() is the usual way to do this.
+            @param share    The share
+            @param adapter  The @ref Adapter running the task list
+        '''
+        ##  @brief  The share
+        self.share = share
+        self._waiter = _Waiter(adapter)
+
+    def get(self):
+        '''!Returns the share's value now.
+        '''
+        return self.share.get()
+
+    def put(self, value):
+        '''!Puts a value into the share, waking anything waiting for a
+            change.
+        '''
+        self.share.put(value)
+
+    async def wait_change(self, timeout=None):
+        '''!Waits until a value is next put into the share.
+            @param timeout  The longest time to wait in seconds, or @c None
+            @return         @c True if there was a change, @c False if the
+                            timeout ran out first
+        '''
+        return await self._waiter.wait(self.share.wait_change(), timeout)
+
+    async def changed(self):
+        '''!Waits for the next change and returns the new value.
+        '''
+        await self.wait_change()
+        return self.share.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.changed()
+
+
+class Pipe:
+    '''!A stream which tasks write to, such as through @c print_task, and a
+        coroutine reads from, awaiting data rather than polling for it.
+    '''
+
+    def __init__(self, adapter=None):
+        '''!Creates an empty pipe.
+            @param adapter  The @ref Adapter, so that writes from other
+                            threads wake the reader safely, or @c None if
+                            only the event loop's thread writes
+        '''
+        self._adapter = adapter
+        self._buf = bytearray()
+        self._event = asyncio.Event()
+
+        ##  @brief  Set to @c True once @c close() has been called
+        self.closed = False
+
+    def write(self, data):
+        '''!Adds data to the pipe.
+            @param data     A @c bytes-like object or a string
+            @return         The number of items written
+        '''
+        if isinstance(data, str):
+            data = data.encode()
+        self._buf += data
+        if self._adapter is not None:
+            self._adapter._call(self._event.set)
+        else:
+            self._event.set()
+        return len(data)
+
+    def close(self):
+        '''!Marks the end of the data, so that @c read() returns an empty
+            result once the pipe is empty.
+        '''
+        self.closed = True
+        self._event.set()
+
+    async def read(self):
+        '''!Waits until there's data and takes all of it.
+            @return         The data as @c bytes, which is empty only if the
+                            pipe is closed and empty
+        '''
+        while not self._buf and not self.closed:
+            self._event.clear()
+            await self._event.wait()
+        data = bytes(self._buf)
+        self._buf.clear()
+        return data
+
+
+if __name__ == '__main__':
+    # Run main.py's step response at four times real speed while a coroutine
+    # decodes the telemetry and another shows progress, all in one thread
+    import simhal
+    _board = simhal.install()
+    _board.add_motor(simhal.DCMotor(), pwm_timer=3, encoder_timer=4)
+    _board.add_motor(simhal.DCMotor(), pwm_timer=5, encoder_timer=8)
+
+    # NumPy is imported now rather than by the first decode, which would
+    # hold up the event loop, and with it the tasks, for a moment
+    import numpy                # noqa: F401 -- imported to load it early
+    import cotask
+    import print_task
+    import telemetry
+    import main
+
+    main.create_tasks()
+    _adapter = Adapter(cotask.task_list, _board.clock, speed=4.0)
+    _pipe = Pipe(_adapter)
+    print_task.set_stream(_pipe)
+    _latest = {}
+
+    async def _decode():
+        pending = b''
+        while True:
+            data = await _pipe.read()
+            if not data:
+                return
+            pending += data
+            records, used = telemetry.decode(pending)
+            pending = pending[used:]
+            for record in records:
+                _latest[int(record['channel'])] = (int(record['time']),
+                                                   int(record['ticks']))
+
+    async def _show():
+        while True:
+            await asyncio.sleep(0.1)
+            print(', '.join(f'motor {channel}: {ticks} ticks at {time} ms'
+                            for channel, (time, ticks)
+                            in sorted(_latest.items())))
+
+    async def _session():
+        decoder = asyncio.create_task(_decode())
+        shower = asyncio.create_task(_show())
+        await _adapter.run(main._stepResponseTime + 100)
+        _pipe.close()
+        await decoder
+        shower.cancel()
+        print(cotask.task_list)
+
+    asyncio.run(_session())
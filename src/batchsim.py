@@ -0,0 +1,188 @@
+'''!@file       batchsim.py
+    A simulator, run on the PC, which finds the step responses of many
+    controller configurations at once using NumPy.
+
+    Each configuration is a set of PID gains and task periods. All of them
+    are simulated together in lockstep: every quantity is an array with one
+    element per configuration, and each millisecond of simulated time is one
+    set of array operations. The control law is the one in
+    @c pidcontroller.PIDController.run(), and the motor is the first order
+    model of @c simhal.DCMotor, solved exactly over each millisecond.
+
+    The effect of the task periods is modelled as it happens in
+    @c main.py: the position seen by the controller is the one the encoder
+    task last read, and the duty cycle stays where the controller task last
+    set it. Both tasks first run one period after starting, and when they're
+    due at the same time the encoder task runs first, as it has the higher
+    priority. Tasks are assumed to take no time to run.
+
+    @code
+    import batchsim
+    configs = batchsim.grid(Kp=numpy.linspace(0.005, 0.05, 100),
+                            controller_period=[10, 20, 50, 75, 100])
+    results = batchsim.simulate(**configs)
+    best = numpy.argmin(results['settling_time'])
+    @endcode
+'''
+
+import numpy
+
+import simhal
+
+_PPR = 256*4*16
+
+##  @brief      The default set point, one revolution, in encoder ticks.
+SET_POINT = 360 * _PPR / 360
+
+
+def grid(Kp=0.0, Ki=0.0, Kd=0.0, controller_period=10, encoder_period=10):
+    '''!Makes every combination of the given parameter values.
+        @param Kp                   Proportional gains in duty cycle per tick
+        @param Ki                   Integral gains
+        @param Kd                   Derivative gains
+        @param controller_period    Controller task periods in ms
+        @param encoder_period       Encoder task periods in ms
+        @return                     A dictionary of flat arrays with one
+                                    element per combination, which may be
+                                    passed to @c simulate() as keywords
+    '''
+    names = ('Kp', 'Ki', 'Kd', 'controller_period', 'encoder_period')
+    axes = numpy.meshgrid(*(numpy.atleast_1d(value) for value in
+                            (Kp, Ki, Kd, controller_period, encoder_period)),
+                          indexing='ij')
+    return {name: axis.ravel() for name, axis in zip(names, axes)}
+
+
+def simulate(Kp, Ki=0.0, Kd=0.0, controller_period=10, encoder_period=10,
+             set_point=SET_POINT, duration_ms=1500, motor=None,
+             settle_band=0.02, record=False):
+    '''!Simulates the step responses of a batch of configurations.
+        Arguments may be scalars or arrays; they are broadcast together and
+        each element of the result is one configuration.
+        @param Kp                   Proportional gains in duty cycle per tick
+        @param Ki                   Integral gains, duty cycle per tick ms
+        @param Kd                   Derivative gains, duty cycle ms per tick
+        @param controller_period    Controller task periods in whole ms
+        @param encoder_period       Encoder task periods in whole ms
+        @param set_point            The set point in ticks
+        @param duration_ms          The simulated time in ms
+        @param motor                A @c simhal.DCMotor whose parameters are
+                                    used, or @c None for the defaults
+        @param settle_band          The fraction of the set point within which
+                                    the response must stay to be settled
+        @param record               Set to @c True to also return the position
+                                    of every configuration at every ms
+        @return                     A dictionary of arrays: @c overshoot in
+                                    percent of the set point,
+                                    @c settling_time in ms (@c nan if never
+                                    settled), @c steady_state_error in ticks
+                                    (set point minus final position), and
+                                    @c final_position; with @c record, also
+                                    @c position, shaped (time, configuration)
+    '''
+    motor = motor if motor is not None else simhal.DCMotor()
+    Kp, Ki, Kd, ctrl_per, enc_per = numpy.broadcast_arrays(
+        *(numpy.asarray(value, dtype=float) for value in
+          (Kp, Ki, Kd, controller_period, encoder_period)))
+    ctrl_per = ctrl_per.astype(int)
+    enc_per = enc_per.astype(int)
+    count = Kp.size
+    Kp, Ki, Kd = Kp.ravel(), Ki.ravel(), Kd.ravel()
+    ctrl_per, enc_per = ctrl_per.ravel(), enc_per.ravel()
+
+    # Motor state, the encoder share and the controller's stored values
+    position = numpy.zeros(count)
+    speed = numpy.zeros(count)
+    duty = numpy.zeros(count)
+    shared = numpy.zeros(count)
+    Iduty = numpy.zeros(count)
+    last_error = numpy.zeros(count)
+    last_time = numpy.zeros(count)
+    started = numpy.zeros(count, dtype=bool)
+    start_ms = numpy.zeros(count)
+
+    peak = numpy.zeros(count)
+    last_outside = numpy.zeros(count)
+    trace = numpy.empty((duration_ms, count)) if record else None
+
+    decay = numpy.exp(-0.001 / motor.time_constant)
+    band = settle_band * abs(set_point)
+
+    for now in range(1, duration_ms + 1):
+        # Advance the motor one millisecond with the duty cycle held
+        final = motor.max_speed * duty / 100.0
+        position += (final * 0.001 + (speed - final) * motor.time_constant
+                     * (1.0 - decay))
+        speed = final + (speed - final) * decay
+        ticks = numpy.floor(position)
+
+        # Encoder tasks which are due put the position into the share
+        enc_due = now % enc_per == 0
+        shared = numpy.where(enc_due, ticks, shared)
+
+        # Controller tasks which are due run PIDController.run()'s law
+        due = now % ctrl_per == 0
+        if due.any():
+            first = due & ~started
+            start_ms = numpy.where(first, now, start_ms)
+            started |= due
+            error = shared - set_point
+            curr_time = now - start_ms
+            delta = curr_time - last_time
+
+            # The first run has no previous time, so it has no I or D term
+            live = due & ~first
+            safe = numpy.where(live & (delta != 0), delta, 1.0)
+            Iduty_new = numpy.where(live, Ki * error * delta, 0.0)
+            reset = (((Iduty > 0) & (Iduty_new < 0))
+                     | ((Iduty < 0) & (Iduty_new > 0)))
+            new_I = numpy.where(reset, Iduty_new, Iduty + Iduty_new)
+            Dduty = numpy.where(live, Kd * (error - last_error) / safe, 0.0)
+
+            actuation = numpy.clip(-Kp * error + new_I + Dduty, -100, 100)
+            duty = numpy.where(due, actuation, duty)
+            Iduty = numpy.where(due, new_I, Iduty)
+            last_error = numpy.where(due, error, last_error)
+            last_time = numpy.where(due, curr_time, last_time)
+
+        peak = numpy.maximum(peak, ticks)
+        last_outside = numpy.where(numpy.abs(ticks - set_point) > band,
+                                   now, last_outside)
+        if record:
+            trace[now - 1] = ticks
+
+    settled = last_outside < duration_ms
+    results = {
+        'overshoot': numpy.maximum(peak - set_point, 0) / abs(set_point)
+                     * 100.0,
+        'settling_time': numpy.where(settled, last_outside, numpy.nan),
+        'steady_state_error': set_point - numpy.floor(position),
+        'final_position': numpy.floor(position),
+    }
+    if record:
+        results['position'] = trace
+    return results
+
+
+if __name__ == '__main__':
+    import time
+
+    # Sweep the gains and controller periods of the README's experiments
+    _configs = grid(Kp=numpy.linspace(0.1, 2.0, 200) * (360 / _PPR),
+                    controller_period=[10, 20, 30, 40, 50, 75, 100, 150,
+                                       500])
+    _start = time.perf_counter()
+    _results = simulate(**_configs)
+    _elapsed = time.perf_counter() - _start
+    print(f'{len(_configs["Kp"])} configurations in {_elapsed:.2f} s')
+
+    print(f'{"PERIOD":>7s} {"BEST KP":>8s} {"%OS":>7s} {"SETTLE":>7s} '
+          f'{"SSE":>7s}')
+    for _period in numpy.unique(_configs['controller_period']):
+        _mask = _configs['controller_period'] == _period
+        _settle = numpy.where(_mask, _results['settling_time'], numpy.inf)
+        _best = int(numpy.nanargmin(_settle))
+        print(f'{_period:7d} {_configs["Kp"][_best] * _PPR / 360:8.2f} '
+              f'{_results["overshoot"][_best]:7.1f} '
+              f'{_results["settling_time"][_best]:7.0f} '
+              f'{_results["steady_state_error"][_best]:7.0f}')
@@ -0,0 +1,123 @@
+'''!@file       bench_idle.py
+    A benchmark, run on the PC, which compares a busy scheduler loop with
+    @c cotask.TaskList.run_forever(), which sleeps when no task is ready.
+
+    The task set is the one in @c main.py: two encoder tasks and a data
+    collection task every 10 ms and two controller tasks every 300 ms. Time
+    is simulated with the clock from @c simhal.py. Each scheduler pass
+    costs a fixed amount of simulated time and each task run costs some more.
+    Three loops are compared:
+    - @b busy calls @c pri_sched() over and over, as @c main.py used to
+    - @b wfi uses @c run_forever() with the default @c cotask.wfi_idle(),
+      sleeping until the next 1 ms system tick when nothing is due soon
+    - @b timer uses @c run_forever() with an idle function which sleeps
+      exactly until the next task is due, as a wake-up timer would
+
+    For each loop the benchmark prints the scheduler wakeups per second of
+    simulated time, the average and maximum lateness of the tasks taken from
+    their profiles (@c _late_sum and @c _latest), and the number of task
+    runs.
+
+    Usage: @c python bench_idle.py [seconds]
+'''
+
+import sys
+
+import simhal
+
+## Simulated time in seconds for which each loop is run by default
+_SECONDS = 10
+
+## Simulated time in microseconds taken by one scheduler pass
+_PASS_US = 20
+
+## Simulated time in microseconds taken by one run of a task
+_RUN_US = 150
+
+
+class _Done(Exception):
+    '''!Raised to stop @c run_forever() when the simulated time is up.
+    '''
+
+
+def _make_task_fun(clock):
+    '''!Makes a task function whose runs take a fixed amount of simulated
+        time.
+        @param clock    The simulated clock
+        @return         A generator function to be used by a task
+    '''
+    def task_fun():
+        while True:
+            clock.now += _RUN_US
+            yield 0
+    return task_fun
+
+
+def _run(mode, seconds):
+    '''!Runs the @c main.py task set in simulated time with one kind of loop.
+        @param mode     One of @c 'busy', @c 'wfi' or @c 'timer'
+        @param seconds  The simulated time for which to run
+        @return         A tuple (wakeups per second, average lateness in ms,
+                        maximum lateness in ms, total task runs)
+    '''
+    clock = simhal.Clock()
+    simhal.install(clock)
+    import cotask
+    task_list = cotask.TaskList()
+    task_fun = _make_task_fun(clock)
+    tasks = [cotask.Task(task_fun, name='Encoder_1', priority=2, period=10,
+                         profile=True),
+             cotask.Task(task_fun, name='Controller_1', priority=1,
+                         period=300, profile=True),
+             cotask.Task(task_fun, name='Encoder_2', priority=2, period=10,
+                         profile=True),
+             cotask.Task(task_fun, name='Controller_2', priority=1,
+                         period=300, profile=True),
+             cotask.Task(task_fun, name='Data', priority=0, period=10,
+                         profile=True)]
+    for task in tasks:
+        task_list.append(task)
+
+    end = seconds * 1000000
+    passes = 0
+
+    def sched():
+        nonlocal passes
+        if clock.now >= end:
+            raise _Done
+        passes += 1
+        clock.now += _PASS_US
+        return task_list.pri_sched()
+
+    def timer_idle(wait_us):
+        clock.now += wait_us
+
+    try:
+        if mode == 'busy':
+            while True:
+                sched()
+        elif mode == 'wfi':
+            task_list.run_forever(sched)
+        else:
+            task_list.run_forever(sched, timer_idle)
+    except _Done:
+        pass
+
+    runs = sum(task._runs for task in tasks)
+    late_sum = sum(task._late_sum for task in tasks)
+    latest = max(task._latest for task in tasks)
+    return (passes / seconds, late_sum / runs / 1000.0, latest / 1000.0,
+            runs)
+
+
+if __name__ == '__main__':
+    _seconds = int(sys.argv[1]) if len(sys.argv) > 1 else _SECONDS
+
+    print(f'{_seconds} s simulated, {_PASS_US} us per pass, '
+          f'{_RUN_US} us per task run')
+    print(f'{"LOOP":>6s} {"WAKEUPS/S":>10s} {"AVG LATE":>9s} '
+          f'{"MAX LATE":>9s} {"RUNS":>6s}')
+    for _mode in ('busy', 'wfi', 'timer'):
+        _wakeups, _avg_late, _max_late, _runs = _run(_mode, _seconds)
+        print(f'{_mode:>6s} {_wakeups:10.0f} {_avg_late:9.3f} '
+              f'{_max_late:9.3f} {_runs:6d}')
@@ -0,0 +1,411 @@
+'''!@file       bench_overhead.py
+    Micro-benchmarks of the overhead of the scheduler in @c cotask.py and
+    the queues and shares in @c task_share.py, which run both on the PC and
+    on the Nucleo.
+
+    Each benchmark times many calls of one operation and reports the time
+    per call in nanoseconds, less the time taken by an empty loop of the same
+    length:
+    - @c Task.ready() and @c Task.schedule() of a single task
+    - one pass of each @c TaskList scheduler which finds no task ready, for
+      several numbers of tasks and numbers of different priorities
+    - @c Queue.put() and @c Queue.get() with item types @c 'B', @c 'i' and
+      @c 'f', with interrupts turned off around each transfer and without,
+      and the same for @c task_share.SPSCQueue
+    - @c Share.put() and @c Share.get(), protected and not
+
+    On the PC the MicroPython modules are replaced by the stand-ins in
+    @c simhal.py and times are measured with @c time.perf_counter_ns(), so
+    the results show the cost of the Python code, not of the Nucleo; on the
+    Nucleo, @c utime.ticks_us() is used. The results can be saved as a JSON
+    baseline and later runs compared with it, to catch changes which make
+    the scheduler or the shares slower:
+    @code
+    python bench_overhead.py --save baseline.json
+    ...
+    python bench_overhead.py --compare baseline.json --tolerance 0.2
+    @endcode
+    Each benchmark is timed several times; the fastest time is the result
+    and the gap between the fastest and the median time is saved with it as
+    a measure of how noisy it is. When comparing, each result more than the
+    tolerance slower than the baseline, plus the noise of both runs, is
+    timed again, as a run may be slowed down as a whole by another program;
+    if it's still too slow it's marked as a regression and the program
+    exits with status 1. Results
+    are only compared with a baseline measured with the same number of
+    calls by the same implementation of Python, as others aren't alike.
+    Quick runs, with @c --quick, can be printed or saved but not compared:
+    they time so few calls that the spread between their tries is too
+    wide for a regression to be told apart from noise.
+    On the Nucleo, @c run() is called with the same options, for example
+    @c bench_overhead.run(save='baseline.json').
+
+    Usage: @c python bench_overhead.py [--save FILE] [--compare FILE]
+           [--tolerance FRACTION] [--quick]
+'''
+
+import array
+import gc
+import json
+import sys
+
+try:
+    import pyb
+    import utime
+
+    def _time_ns(fun, count):
+        start = utime.ticks_us()
+        fun(count)
+        return utime.ticks_diff(utime.ticks_us(), start)*1000
+except ImportError:
+    import time
+    import simhal
+    simhal.install()
+
+    def _time_ns(fun, count):
+        start = time.perf_counter_ns()
+        fun(count)
+        return time.perf_counter_ns() - start
+
+import cotask
+import task_share
+
+## Number of calls timed for each benchmark by default
+_CALLS = 20000
+
+## The fewest calls for each benchmark whose results may be compared with
+#  a baseline
+_MIN_COMPARE_CALLS = _CALLS
+
+## Number of times each benchmark is timed, of which the fastest is kept
+_REPEATS = 5
+
+## The fraction by which a result may be slower than its baseline, beyond
+#  the noise in both, before it's a regression
+_TOLERANCE = 0.25
+
+## Number of times the benchmarks are run again when comparing, if some
+#  results look like regressions, to see if they were only held up
+_RETRIES = 2
+
+## Numbers of tasks in the task lists whose scheduler passes are timed
+_TASK_COUNTS = (1, 5, 20, 50)
+
+## Numbers of different priorities given to the tasks, where no more than
+#  the number of tasks; @c event_sched() allows no more than 30
+_SPREADS = (1, 4, 16)
+
+## The schedulers whose passes are timed
+_SCHEDULERS = ('pri_sched', 'rr_sched', 'deadline_sched', 'event_sched')
+
+## The item types of the queues and shares which are timed
+_TYPE_CODES = ('B', 'i', 'f')
+
+## The number of items in each queue; puts and gets are timed in blocks of
+#  this many so that the queue never fills or empties
+_QUEUE_SIZE = 100
+
+## The period in ms of the benchmark's tasks, long enough that none comes
+#  due while it runs, so that the scheduler passes find nothing to do
+_PERIOD = 60000
+
+
+def _task_fun():
+    '''!A task which does nothing.
+    '''
+    while True:
+        yield 0
+
+
+def _empty(count):
+    '''!Runs an empty loop, whose time is taken from the others.
+    '''
+    for _ in range(count):
+        pass
+
+
+def _measure(results, noise, key, fun, count, per=1):
+    '''!Times a function which performs an operation @c count times. The
+        fastest of @c _REPEATS tries is taken, as the slower ones have been
+        held up by something else, such as an interrupt or another program;
+        how much slower the median try is shows how noisy the timing is.
+        @param results  The dictionary of results in which to put the time
+        @param noise    The dictionary in which to put the noise
+        @param key      The name of the benchmark
+        @param fun      A function taking the number of times to perform it
+        @param count    The number of times
+        @param per      The number of operations performed each time
+    '''
+    # Run once untimed first, so that caches and the like are warmed up
+    fun(count)
+    loop = None
+    times = []
+    for _ in range(_REPEATS):
+        gc.collect()
+        elapsed = _time_ns(_empty, count)
+        if loop is None or elapsed < loop:
+            loop = elapsed
+        gc.collect()
+        times.append(_time_ns(fun, count))
+    times.sort()
+    results[key] = max(times[0] - loop, 0) / count / per
+    noise[key] = (times[len(times) // 2] - times[0]) / count / per
+
+
+def _bench_task(results, noise, calls):
+    '''!Times @c Task.ready() and @c Task.schedule() of tasks which aren't
+        ready.
+    '''
+    task_list = cotask.TaskList()
+    timed = cotask.Task(_task_fun, name='Timed', priority=1, period=_PERIOD)
+    untimed = cotask.Task(_task_fun, name='Untimed', priority=1)
+    task_list.append(timed)
+    task_list.append(untimed)
+    for name, task in (('timed', timed), ('untimed', untimed)):
+        ready = task.ready
+        schedule = task.schedule
+
+        def call_ready(count):
+            for _ in range(count):
+                ready()
+
+        def call_schedule(count):
+            for _ in range(count):
+                schedule()
+
+        _measure(results, noise, 'task.ready/' + name, call_ready, calls)
+        _measure(results, noise, 'task.schedule/' + name, call_schedule,
+                 calls)
+
+
+def _bench_sched(results, noise, calls):
+    '''!Times scheduler passes which find no task ready, for each number of
+        tasks and of priorities.
+    '''
+    for num_tasks in _TASK_COUNTS:
+        for spread in _SPREADS:
+            if spread > num_tasks:
+                continue
+            for sched_name in _SCHEDULERS:
+                task_list = cotask.TaskList()
+                for num in range(num_tasks):
+                    task_list.append(cotask.Task(
+                        _task_fun, name='T' + str(num),
+                        priority=num % spread, period=_PERIOD))
+                sched = getattr(task_list, sched_name)
+
+                def call_sched(count):
+                    for _ in range(count):
+                        sched()
+
+                key = '{:s}/tasks={:d}/spread={:d}'.format(sched_name,
+                                                           num_tasks, spread)
+                _measure(results, noise, key, call_sched,
+                         max(calls // num_tasks, 100))
+
+
+def _bench_queue(results, noise, calls):
+    '''!Times putting items into queues and getting them out, one at a time
+        and, as @c put_many() and @c get_many() do, in blocks.
+    '''
+    blocks = max(calls // _QUEUE_SIZE, 1)
+    for type_code in _TYPE_CODES:
+        for kind in ('protected', 'unprotected', 'spsc'):
+            if kind == 'spsc':
+                queue = task_share.SPSCQueue(type_code, _QUEUE_SIZE)
+            else:
+                queue = task_share.Queue(type_code, _QUEUE_SIZE,
+                                         thread_protect=kind == 'protected')
+            put = queue.put
+            get = queue.get
+            item = 1.5 if type_code == 'f' else 100
+            buf = array.array(type_code, [item]*_QUEUE_SIZE)
+
+            def put_get(count):
+                for _ in range(count // _QUEUE_SIZE):
+                    for _ in range(_QUEUE_SIZE):
+                        put(item)
+                    for _ in range(_QUEUE_SIZE):
+                        get()
+
+            def put_get_many(count):
+                for _ in range(count):
+                    queue.put_many(buf)
+                    queue.get_many(buf)
+
+            key = 'queue/{:s}/{:s}'.format(type_code, kind)
+            _measure(results, noise, key + '/put+get', put_get,
+                     blocks*_QUEUE_SIZE)
+            _measure(results, noise, key + '/many_per_item', put_get_many,
+                     blocks, _QUEUE_SIZE)
+
+
+def _bench_share(results, noise, calls):
+    '''!Times putting values into shares and getting them out.
+    '''
+    for type_code in _TYPE_CODES:
+        for protect in (True, False):
+            share = task_share.Share(type_code, thread_protect=protect)
+            put = share.put
+            get = share.get
+            item = 1.5 if type_code == 'f' else 100
+
+            def call_put(count):
+                for _ in range(count):
+                    put(item)
+
+            def call_get(count):
+                for _ in range(count):
+                    get()
+
+            key = 'share/{:s}/{:s}'.format(
+                type_code, 'protected' if protect else 'unprotected')
+            _measure(results, noise, key + '/put', call_put, calls)
+            _measure(results, noise, key + '/get', call_get, calls)
+
+
+def measure(calls=_CALLS, noise=None):
+    '''!Runs every benchmark.
+        @param calls    The number of calls timed for each benchmark
+        @param noise    A dictionary in which to put the noise of each
+                        benchmark, in nanoseconds per call, or @c None
+        @return         A dictionary of nanoseconds per call by benchmark name
+    '''
+    results = {}
+    noise = noise if noise is not None else {}
+    _bench_task(results, noise, calls)
+    _bench_sched(results, noise, calls)
+    _bench_queue(results, noise, calls)
+    _bench_share(results, noise, calls)
+    return results
+
+
+def _limit(name, base, tolerance, noise, base_noise):
+    '''!Finds the slowest a result may be before it's a regression.
+        @return     The limit in nanoseconds per call
+    '''
+    return base*(1.0 + tolerance) + (noise or {}).get(name, 0.0) \
+        + (base_noise or {}).get(name, 0.0)
+
+
+def compare(results, baseline, tolerance=_TOLERANCE, noise=None,
+            base_noise=None):
+    '''!Prints each result beside its baseline and marks the regressions.
+        @param results      A dictionary of results from @c measure()
+        @param baseline     A dictionary of baseline results
+        @param tolerance    The fraction by which a result may be slower than
+                            its baseline, beyond the noise, before it's a
+                            regression
+        @param noise        A dictionary of the results' noise, or @c None
+        @param base_noise   A dictionary of the baseline's noise, or @c None
+        @return             The number of regressions
+    '''
+    regressions = 0
+    print('{:<40s} {:>10s} {:>10s} {:>7s}'.format('BENCHMARK', 'BASE NS',
+                                                  'NS', 'RATIO'))
+    for name in sorted(results):
+        value = results[name]
+        base = baseline.get(name)
+        if base is None:
+            print('{:<40s} {:>10s} {:10.1f}'.format(name, '-', value))
+            continue
+        ratio = value / base if base > 0 else 1.0
+        flag = ''
+        if value > _limit(name, base, tolerance, noise, base_noise):
+            flag = ' REGRESSION'
+            regressions += 1
+        print('{:<40s} {:10.1f} {:10.1f} {:7.2f}{:s}'.format(
+            name, base, value, ratio, flag))
+    return regressions
+
+
+def run(save=None, compare_with=None, tolerance=_TOLERANCE, calls=_CALLS):
+    '''!Runs the benchmarks and prints, saves or compares the results.
+        @param save         A file to write the results to as a JSON
+                            baseline, or @c None
+        @param compare_with A baseline file to compare the results with, or
+                            @c None to just print them
+        @param tolerance    The fraction by which a result may be slower than
+                            its baseline, beyond the noise, before it's a
+                            regression
+        @param calls        The number of calls timed for each benchmark
+        @return             The number of regressions
+    '''
+    # Check the baseline before spending time on the benchmarks
+    baseline = None
+    if compare_with is not None:
+        with open(compare_with) as file:
+            baseline = json.load(file)
+        if baseline.get('implementation') != sys.implementation.name:
+            raise ValueError('Baseline is from {:s}, not {:s}'.format(
+                str(baseline.get('implementation')), sys.implementation.name))
+        if calls < _MIN_COMPARE_CALLS:
+            raise ValueError('Runs of fewer than {:d} calls are too noisy to '
+                             'compare'.format(_MIN_COMPARE_CALLS))
+        if baseline.get('calls') != calls:
+            raise ValueError('Baseline was measured with {:s} calls, not '
+                             '{:d}'.format(str(baseline.get('calls')), calls))
+
+    noise = {}
+    results = measure(calls, noise)
+    regressions = 0
+    if baseline is not None:
+        # Time everything again while anything looks too slow, keeping the
+        # fastest result of each benchmark
+        for _ in range(_RETRIES):
+            if not any(results[name] > _limit(name, base, tolerance, noise,
+                                              baseline.get('noise'))
+                       for name, base in baseline['results'].items()
+                       if name in results):
+                break
+            again_noise = {}
+            again = measure(calls, again_noise)
+            for name, value in again.items():
+                if value < results[name]:
+                    results[name] = value
+                    noise[name] = again_noise[name]
+
+        print('Baseline from {:s} {:s}'.format(baseline['implementation'],
+                                               baseline['platform']))
+        regressions = compare(results, baseline['results'], tolerance, noise,
+                              baseline.get('noise'))
+        print('{:d} regressions'.format(regressions))
+    else:
+        print('{:<40s} {:>10s}'.format('BENCHMARK', 'NS'))
+        for name in sorted(results):
+            print('{:<40s} {:10.1f}'.format(name, results[name]))
+
+    if save is not None:
+        with open(save, 'w') as file:
+            json.dump({'implementation': sys.implementation.name,
+                       'platform': sys.platform, 'calls': calls,
+                       'results': results, 'noise': noise}, file)
+    return regressions
+
+
+if __name__ == '__main__':
+    # Options are read by hand, as MicroPython doesn't have argparse
+    _args = sys.argv[1:]
+    _options = {'save': None, 'compare_with': None,
+                'tolerance': _TOLERANCE, 'calls': _CALLS}
+    while _args:
+        _arg = _args.pop(0)
+        if _arg == '--save':
+            _options['save'] = _args.pop(0)
+        elif _arg == '--compare':
+            _options['compare_with'] = _args.pop(0)
+        elif _arg == '--tolerance':
+            _options['tolerance'] = float(_args.pop(0))
+        elif _arg == '--quick':
+            _options['calls'] = _CALLS // 10
+        else:
+            print('Usage: bench_overhead.py [--save FILE] [--compare FILE] '
+                  '[--tolerance FRACTION] [--quick]')
+            sys.exit(2)
+    try:
+        _regressions = run(**_options)
+    except ValueError as err:
+        print(err)
+        sys.exit(2)
+    if _regressions:
+        sys.exit(1)
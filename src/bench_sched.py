@@ -0,0 +1,91 @@
+'''!@file       bench_sched.py
+    A benchmark, run on the PC, which compares the cost of the priority
+    scheduler @c cotask.TaskList.pri_sched() with that of the deadline
+    scheduler @c cotask.TaskList.deadline_sched().
+
+    The MicroPython modules are replaced by the stand-ins in @c simhal.py so
+    that @c cotask.py can be imported by CPython. The simulated clock only
+    moves when the benchmark moves it, by a fixed amount per scheduler pass,
+    so both schedulers see exactly the same sequence of times, and it counts
+    how many times it is read. For each number of tasks the benchmark prints
+    the number of clock reads per scheduler pass, the PC time per pass, and
+    the number of task runs so one can check that both schedulers did the
+    same work.
+
+    Usage: @c python bench_sched.py [passes]
+'''
+
+import sys
+import time
+
+import simhal
+
+## Number of scheduler passes run for each configuration by default
+_PASSES = 20000
+
+## Simulated time in microseconds which goes by during each scheduler pass
+_PASS_US = 20
+
+## Numbers of tasks for which the schedulers are compared
+_TASK_COUNTS = (5, 50, 500)
+
+## A time just before the tick counters wrap around, at which runs start
+_START_US = simhal.TICKS_PERIOD - 100000
+
+
+## The number of task runs, counted by the tasks themselves
+_run_count = 0
+
+
+def _idle_task_fun():
+    '''!A task which does nothing but count its runs and yield.
+    '''
+    global _run_count
+    while True:
+        _run_count += 1
+        yield 0
+
+
+def _run(num_tasks, sched_name, passes):
+    '''!Runs one scheduler on a set of tasks for a number of passes.
+        @param num_tasks    The number of periodic tasks to create
+        @param sched_name   The name of the @c TaskList scheduler method
+        @param passes       The number of scheduler passes to run
+        @return             A tuple (clock reads per pass, PC microseconds per
+                            pass, total task runs)
+    '''
+    global _run_count
+
+    # Start near the wraparound point so that it's crossed during the run
+    clock = simhal.Clock(_START_US)
+    simhal.install(clock)
+    import cotask
+    task_list = cotask.TaskList()
+    for num in range(num_tasks):
+        task_list.append(cotask.Task(_idle_task_fun, name='T' + str(num),
+                                     priority=num % 4,
+                                     period=10 + (num % 50) * 10))
+
+    sched = getattr(task_list, sched_name)
+    clock.reads = 0
+    _run_count = 0
+    start = time.perf_counter()
+    for _ in range(passes):
+        sched()
+        clock.now += _PASS_US
+    elapsed = time.perf_counter() - start
+
+    return (clock.reads / passes, elapsed * 1e6 / passes, _run_count)
+
+
+if __name__ == '__main__':
+    _passes = int(sys.argv[1]) if len(sys.argv) > 1 else _PASSES
+
+    print(f'{_passes} passes, {_PASS_US} us of simulated time per pass')
+    print(f'{"TASKS":>6s} {"SCHEDULER":>15s} {"READS/PASS":>11s} '
+          f'{"US/PASS":>9s} {"RUNS":>7s}')
+    for _count in _TASK_COUNTS:
+        for _name in ('pri_sched', 'deadline_sched'):
+            _reads, _us, _runs = _run(_count, _name, _passes)
+            print(f'{_count:6d} {_name:>15s} {_reads:11.2f} '
+                  f'{_us:9.2f} {_runs:7d}')
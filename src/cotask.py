@@ -16,11 +16,314 @@ chosen scheduling algorithm such as round-robin or highest-priority-first.
            under the GNU Public License, version 3.0. 
 """
 
-import gc                              # Memory allocation garbage collector
+import array                           # Fixed size arrays for histograms
 import utime                           # Micropython version of time library
+import machine                         # Used to wait for interrupts when idle
 import micropython                     # This shuts up incorrect warnings
+import timeline                        # Records when tasks run, if wanted
 
 
+class Histogram:
+    """!
+    Counts how often times of different lengths occur, in a fixed amount of
+    memory.
+
+    Times in microseconds are counted in buckets whose widths grow with the
+    times they hold. Times below 8 us each have their own bucket; above that,
+    each doubling of time is split into four buckets, so a time is known to
+    within about a quarter of its size whether it's a few microseconds or a
+    few minutes. Adding a time takes a few shifts and one array write and
+    doesn't allocate memory, so it can be done in the scheduler each time a
+    task runs.
+
+    @code
+    hist = cotask.Histogram ()
+    hist.add (120)
+    hist.add (5000)
+    print (hist.percentile (99))
+    @endcode
+    """
+
+    ## The number of buckets, enough for times up to 2**30 microseconds
+    BUCKETS = 120
+
+
+    def __init__ (self):
+        """!
+        Create a histogram in which no times have been counted.
+        """
+        ## The number of times counted in each bucket, as 32 bit unsigned
+        #  integers on both the board and a PC, where 'L' may be 64 bits
+        self.counts = array.array ('I', [0] * Histogram.BUCKETS)
+
+        ## The total number of times counted
+        self.count = 0
+
+
+    @micropython.native
+    def add (self, time_us):
+        """!
+        Count one time.
+        @param time_us The time in microseconds; negative times count as zero
+        """
+        idx = 0
+        if time_us < 0:
+            time_us = 0
+        while time_us >= 8:
+            time_us >>= 1
+            idx += 4
+        idx += time_us
+        if idx >= Histogram.BUCKETS:
+            idx = Histogram.BUCKETS - 1
+        self.counts[idx] += 1
+        self.count += 1
+
+
+    @staticmethod
+    def bounds (idx):
+        """!
+        Find the range of times counted in a bucket.
+        @param idx The index of the bucket
+        @return A tuple holding the shortest time in the bucket and the
+                shortest time which is too long for it, in microseconds
+        """
+        if idx < 8:
+            return (idx, idx + 1)
+        shift = (idx - 4) // 4
+        mantissa = idx - 4 * shift
+        return (mantissa << shift, (mantissa + 1) << shift)
+
+
+    def percentile (self, pct):
+        """!
+        Find a time which a given percentage of the counted times don't
+        exceed. The answer is the top of the bucket holding that time, so it
+        may be up to a quarter too long but is never too short.
+        @param pct The percentage, such as 50 for the median or 99.9
+        @return The time in microseconds, or zero if nothing has been counted
+        """
+        if self.count == 0:
+            return 0
+        target = self.count * pct / 100.0
+        total = 0
+        for idx in range (Histogram.BUCKETS):
+            total += self.counts[idx]
+            if total >= target and total > 0:
+                return Histogram.bounds (idx)[1] - 1
+        return Histogram.bounds (Histogram.BUCKETS - 1)[1] - 1
+
+
+    def clear (self):
+        """!
+        Forget all the times which have been counted.
+        """
+        for idx in range (Histogram.BUCKETS):
+            self.counts[idx] = 0
+        self.count = 0
+
+
+# =============================================================================
+
+class Wait:
+    """!
+    Something a task can wait for by yielding it, such as data arriving in a
+    queue or some time passing.
+
+    A task's generator normally yields its state. If it yields a @c Wait
+    object instead, the task is parked: it isn't run again until the wait
+    object is woken by a call to @c wake(), as a queue does when data is put
+    into it, or until the wait's timeout, if it has one, runs out. While it's
+    parked, a task's go flag isn't set and it isn't posted, so it costs the
+    schedulers nothing. Only tasks with no period can wait. When the task is
+    resumed it should check why, such as by seeing if its queue has data,
+    as a timeout or a call to its @c go() method also resume it.
+
+    Tasks don't usually make wait objects; queues and shares make them in
+    @c task_share.Queue.wait_data() and @c task_share.Share.wait_change(),
+    and @c sleep_ms() makes one which only times out:
+    @code
+    def consumer_fun ():
+        while True:
+            while my_queue.any ():
+                do_something_with (my_queue.get ())
+            yield my_queue.wait_data ()
+    @endcode
+    """
+
+    def __init__ (self, check = None, timeout_ms = None):
+        """!
+        Create a wait object which no tasks are waiting for.
+        @param check A function which returns @c True if what's being waited
+               for has already happened, in which case a task which yields
+               this object isn't parked; @c None if there's nothing to check
+        @param timeout_ms The time in milliseconds after which a waiting task
+               is resumed even if the wait hasn't been woken, or @c None to
+               wait for as long as it takes
+        """
+        self._check = check
+
+        ## The timeout in microseconds given to tasks which are parked next,
+        #  or @c None for no timeout
+        self.timeout_us = int (timeout_ms * 1000) if timeout_ms != None \
+            else None
+
+        # The parked tasks, in the first _num places of the list. The list
+        # doesn't shrink, so waking tasks doesn't allocate memory
+        self._waiters = []
+        self._num = 0
+
+
+    def _park (self, task):
+        """!
+        Park a task which has yielded this object, unless what it's waiting
+        for has already happened.
+        @param task The task which yielded this object
+        """
+        if task.period != None:
+            raise ValueError ('Task ' + task.name + ' has a period, so it '
+                              'can\'t wait')
+
+        if not self._add_waiter (task):
+            task.go ()
+            return
+
+        if self.timeout_us != None:
+            if task._task_list is None:
+                raise ValueError ('Task ' + task.name + ' must be in a task '
+                                  'list to wait with a timeout')
+            task._task_list._add_sleeper (task, utime.ticks_add (
+                utime.ticks_us (), self.timeout_us))
+
+
+    def _add_waiter (self, task):
+        """!
+        Add a task to those which are woken by @c wake(), unless what it's
+        waiting for has already happened. Anything with a @c go() method and
+        a @c _wait attribute may wait this way, which lets code other than
+        tasks, such as @c aiotask.py on the PC, be woken too.
+        @param task The task, or other object, which is to wait
+        @return @c True if it's waiting, @c False if there was no need to
+        """
+        # Check and park with interrupts off, so an ISR can't wake this
+        # object between finding nothing to wait for and parking the task
+        irq_state = machine.disable_irq ()
+        if self._check is not None and self._check ():
+            machine.enable_irq (irq_state)
+            return False
+        task._wait = self
+        for idx in range (self._num):
+            if self._waiters[idx] is task:
+                break
+        else:
+            if self._num < len (self._waiters):
+                self._waiters[self._num] = task
+            else:
+                self._waiters.append (task)
+            self._num += 1
+        machine.enable_irq (irq_state)
+        return True
+
+
+    @micropython.native
+    def wake (self):
+        """!
+        Resume every task which is waiting for this object. This may be
+        called from an interrupt service routine, and doesn't allocate memory.
+        """
+        if self._num == 0:
+            return
+        irq_state = machine.disable_irq ()
+        for idx in range (self._num):
+            task = self._waiters[idx]
+            if task._wait is self:
+                task._wait = None
+                task.go ()
+        self._num = 0
+        machine.enable_irq (irq_state)
+
+
+class SingleWait (Wait):
+    """!
+    A wait object for which at most one task waits at a time, such as the
+    consumer of a queue with one consumer. Parking the task and waking it
+    don't disable interrupts: the task is marked as waiting before the check
+    is made, and a waker looks at the mark after doing whatever it's waking
+    the task for, so if an ISR wakes this object between the two either the
+    check sees what the ISR did or the ISR sees the waiting task. Resuming a
+    task which is waiting calls its @c go() method, which under
+    @c TaskList.event_sched() still posts it with interrupts off.
+    """
+
+    def __init__ (self, check = None, timeout_ms = None):
+        """!
+        Create a wait object which no task is waiting for.
+        @param check A function which returns @c True if what's being waited
+               for has already happened; @c None if there's nothing to check
+        @param timeout_ms The time in milliseconds after which the waiting
+               task is resumed even if the wait hasn't been woken, or
+               @c None to wait for as long as it takes
+        """
+        super ().__init__ (check, timeout_ms)
+        self._waiter = None
+
+
+    def _add_waiter (self, task):
+        """!
+        Make a task the one which is woken by @c wake(), unless what it's
+        waiting for has already happened.
+        @param task The task, or other object, which is to wait
+        @return @c True if it's waiting, @c False if there was no need to
+        """
+        task._wait = self
+        self._waiter = task
+        if self._check is not None and self._check ():
+            task._wait = None
+            return False
+        return True
+
+
+    @micropython.native
+    def wake (self):
+        """!
+        Resume the task which is waiting for this object, if there is one.
+        This may be called from an interrupt service routine, and doesn't
+        allocate memory.
+        """
+        task = self._waiter
+        if task is not None and task._wait is self:
+            task._wait = None
+            task.go ()
+
+
+## The wait objects returned by sleep_ms(), by delay
+_sleep_waits = {}
+
+
+def sleep_ms (delay):
+    """!
+    Get a wait object which a task with no period can yield to be resumed
+    after a given time, without being run in the meantime. Nothing wakes it
+    but its timeout, which is kept for each task, so the same object is
+    returned every time for the same delay and sleeping doesn't allocate
+    memory once it's been made.
+    @code
+    def blink_fun ():
+        while True:
+            led.toggle ()
+            yield cotask.sleep_ms (500)
+    @endcode
+    @param delay The time to wait in milliseconds
+    @return A wait object to be yielded
+    """
+    wait = _sleep_waits.get (delay)
+    if wait is None:
+        wait = Wait (timeout_ms = delay)
+        _sleep_waits[delay] = wait
+    return wait
+
+
+# =============================================================================
+
 class Task:
     """!
     Implements multitasking with scheduling and some performance logging.
@@ -58,7 +361,9 @@ class Task:
 
 
     def __init__ (self, run_fun, name = "NoName", priority = 0, 
-                  period = None, profile = False, trace = False):
+                  period = None, profile = False, trace = False,
+                  wcet = None, trace_size = 100, deadline = None,
+                  overrun = None, catch_up_limit = 1):
         """!
         Initialize a task object so it may be run by the scheduler.
 
@@ -76,8 +381,28 @@ class Task:
                The time can be given in a @c float or @c int; it will be 
                converted to microseconds for internal use by the scheduler.
         @param profile Set to @c True to enable run-time profiling 
-        @param trace Set to @c True to generate a list of transitions between
-               states. @b Note: This slows things down and allocates memory.
+        @param trace Set to @c True to record transitions between states.
+               The most recent @c trace_size transitions are kept in a ring
+               buffer made here, so tracing can be left on without using up
+               memory.
+        @param wcet The longest time in milliseconds which one run of the task
+               is expected to take, used for schedulability analysis before
+               the task has been profiled; @c None if not known
+        @param trace_size The number of state transitions which are kept when
+               tracing; older ones are overwritten by newer ones
+        @param deadline The time in milliseconds after each release by which
+               a run of a timed task should have finished; by default its
+               period. Runs which finish later are counted as misses.
+        @param overrun What to do when a timed task falls a whole period or
+               more behind, so that releases which should already have
+               happened are missed: @c None to run the task again for each
+               one as soon as possible, as before; @c 'skip' to drop them all
+               and carry on from the next release time; @c 'catch_up' to run
+               at most @c catch_up_limit of them and drop the rest; or a
+               function which is called with the task and the number of
+               missed releases and returns how many of them to drop
+        @param catch_up_limit The largest number of missed releases which are
+               made up for with the @c 'catch_up' policy
         """
         # The function which is run to implement this task's code. Since it 
         # is a generator, we "run" it here, which doesn't actually run it but
@@ -103,6 +428,33 @@ class Task:
             self.period = period
             self._next_run = None
 
+        ## The expected worst case execution time of one run of the task in
+        #  microseconds, or @c None if it isn't known. The longest profiled
+        #  run time is used instead if that is longer.
+        self.wcet = int (wcet * 1000) if wcet != None else None
+
+        ## The time in microseconds after each release by which a run of the
+        #  task should finish, or @c None for a task with no period
+        if deadline != None:
+            self.deadline = int (deadline * 1000)
+        else:
+            self.deadline = self.period
+
+        ## What to do when releases are missed; see the constructor
+        if overrun not in (None, 'skip', 'catch_up') and not callable (overrun):
+            raise ValueError ('Unknown overrun policy ' + str (overrun))
+        self.overrun = overrun
+
+        ## The largest number of missed releases made up for by @c 'catch_up'
+        self.catch_up_limit = catch_up_limit
+
+        # The release time of the oldest release which hasn't been run yet,
+        # from which that run's lateness and deadline are measured, and the
+        # number of releases waiting to be run. Pending releases are one
+        # period apart, so only the oldest one's time needs to be kept
+        self._release_time = self._next_run
+        self._pending = 0
+
         # Flag which causes the task to be profiled, in which the execution
         #  time of the @c run() method is measured and basic statistics kept. 
         self._prof = profile
@@ -112,12 +464,36 @@ class Task:
         # for and track state transitions.
         self._prev_state = 0
 
-        # If transition tracing has been enabled, create an empty list in 
-        # which to store transition (time, to-state) stamps
+        # If transition tracing has been enabled, create a ring buffer in
+        # which to store (time since last transition, to-state) stamps. Only
+        # the most recent transitions are kept. States are kept in a list, as
+        # a task may yield anything as its state
         self._trace = trace
-        self._tr_data = []
+        if trace:
+            self._tr_delta = array.array ('l', [0] * trace_size)
+            self._tr_state = [0] * trace_size
+        self._tr_size = trace_size
+        self._tr_idx = 0
+        self._tr_count = 0
         self._prev_time = utime.ticks_us ()
 
+        # The timeline in which this task's releases and runs are recorded,
+        # if any, and this task's number in it. These are set by the task list
+        self._timeline = None
+        self._tl_id = 0
+
+        # The task list to which go() posts this task, its priority level in
+        # that list's ready bitmap, and whether it's waiting there to be run.
+        # These are set by the task list
+        self._task_list = None
+        self._level = 0
+        self._posted = False
+
+        # The wait object for which the task is parked, if any, and the time
+        # at which a timeout will resume it, or None if it has no timeout
+        self._wait = None
+        self._wake_time = None
+
         ## Flag which is set true when the task is ready to be run by the
         #  scheduler
         self.go_flag = False
@@ -133,52 +509,102 @@ class Task:
         @return @c True if the task ran or @c False if it did not
         """
         if self.ready ():
-
-            # Reset the go flag for the next run
-            self.go_flag = False
-
-            # If profiling, save the start time
-            if self._prof:
-                stime = utime.ticks_us ()
-
-            # Run the method belonging to the state which should be run next
-            curr_state = next (self._run_gen)
-
-            # If profiling or tracing, save timing data
-            if self._prof or self._trace:
-                etime = utime.ticks_us ()
-
-            # If profiling, save timing data
-            if self._prof:
-                self._runs += 1
-                runt = utime.ticks_diff (etime, stime)
-                if self._runs > 2:
-                    self._run_sum += runt
-                    if runt > self._slowest:
-                        self._slowest = runt
-
-            # If transition logic tracing is on, record a transition; if not,
-            # ignore the state. If out of memory, switch tracing off and 
-            # run the memory allocation garbage collector
-            if self._trace:
-                try:
-                    if curr_state != self._prev_state:
-                        self._tr_data.append (
-                            (utime.ticks_diff (etime, self._prev_time),
-                             curr_state))
-                except MemoryError:
-                    self._trace = False
-                    gc.collect ()
-
-                self._prev_state = curr_state
-                self._prev_time = etime
-
+            self._run ()
             return True
 
         else:
             return False
 
 
+    def _run (self):
+        """!
+        Run the task's generator up to its next @c yield() and record
+        profiling and tracing data. The caller must already have decided that
+        the task is ready to run; this method doesn't check.
+        """
+        # Reset the go flag for the next run
+        self.go_flag = False
+
+        # If recording a timeline, log the start of this run
+        if self._timeline is not None:
+            self._timeline.record (self._tl_id, timeline.START,
+                                   utime.ticks_us ())
+
+        # A timed task may also be run by a call to go() with no release
+        # waiting; only a run for a release can be late or miss a deadline
+        released = self._pending > 0
+
+        # If profiling, save the start time, and for a run of a release
+        # record how long after the release it started
+        if self._prof:
+            stime = utime.ticks_us ()
+            if released:
+                late = utime.ticks_diff (stime, self._release_time)
+                self._late_sum += late
+                if late > self._latest:
+                    self._latest = late
+                self._late_hist.add (late)
+
+        # Run the method belonging to the state which should be run next
+        curr_state = next (self._run_gen)
+
+        # If the task yielded a wait object rather than a state, park it
+        # until the wait is over; its state hasn't changed
+        if isinstance (curr_state, Wait):
+            curr_state._park (self)
+            curr_state = self._prev_state
+
+        # If profiling, tracing or checking a deadline, save timing data
+        if self._prof or self._trace or self.period != None:
+            etime = utime.ticks_us ()
+
+        # Count a miss if a timed task finished after its release's deadline,
+        # then move on to the next pending release; if there is one, the
+        # task stays ready, and is posted again under event_sched(), so that
+        # it runs again
+        if released:
+            if utime.ticks_diff (etime, self._release_time) > self.deadline:
+                self._misses += 1
+            if self._pending > 1:
+                self._pending -= 1
+                self._release_time = utime.ticks_add (self._release_time,
+                                                      self.period)
+                self.go ()
+            else:
+                self._pending = 0
+
+        if self._timeline is not None:
+            self._timeline.record (self._tl_id, timeline.END,
+                                   utime.ticks_us ())
+
+        # If profiling, save timing data
+        if self._prof:
+            self._runs += 1
+            runt = utime.ticks_diff (etime, stime)
+            if self._runs > 2:
+                self._run_sum += runt
+                if runt > self._slowest:
+                    self._slowest = runt
+                self._dur_hist.add (runt)
+
+        # If transition logic tracing is on, record a transition in the ring
+        # buffer, overwriting the oldest one if it's full; if not, ignore the
+        # state. Nothing is allocated, so tracing can stay on
+        if self._trace:
+            if curr_state != self._prev_state:
+                idx = self._tr_idx
+                self._tr_delta[idx] = utime.ticks_diff (etime, self._prev_time)
+                self._tr_state[idx] = curr_state
+                idx += 1
+                if idx >= self._tr_size:
+                    idx = 0
+                self._tr_idx = idx
+                self._tr_count += 1
+                self._prev_time = etime
+
+            self._prev_state = curr_state
+
+
     @micropython.native
     def ready (self) -> bool:
         """!
@@ -188,25 +614,83 @@ class Task:
         go. This method may be overridden in descendent classes to implement
         some other behavior.
         """
-        # If this task uses a timer, check if it's time to run run() again. If
-        # so, set go flag and set the timer to go off at the next run time
+        # If this task uses a timer, check if it's time to run run() again
         if self.period != None:
-            late = utime.ticks_diff (utime.ticks_us (), self._next_run)
-            if late > 0:
-                self.go_flag = True
-                self._next_run = utime.ticks_diff (self.period, 
-                                                   -self._next_run)
-
-                # If keeping a latency profile, record the data
-                if self._prof:
-                    self._late_sum += late
-                    if late > self._latest:
-                        self._latest = late
+            self._release (utime.ticks_us ())
 
         # If the task doesn't use a timer, we rely on go_flag to signal ready
         return self.go_flag
 
 
+    @micropython.native
+    def _release (self, now):
+        """!
+        Release a timed task if its next run time has passed.
+        If the time @c now is later than the task's next run time, this
+        method sets the go flag, adds every release which has come due to
+        those waiting to be run and moves the next run time past them. It
+        lets a scheduler which has already read the clock check a task
+        without reading the clock again.
+
+        A release which comes due while an earlier one is still waiting to
+        be run is an overrun. Overruns are counted here, once each, and the
+        overrun policy decides how many of the waiting releases to drop,
+        oldest first; each of the rest is run in turn, and its lateness and
+        deadline are measured from its own release time.
+        @param now The current time from @c utime.ticks_us()
+        @return @c True if the task was released, @c False if not
+        """
+        late = utime.ticks_diff (now, self._next_run)
+        if late > 0:
+            due = (late - 1) // self.period + 1
+            if self._pending == 0:
+                self._release_time = self._next_run
+                missed = due - 1
+            else:
+                missed = due
+            self._pending += due
+            self._next_run = utime.ticks_add (self._next_run,
+                                              due * self.period)
+            self.go_flag = True
+
+            # If releases have piled up, count them and drop as many as the
+            # overrun policy says, rather than letting the task run back to
+            # back
+            if missed > 0:
+                self._overruns += missed
+                skip = self._missed_releases (self._pending - 1)
+                if skip > 0:
+                    self._skipped += skip
+                    self._pending -= skip
+                    self._release_time = utime.ticks_add (
+                        self._release_time, skip * self.period)
+
+            # If recording a timeline, log the release, noting if it's late
+            if self._timeline is not None:
+                self._timeline.record (self._tl_id, timeline.LATE
+                    if late > self._timeline.late_us else timeline.READY, now)
+            return True
+        return False
+
+
+    def _missed_releases (self, missed):
+        """!
+        Apply the overrun policy when a task has fallen behind.
+        @param missed The number of releases waiting to be run besides the
+               newest one
+        @return The number of those releases to drop, oldest first
+        """
+        if self.overrun == None:
+            return 0
+        if self.overrun == 'skip':
+            return missed
+        if self.overrun == 'catch_up':
+            return missed - self.catch_up_limit \
+                if missed > self.catch_up_limit else 0
+        skip = self.overrun (self, missed)
+        return min (int (skip), missed) if skip else 0
+
+
     def reset_profile (self):
         """!
         This method resets the variables used for execution time profiling.
@@ -217,28 +701,104 @@ class Task:
         self._slowest = 0
         self._late_sum = 0
         self._latest = 0
+        self._misses = 0
+        self._overruns = 0
+        self._skipped = 0
+
+        # Histograms of run durations and of how late runs start, which are
+        # made once and then cleared so that profiling doesn't allocate memory
+        if self._prof:
+            try:
+                self._dur_hist.clear ()
+                self._late_hist.clear ()
+            except AttributeError:
+                self._dur_hist = Histogram ()
+                self._late_hist = Histogram ()
+
+
+    def cost (self):
+        """!
+        Find the worst case execution time of one run of this task, for use
+        in schedulability analysis. This is the longer of the expected time
+        given as @c wcet to the constructor and the longest run time measured
+        by profiling.
+        @return The worst case execution time in microseconds, or zero if it
+                isn't known
+        """
+        cost = self._slowest
+        if self.wcet != None and self.wcet > cost:
+            cost = self.wcet
+        return cost
+
+
+    def stats (self):
+        """!
+        Collect the task's profile and deadline statistics in a form which a
+        program can use, such as to print as CSV or send to a PC. Times are
+        in microseconds; those which aren't known are @c None.
+        @return A dictionary of the task's statistics
+        """
+        runs = self._runs
+        stats = {'name': self.name, 'priority': self.priority,
+                 'period': self.period, 'deadline': self.deadline,
+                 'runs': runs, 'misses': self._misses,
+                 'overruns': self._overruns, 'skipped': self._skipped,
+                 'avg_dur': None, 'max_dur': None,
+                 'avg_late': None, 'max_late': None}
+        if self._prof and runs > 0:
+            stats['avg_dur'] = self._run_sum / runs
+            stats['max_dur'] = self._slowest
+            if self.period != None:
+                stats['avg_late'] = self._late_sum / runs
+                stats['max_late'] = self._latest
+        return stats
 
 
     def get_trace (self):
         """!
-        This method returns a string containing the task's transition trace.
-        The trace is a set of tuples, each of which contains a time and the
-        states from and to which the system transitioned. 
-        @return A possibly quite large string showing state transitions
+        This method returns a string containing the task's transition trace,
+        made from the lines given by @c iter_trace(). 
+        @return A string showing the recorded state transitions
         """
-        tr_str = 'Task ' + self.name + ':'
-        if self._trace:
-            tr_str += '\n'
-            last_state = 0
-            total_time = 0.0
-            for item in self._tr_data:
-                total_time += item[0] / 1000000.0
-                tr_str += '{: 12.6f}: {: 2d} -> {:d}\n'.format (total_time, 
-                    last_state, item[1])
-                last_state = item[1]
-        else:
-            tr_str += ' not traced'
-        return (tr_str)
+        return '\n'.join (self.iter_trace ())
+
+
+    def iter_trace (self):
+        """!
+        Generate lines of text showing the task's recorded state transitions,
+        oldest first, one line at a time so that a long trace can be printed
+        without making one big string. Each line shows the time in seconds
+        since the oldest recorded transition's previous one and the states
+        from and to which the task went. If older transitions have been
+        overwritten, the first line says how many, and the state before the
+        oldest one kept is shown as @c ?.
+        @return A generator which yields the lines of the trace
+        """
+        if not self._trace:
+            yield 'Task ' + self.name + ': not traced'
+            return
+
+        yield 'Task ' + self.name + ':'
+        count = self._tr_count
+        idx = 0
+        last_state = 0
+        if count > self._tr_size:
+            yield '  ({:d} older transitions overwritten)'.format (
+                count - self._tr_size)
+            idx = self._tr_idx
+            count = self._tr_size
+            last_state = None
+
+        total_time = 0.0
+        for num in range (count):
+            total_time += self._tr_delta[idx] / 1000000.0
+            state = self._tr_state[idx]
+            yield '{: 12.6f}: {:>2s} -> {:s}'.format (total_time, 
+                '?' if last_state is None else str (last_state), str (state))
+            last_state = state
+            idx += 1
+            if idx >= self._tr_size:
+                idx = 0
 
 
     def go (self):
@@ -246,8 +806,17 @@ class Task:
         Method to set a flag so that this task indicates that it's ready to run.
         This method may be called from an interrupt service routine or from
         another task which has data that this task needs to process soon.
+        If the task list is being run by @c TaskList.event_sched(), the task
+        is also posted to the list's ready queue so that the scheduler finds
+        it without looking at every task. A parked task stops waiting, and
+        its timeout, if any, is cancelled.
         """
         self.go_flag = True
+        self._wait = None
+        if self._task_list is not None:
+            if self._wake_time is not None:
+                self._task_list._remove_sleeper (self)
+            self._task_list.post (self)
 
 
     def __repr__ (self):
@@ -271,6 +840,24 @@ class Task:
             if self.period != None:
                 rst += '{: 10.3f}{: 10.3f}'.format (avg_late, 
                                             self._latest / 1000.0)
+            else:
+                rst += '         -         -'
+
+            # Percentiles of duration and lateness from the histograms;
+            # untimed tasks are never late, so they have no lateness
+            for pct in (50, 99, 99.9):
+                rst += '{: 8.3f}'.format (
+                    self._dur_hist.percentile (pct) / 1000.0)
+            if self.period != None:
+                for pct in (50, 99, 99.9):
+                    rst += '{: 8.3f}'.format (
+                        self._late_hist.percentile (pct) / 1000.0)
+            else:
+                rst += '       -       -       -'
+
+            if self.period != None:
+                rst += '{: 8d}{: 8d}{: 8d}'.format (self._misses,
+                    self._overruns, self._skipped)
         return rst
 
 
@@ -291,27 +878,102 @@ class TaskList:
     "round-robin" fashion.
     """
 
-    def __init__ (self):
+    def __init__ (self, admission = None):
         """!
         Initialize the task list. This creates the list of priorities in
         which tasks will be organized by priority.
+        @param admission What @c append() does with a task which would make
+               the task set unschedulable: @c None to add it without checking,
+               @c 'warn' to print a warning and add it anyway, or
+               @c 'refuse' to raise a @c ValueError and not add it
         """
+        ## What to do when a task which would make the task set unschedulable
+        #  is appended: @c None, @c 'warn' or @c 'refuse'
+        self.admission = admission
+
         ## The list of priority lists. Each priority for which at least one 
         #  task has been created has a list whose first element is a task 
         #  priority and whose other elements are references to task objects at
         #  that priority. 
         self.pri_list = []
 
+        # Timed tasks kept as a binary min-heap ordered by next run time, and
+        # tasks with no period, sorted by priority, which only run on go().
+        # These are only used by the deadline scheduler @c deadline_sched()
+        self._heap = []
+        self._untimed = []
+
+        # Timed tasks which have been released from the heap but not yet run
+        self._ready = []
+
+        # The cyclic executive's table of minor frames, each a tuple of the
+        # tasks which run in it, highest priority first; None until
+        # make_cyclic() has been called
+        self._frames = None
+        self._frame_idx = 0
+        self._frame_time = 0
+        self._minor_us = 0
+
+        # The ready bitmap and queues used by event_sched(). Bit n of the
+        # bitmap is set when a task at priority level n, counting down from
+        # the highest priority, has been posted; each level has a ring of
+        # posted tasks as long as the number of tasks at that level
+        self._ready_bits = 0
+        self._bit_level = {}
+        self._rings = []
+        self._heads = []
+        self._counts = []
+        self._event_mode = False
+
+        # Parked tasks with timeouts, soonest wake time first
+        self._sleepers = []
+
+        ## The number of minor frames which started more than one minor frame
+        #  late when run by @c cyclic_sched()
+        self.frame_overruns = 0
+
+        ## The timeline in which the scheduler records events, or @c None if
+        #  it isn't recording them; see @c record_timeline()
+        self.timeline = None
+
+        ## A function which @c post() calls with each task made ready by
+        #  @c Task.go(), under any scheduler, or @c None. It lets something
+        #  which runs the scheduler and idles between passes, such as
+        #  @c aiotask.Adapter on the PC, be woken as an interrupt wakes the
+        #  CPU. It may be called from an interrupt service routine
+        self.on_post = None
+
 
     def append (self, task):
         """!
         Append a task to the task list. The list will be sorted by task 
         priorities so that the scheduler can quickly find the highest priority
         task which is ready to run at any given time. 
+        If admission control has been turned on, the task set including the
+        new task is first checked with fixed priority response time analysis,
+        and a task which would cause deadlines to be missed is warned about
+        or refused.
         @param task The task to be appended to the list
         """
-        # See if there's a tasklist with the given priority in the main list
+        # The ready bitmap used by event_sched() has room for 30 priorities;
+        # check before anything is changed, so a refused task isn't left half
+        # added
         new_pri = task.priority
+        if self._event_mode and len (self.pri_list) >= 30 \
+                and new_pri not in [pri[0] for pri in self.pri_list]:
+            raise ValueError ('Too many different priorities for the ready '
+                              'bitmap')
+
+        if self.admission != None:
+            tasks = self.tasks ()
+            tasks.append (task)
+            if not self.schedulable (tasks = tasks):
+                msg = 'Task ' + task.name + ' makes task set unschedulable'
+                if self.admission == 'refuse':
+                    raise ValueError (msg)
+                print ('Warning: ' + msg)
+
+        # See if there's a tasklist with the given priority in the main list
         for pri in self.pri_list:
             # If a tasklist with this priority exists, add this task to it.
             if pri[0] == new_pri:
@@ -329,6 +991,202 @@ class TaskList:
         # Make sure the main list (of lists at each priority) is sorted
         self.pri_list.sort (key=lambda pri: pri[0], reverse=True)
 
+        if self.timeline is not None:
+            self._add_to_timeline (task)
+
+        # Keep the structures used by the deadline scheduler up to date
+        if task.period != None:
+            self._heap.append (task)
+            self._sift_up (len (self._heap) - 1)
+        else:
+            self._untimed.append (task)
+            self._untimed.sort (key=lambda tsk: tsk.priority, reverse=True)
+
+        # Make room for the task in the ready queues used by event_sched()
+        task._task_list = self
+        self._make_levels ()
+
+
+    def record_timeline (self, size = 1000, late_us = 1000):
+        """!
+        Start recording when each task is released, starts and ends, in a
+        ring buffer of events which can be dumped and looked at on a PC with
+        @c timeline.py. Tasks appended later are recorded too. Recording
+        costs two or three extra clock readings per run of a task.
+        @param size The number of events which are kept; older ones are
+               overwritten by newer ones
+        @param late_us A task released more than this many microseconds after
+               it was due is logged as late
+        @return The @c timeline.Timeline holding the events
+        """
+        self.timeline = timeline.Timeline (size, late_us)
+        for task in self.tasks ():
+            self._add_to_timeline (task)
+        return self.timeline
+
+
+    def stop_timeline (self):
+        """!
+        Stop recording events. The timeline which was being recorded keeps
+        the events which it holds.
+        """
+        for task in self.tasks ():
+            task._timeline = None
+        self.timeline = None
+
+
+    def _add_to_timeline (self, task):
+        """!
+        Give a task a number in the timeline and have it log its events there.
+        @param task The task to be recorded
+        """
+        task._tl_id = self.timeline.add_task (task.name)
+        task._timeline = self.timeline
+
+
+    def tasks (self):
+        """!
+        Make a list of the tasks in the task list, highest priority first.
+        @return A new list holding the tasks
+        """
+        return [task for pri in self.pri_list for task in pri[2:]]
+
+
+    def utilization (self, tasks = None, average = False):
+        """!
+        Compute the fraction of CPU time needed by the timed tasks. Each
+        task's share is its execution time divided by its period.
+        @param tasks A list of tasks to analyze instead of this task list's
+        @param average Set to @c True to use the average profiled run time
+               rather than the worst case from @c Task.cost()
+        @return The CPU utilization, where 1.0 means the CPU is always busy
+        """
+        if tasks is None:
+            tasks = self.tasks ()
+        util = 0.0
+        for task in tasks:
+            if task.period:
+                if average:
+                    if task._runs > 2:
+                        util += task._run_sum / (task._runs - 2) / task.period
+                else:
+                    util += task.cost () / task.period
+        return util
+
+
+    def response_times (self, tasks = None):
+        """!
+        Compute the worst case response time of each timed task.
+
+        Because tasks are scheduled cooperatively, a task which is released
+        may have to wait for one run of a lower priority task to finish
+        (blocking) and for every run of tasks of higher or equal priority
+        which are released while it waits. The response time is found by
+        non-preemptive fixed priority response time analysis: the waiting
+        time @c w is found by iterating @c w = B + sum ((w // T_j + 1) * C_j)
+        until it stops changing, where @c B is the blocking time and @c T_j
+        and @c C_j are the other tasks' periods and execution times; the
+        response time is @c w plus the task's own execution time.
+        Untimed tasks are counted only as blocking, as how often they run
+        isn't known. Each task's deadline is the one it was given, which is
+        its period unless set otherwise; deadlines are assumed to be no
+        longer than periods.
+        @param tasks A list of tasks to analyze instead of this task list's
+        @return A list of (task, response time in microseconds) tuples, one
+                for each timed task, highest priority first. The response
+                time is @c None if it's longer than the task's deadline.
+        """
+        if tasks is None:
+            tasks = self.tasks ()
+        timed = [task for task in tasks if task.period]
+        results = []
+        for task in timed:
+            # Blocking by the longest run of any lower priority task
+            block = 0
+            for other in tasks:
+                if other.priority < task.priority and other.cost () > block:
+                    block = other.cost ()
+
+            # Interference from other tasks of the same or higher priority
+            others = [other for other in timed if other is not task
+                      and other.priority >= task.priority]
+            cost = task.cost ()
+            wait = block + sum (other.cost () for other in others)
+            while wait + cost <= task.deadline:
+                new_wait = block
+                for other in others:
+                    new_wait += (wait // other.period + 1) * other.cost ()
+                if new_wait == wait:
+                    break
+                wait = new_wait
+
+            resp = wait + cost
+            results.append ((task, resp if resp <= task.deadline else None))
+        return results
+
+
+    def schedulable (self, policy = 'fp', tasks = None):
+        """!
+        Check whether every timed task can always meet its deadline.
+        @param policy The test to use: @c 'fp' for response time analysis of
+               the priorities actually given to the tasks, @c 'rm' for the
+               Liu and Layland utilization bound for rate monotonic priorities,
+               or @c 'edf' for the density bound of earliest deadline first
+               scheduling, which uses each task's deadline where it's
+               shorter than its period. The bounds include the longest
+               blocking time from any one task, as tasks can't be preempted.
+        @param tasks A list of tasks to analyze instead of this task list's
+        @return @c True if the task set is schedulable, @c False if not
+        """
+        if tasks is None:
+            tasks = self.tasks ()
+        if policy == 'fp':
+            for task, resp in self.response_times (tasks):
+                if resp is None:
+                    return False
+            return True
+
+        timed = [task for task in tasks if task.period]
+        if not timed:
+            return True
+        util = self.utilization (tasks)
+        block = max (task.cost () for task in tasks)
+        util += block / min (task.period for task in timed)
+        if policy == 'rm':
+            num = len (timed)
+            return util <= num * (2 ** (1 / num) - 1)
+        elif policy == 'edf':
+            util -= self.utilization (tasks)
+            for task in timed:
+                util += task.cost () / min (task.deadline, task.period)
+            return util <= 1.0
+        raise ValueError ('Unknown schedulability test ' + str (policy))
+
+
+    def analysis (self):
+        """!
+        Create some diagnostic text showing the results of schedulability
+        analysis: each timed task's period, deadline, execution time and
+        worst case response time, then the CPU utilization and the verdict of
+        each test.
+        """
+        ret_str = 'TASK             PRI    PERIOD  DEADLINE      WCET  RESPONSE\n'
+        for task, resp in self.response_times ():
+            ret_str += '{:<16s}{: 4d}{: 10.1f}{: 10.1f}{: 10.3f}'.format (
+                task.name, task.priority, task.period / 1000.0,
+                task.deadline / 1000.0, task.cost () / 1000.0)
+            if resp is None:
+                ret_str += '    MISSES\n'
+            else:
+                ret_str += '{: 10.3f}\n'.format (resp / 1000.0)
+        ret_str += 'Utilization: {:.3f} worst, {:.3f} average\n'.format (
+            self.utilization (), self.utilization (average = True))
+        for policy in ('fp', 'rm', 'edf'):
+            ret_str += '{:<4s}{:s}\n'.format (policy.upper (), 
+                'schedulable' if self.schedulable (policy) 
+                else 'not schedulable')
+        return ret_str
+
 
     @micropython.native
     def rr_sched (self):
@@ -342,11 +1200,19 @@ class TaskList:
         tasks are given a chance to run each time through the list, and it takes
         about the same amount of time before each is given a chance to run 
         again.
+        @return @c True if any task was run, @c False if none were ready
         """
+        # Resume tasks whose waits have timed out
+        if self._sleepers:
+            self._wake_sleepers ()
+
         # For each priority level, run all tasks at that level
+        ran = False
         for pri in self.pri_list:
             for task in pri[2:]:
-                task.schedule ()
+                if task.schedule ():
+                    ran = True
+        return ran
 
 
     @micropython.native
@@ -357,7 +1223,12 @@ class TaskList:
         This scheduler runs tasks in a priority based fashion. Each time it is
         called, it finds the highest priority task which is ready to run and
         calls that task's @c run() method.
+        @return @c True if a task was run, @c False if no task was ready
         """
+        # Resume tasks whose waits have timed out
+        if self._sleepers:
+            self._wake_sleepers ()
+
         # Go down the list of priorities, beginning with the highest
         for pri in self.pri_list:
             # Within each priority list, run tasks in round-robin order
@@ -372,7 +1243,503 @@ class TaskList:
                 if pri[1] >= length:
                     pri[1] = 2
                 if ran:
-                    return
+                    return True
+        return False
+
+
+    @micropython.native
+    def deadline_sched (self):
+        """!
+        Run tasks according to their priorities, finding timed tasks which are
+        due by keeping them in order of their next run times.
+
+        This scheduler makes the same choices as @c pri_sched(), running the
+        highest priority task which is ready, but it reads the clock only once
+        per call and doesn't ask every task whether it's ready. Timed tasks
+        are kept in a min-heap ordered by their next run times, so only the
+        tasks which are actually due are looked at; each one released costs
+        O(log n) work to put it back in the heap. Tasks which have no period
+        are run when their @c go() methods have been called, as usual.
+        Among ready tasks of equal priority, the one released first runs first.
+
+        A timed task's @c go() method has no effect with this scheduler, and
+        this scheduler shouldn't be mixed with @c pri_sched() or
+        @c rr_sched() on the same task list, as they move next run times
+        without keeping the heap in order.
+        @return @c True if a task was run, @c False if no task was ready
+        """
+        # Resume tasks whose waits have timed out
+        if self._sleepers:
+            self._wake_sleepers ()
+
+        # Release every timed task which is due, putting it back into the heap
+        # at its next run time
+        heap = self._heap
+        if heap:
+            now = utime.ticks_us ()
+            while True:
+                task = heap[0]
+                queued = task._pending > 0
+                if not task._release (now):
+                    break
+                if not queued:
+                    self._ready.append (task)
+                self._sift_down (0)
+
+        # Find the highest priority released task, earliest released first
+        best = None
+        for task in self._ready:
+            if best is None or task.priority > best.priority:
+                best = task
+
+        # Untimed tasks are sorted by priority, so the first one whose go
+        # flag is set is the best of them
+        for task in self._untimed:
+            if task.go_flag:
+                if best is None or task.priority > best.priority:
+                    best = task
+                break
+
+        if best is None:
+            return False
+
+        if best.period != None:
+            self._ready.remove (best)
+        best._run ()
+
+        # A timed task with more releases waiting to be run stays ready
+        if best.period != None and best._pending > 0:
+            self._ready.append (best)
+        return True
+
+
+    def make_cyclic (self, minor_ms = None, max_frames = 1000):
+        """!
+        Work out a fixed schedule for the timed tasks, to be run by
+        @c cyclic_sched().
+
+        The schedule repeats every major frame, or hyperperiod, which is the
+        least common multiple of the tasks' periods. It is split into minor
+        frames, by default as long as the greatest common divisor of the
+        periods. Each task runs in every minor frame whose start is a whole
+        number of its periods from the start of the major frame, so a table
+        of which tasks run in which minor frame can be made once, here,
+        rather than having the scheduler ask every task whether it's ready.
+        In each minor frame, tasks run highest priority first.
+
+        For the tasks in @c main.py, with periods of 10 ms and 300 ms, the
+        minor frame is 10 ms and the major frame 300 ms, or 30 minor frames.
+        @param minor_ms The length of a minor frame in milliseconds, which
+               must divide every task's period; by default the greatest
+               common divisor of the periods
+        @param max_frames The largest number of minor frames allowed in the
+               table, to keep periods which have a huge least common multiple
+               from using up memory
+        @return A tuple holding the minor and major frame lengths in
+                microseconds
+        """
+        timed = [task for task in self.tasks () if task.period]
+        if not timed:
+            raise ValueError ('No timed tasks to make a cyclic schedule from')
+
+        minor = 0
+        major = 1
+        for task in timed:
+            minor = _gcd (minor, task.period)
+            major = major * task.period // _gcd (major, task.period)
+        if minor_ms != None:
+            minor_us = int (minor_ms * 1000)
+            if minor_us <= 0:
+                raise ValueError ('Minor frame must be at least 1 us long')
+            if minor % minor_us != 0:
+                raise ValueError ('Minor frame must divide every task period')
+            minor = minor_us
+
+        num_frames = major // minor
+        if num_frames > max_frames:
+            raise ValueError ('Cyclic schedule needs {:d} minor frames'.format (
+                num_frames))
+
+        # Frames which run the same tasks share one tuple
+        frames = []
+        shared = {}
+        for frame in range (num_frames):
+            tasks = tuple (task for task in timed
+                           if (frame * minor) % task.period == 0)
+            frames.append (shared.setdefault (tasks, tasks))
+
+        # Every task runs in the first frame, which is due one minor frame
+        # from now; each task's next run time is kept in step with the table
+        # so profiling and the timeline see releases as usual
+        self._minor_us = minor
+        self._frame_idx = 0
+        self._frame_time = utime.ticks_add (utime.ticks_us (), minor)
+        for task in timed:
+            task._next_run = self._frame_time
+        self.frame_overruns = 0
+        self._frames = frames
+        return (minor, major)
+
+
+    @micropython.native
+    def cyclic_sched (self):
+        """!
+        Run the tasks from the table made by @c make_cyclic().
+
+        Each call reads the clock once. If the next minor frame is due, every
+        task in it is run, one after another, and the scheduler moves on to
+        the next frame; nothing asks the tasks whether they're ready. If no
+        frame is due, the highest priority task with no period whose @c go()
+        method has been called is run instead, in the time left over. A frame
+        which is due while an earlier one is still running is run as soon as
+        that one ends, and one which starts a whole minor frame late is
+        counted in @c frame_overruns. Frames which are run late run the
+        tasks' releases from those frames, so a task whose overrun policy
+        dropped some of them sits out the frames which would have run them.
+
+        This scheduler shouldn't be mixed with the others on the same task
+        list, and tasks appended after @c make_cyclic() aren't in the table
+        until it's called again. Calling it before @c make_cyclic() raises a
+        @c ValueError.
+        @return @c True if a task was run, @c False if none was
+        """
+        if self._frames is None:
+            raise ValueError ('make_cyclic () must be called before '
+                              'cyclic_sched ()')
+
+        # Resume tasks whose waits have timed out
+        if self._sleepers:
+            self._wake_sleepers ()
+
+        now = utime.ticks_us ()
+        late = utime.ticks_diff (now, self._frame_time)
+        if late > 0:
+            if late > self._minor_us:
+                self.frame_overruns += 1
+            for task in self._frames[self._frame_idx]:
+                task._release (now)
+                if task._pending > 0:
+                    task._run ()
+            self._frame_idx += 1
+            if self._frame_idx >= len (self._frames):
+                self._frame_idx = 0
+            self._frame_time = utime.ticks_add (self._frame_time,
+                                                self._minor_us)
+            return True
+
+        for task in self._untimed:
+            if task.go_flag:
+                task._run ()
+                return True
+        return False
+
+
+    def _make_levels (self):
+        """!
+        Make the ready bitmap and the ring of posted tasks for each priority
+        level, which are used by @c post() and @c event_sched(). This is done
+        whenever a task is appended, so that nothing needs to be allocated
+        when a task is posted. Tasks which were posted are posted again.
+        If there are more than 30 different priorities, there's no room for
+        them in the bitmap, so no levels are made; the other schedulers don't
+        need them, and @c event_sched() refuses to run.
+        """
+        irq_state = machine.disable_irq ()
+        posted = [task for task in self.tasks () if task._posted]
+        self._ready_bits = 0
+        self._bit_level = {}
+        self._rings = []
+        self._heads = []
+        self._counts = []
+        if len (self.pri_list) > 30:
+            machine.enable_irq (irq_state)
+            return
+        for level, pri in enumerate (self.pri_list):
+            self._bit_level[1 << level] = level
+            self._rings.append ([None] * (len (pri) - 2))
+            self._heads.append (0)
+            self._counts.append (0)
+            for task in pri[2:]:
+                task._level = level
+                task._posted = False
+        machine.enable_irq (irq_state)
+        for task in posted:
+            self.post (task)
+
+
+    @micropython.native
+    def post (self, task):
+        """!
+        Put a task into the ready queue for its priority and set its bit in
+        the ready bitmap, so that @c event_sched() runs it soon. This is what
+        @c Task.go() does, and it may be called from an interrupt service
+        routine; it takes the same short time however many tasks there are,
+        and doesn't allocate memory. A task which is already waiting in the
+        queue isn't put in again. Until @c event_sched() has been called,
+        this only calls @c on_post, as the other schedulers look at go flags
+        instead.
+        @param task The task to be run
+        """
+        if self._event_mode:
+            irq_state = machine.disable_irq ()
+            if not task._posted:
+                task._posted = True
+                level = task._level
+                ring = self._rings[level]
+                idx = self._heads[level] + self._counts[level]
+                if idx >= len (ring):
+                    idx -= len (ring)
+                ring[idx] = task
+                self._counts[level] += 1
+                self._ready_bits |= 1 << level
+            machine.enable_irq (irq_state)
+
+        if self.on_post is not None:
+            self.on_post (task)
+
+
+    @micropython.native
+    def _take (self):
+        """!
+        Take the task which has waited longest at the highest priority level
+        which has a posted task out of the ready queues. The level is found
+        from the lowest set bit of the ready bitmap, in the same time however
+        many tasks and priorities there are.
+        @return The task, or @c None if no task has been posted
+        """
+        irq_state = machine.disable_irq ()
+        bits = self._ready_bits
+        if bits == 0:
+            machine.enable_irq (irq_state)
+            return None
+        level = self._bit_level[bits & -bits]
+        ring = self._rings[level]
+        head = self._heads[level]
+        task = ring[head]
+        head += 1
+        if head >= len (ring):
+            head = 0
+        self._heads[level] = head
+        self._counts[level] -= 1
+        if self._counts[level] == 0:
+            self._ready_bits &= ~(1 << level)
+        task._posted = False
+        machine.enable_irq (irq_state)
+        return task
+
+
+    @micropython.native
+    def event_sched (self):
+        """!
+        Run tasks according to their priorities, finding ready tasks through
+        the ready bitmap rather than by asking each task.
+
+        Timed tasks which are due are found as in @c deadline_sched(), by
+        reading the clock once and looking only at the tasks at the front of
+        the heap of next run times, and are posted. Tasks whose @c go()
+        methods are called, whether by other tasks or by interrupt service
+        routines, are posted too. The highest priority posted task is then
+        taken from the ready queues and run; at each priority, tasks run in
+        the order in which they were posted. How long a task waits after an
+        ISR posts it therefore doesn't depend on how many tasks there are.
+
+        This scheduler shouldn't be mixed with the others on the same task
+        list. Tasks whose go flags were set before it was first called are
+        posted when it is. A task list with more than 30 different
+        priorities can't be run by it; calling it raises a @c ValueError, as
+        does appending a task with a 31st priority once it has been called.
+        A timed task with several releases waiting is posted again after
+        each run until they've all been run.
+        @return @c True if a task was run, @c False if no task was ready
+        """
+        # Resume tasks whose waits have timed out
+        if self._sleepers:
+            self._wake_sleepers ()
+
+        if not self._event_mode:
+            if len (self.pri_list) > 30:
+                raise ValueError ('Too many different priorities for the '
+                                  'ready bitmap')
+            self._event_mode = True
+            for task in self.tasks ():
+                if task.go_flag:
+                    self.post (task)
+
+        # Post every timed task which is due, putting it back into the heap
+        # at its next run time
+        heap = self._heap
+        if heap:
+            now = utime.ticks_us ()
+            while heap[0]._release (now):
+                self.post (heap[0])
+                self._sift_down (0)
+
+        task = self._take ()
+        if task is None:
+            return False
+        task._run ()
+        return True
+
+
+    def run_forever (self, sched = None, idle = None):
+        """!
+        Run the scheduler forever, sleeping whenever no task is ready.
+
+        Rather than calling the scheduler over and over as fast as possible,
+        this method waits whenever a scheduler pass finds nothing to run. It
+        works out how long it will be until the next timed task is due and
+        calls the @c idle function with that time; the idle function should
+        return when that time is near or when an interrupt has happened,
+        since an interrupt service routine may have called a task's @c go()
+        method. This method only returns by an exception such as
+        @c KeyboardInterrupt.
+        @param sched The scheduler method to be run, such as @c pri_sched or
+               @c deadline_sched; the default is @c pri_sched
+        @param idle A function which is called with the number of
+               microseconds until the next timed task is due, or @c None if
+               there are no timed tasks, whenever no task is ready; the
+               default is @c wfi_idle()
+        """
+        if sched is None:
+            sched = self.pri_sched
+        if idle is None:
+            idle = wfi_idle
+
+        while True:
+            if not sched ():
+                idle (self.time_to_next ())
+
+
+    def _add_sleeper (self, task, wake_time):
+        """!
+        Have a parked task resumed at a given time if it's still waiting then.
+        @param task The parked task
+        @param wake_time The time from @c utime.ticks_us() at which to resume
+               the task
+        """
+        # If the task was woken before its timeout could be set, there's
+        # nothing to time out
+        irq_state = machine.disable_irq ()
+        if task._wait is None:
+            machine.enable_irq (irq_state)
+            return
+        if task._wake_time is not None:
+            self._sleepers.remove (task)
+        task._wake_time = wake_time
+        idx = 0
+        while idx < len (self._sleepers) and utime.ticks_diff (
+                self._sleepers[idx]._wake_time, wake_time) <= 0:
+            idx += 1
+        self._sleepers.insert (idx, task)
+        machine.enable_irq (irq_state)
+
+
+    def _remove_sleeper (self, task):
+        """!
+        Cancel the timeout of a parked task which has been resumed, so that
+        the list of sleepers holds only tasks which are still waiting. This
+        is called by @c Task.go(), possibly from an interrupt service routine.
+        @param task The task, which must have a timeout
+        """
+        irq_state = machine.disable_irq ()
+        self._sleepers.remove (task)
+        task._wake_time = None
+        machine.enable_irq (irq_state)
+
+
+    def _wake_sleepers (self):
+        """!
+        Resume each parked task whose timeout has run out. Resuming a task
+        takes it off the list of sleepers.
+        """
+        now = utime.ticks_us ()
+        sleepers = self._sleepers
+        while True:
+            irq_state = machine.disable_irq ()
+            if not sleepers or utime.ticks_diff (
+                    now, sleepers[0]._wake_time) < 0:
+                machine.enable_irq (irq_state)
+                return
+            sleepers[0].go ()
+            machine.enable_irq (irq_state)
+
+
+    @micropython.native
+    def time_to_next (self):
+        """!
+        Find how long it will be until the next timed task is due to run.
+        All the timed tasks are looked at, because only @c deadline_sched()
+        keeps them in order; this is only done when there's time to spare.
+        Once @c make_cyclic() has been called, the time until the next minor
+        frame is found instead. A waiting task whose timeout comes first
+        counts as due then.
+        @return The number of microseconds until the next timed task is due,
+                zero if one is already due, or @c None if there are no timed
+                tasks. A task is due once the time is later than its next
+                run time, so this is at least one if none is due yet.
+        """
+        if self._ready or self._ready_bits:
+            return 0
+
+        now = utime.ticks_us ()
+        wait = None
+        if self._frames is not None:
+            wait = utime.ticks_diff (self._frame_time, now)
+        else:
+            for task in self._heap:
+                until = utime.ticks_diff (task._next_run, now)
+                if wait is None or until < wait:
+                    wait = until
+        if self._sleepers:
+            until = utime.ticks_diff (self._sleepers[0]._wake_time, now)
+            if wait is None or until < wait:
+                wait = until
+
+        if wait is None:
+            return None
+        return wait + 1 if wait >= 0 else 0
+
+
+    @micropython.native
+    def _sift_up (self, idx):
+        """!
+        Move the task at index @c idx of the heap toward the root until its
+        parent's next run time is no later than its own.
+        @param idx The index in the heap of the task to be moved
+        """
+        heap = self._heap
+        task = heap[idx]
+        while idx > 0:
+            parent = (idx - 1) >> 1
+            if utime.ticks_diff (task._next_run, heap[parent]._next_run) >= 0:
+                break
+            heap[idx] = heap[parent]
+            idx = parent
+        heap[idx] = task
+
+
+    @micropython.native
+    def _sift_down (self, idx):
+        """!
+        Move the task at index @c idx of the heap toward the leaves until
+        neither child has an earlier next run time than its own.
+        @param idx The index in the heap of the task to be moved
+        """
+        heap = self._heap
+        length = len (heap)
+        task = heap[idx]
+        while True:
+            child = 2 * idx + 1
+            if child >= length:
+                break
+            if child + 1 < length and utime.ticks_diff (
+                    heap[child + 1]._next_run, heap[child]._next_run) < 0:
+                child += 1
+            if utime.ticks_diff (heap[child]._next_run, task._next_run) >= 0:
+                break
+            heap[idx] = heap[child]
+            idx = child
+        heap[idx] = task
 
 
     def __repr__ (self):
@@ -380,7 +1747,8 @@ class TaskList:
         Create some diagnostic text showing the tasks in the task list.
         """
         ret_str = 'TASK             PRI    PERIOD    RUNS   AVG DUR   MAX ' \
-            'DUR  AVG LATE  MAX LATE\n'
+            'DUR  AVG LATE  MAX LATE   D P50   D P99 D P99.9   L P50   L P99' \
+            ' L P99.9  MISSES OVERRUN SKIPPED\n'
         for pri in self.pri_list:
             for task in pri[2:]:
                 ret_str += str (task) + '\n'
@@ -388,6 +1756,82 @@ class TaskList:
         return ret_str
 
 
+    def stats (self):
+        """!
+        Collect the statistics of every task in the list, as from
+        @c Task.stats().
+        @return A list of dictionaries, one for each task, highest priority
+                first
+        """
+        return [task.stats () for task in self.tasks ()]
+
+
+    def dump_histograms (self, stream, binary = False):
+        """!
+        Write the duration and lateness histograms of every profiled task to
+        a stream, so they can be looked at on a PC.
+
+        As text, each line is a comma separated record holding the task name,
+        @c dur or @c late, the lowest and one past the highest time in the
+        bucket in microseconds, and the count, for each bucket which isn't
+        empty; the first line names the columns. In binary, each histogram
+        is a byte holding the length of the task name, the name, a byte which
+        is 0 for duration or 1 for lateness, and then @c Histogram.BUCKETS
+        counts as little-endian 32 bit unsigned integers.
+        @param stream A stream with a @c write() method, such as
+               @c sys.stdout or an open file
+        @param binary Set to @c True for the binary format rather than text
+        """
+        if not binary:
+            stream.write ('task,kind,low_us,high_us,count\n')
+        for task in self.tasks ():
+            if not task._prof:
+                continue
+            for kind, hist in ((0, task._dur_hist), (1, task._late_hist)):
+                if binary:
+                    name = task.name.encode ()
+                    stream.write (bytes ([len (name)]) + name
+                                  + bytes ([kind]))
+                    stream.write (hist.counts)
+                    continue
+                for idx in range (Histogram.BUCKETS):
+                    if hist.counts[idx]:
+                        low, high = Histogram.bounds (idx)
+                        stream.write ('{:s},{:s},{:d},{:d},{:d}\n'.format (
+                            task.name, 'late' if kind else 'dur', low, high,
+                            hist.counts[idx]))
+
+
+def _gcd (a, b):
+    """!
+    Find the greatest common divisor of two integers, as MicroPython has no
+    @c math.gcd().
+    @param a One integer
+    @param b The other integer
+    @return The greatest common divisor of @c a and @c b
+    """
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def wfi_idle (wait_us):
+    """!
+    Wait for an interrupt if the next timed task isn't due for a while.
+    This is the idle function used by @c TaskList.run_forever() by default.
+    If the next task is due in more than one millisecond, the CPU is put to
+    sleep until the next interrupt; the system tick interrupt wakes it within
+    a millisecond, and any other interrupt, such as one whose handler calls a
+    task's @c go() method, wakes it sooner. In the last millisecond before a
+    task is due this function returns at once, so the scheduler polls the
+    clock and the task isn't made late by sleeping.
+    @param wait_us The number of microseconds until the next timed task is
+           due, or @c None if there are no timed tasks
+    """
+    if wait_us is None or wait_us > 1000:
+        machine.idle ()
+
+
 ## This is @b the main task list which is created for scheduling when 
 #  @c cotask.py is imported into a program. 
 task_list = TaskList ()
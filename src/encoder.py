@@ -7,7 +7,10 @@
     @date       January 13, 2022
 '''
 
+import array
 import pyb
+import utime
+import task_share
 
 ##  @brief      Encoder overflow period.
 #   @details    The Encoder AR value 2**16-1.
@@ -49,16 +52,127 @@ class EncoderDriver:
         #              change in position between readings.
         self.currentTick = 0
         
+        ##  @brief     Time of the most recent sample
+        #   @details   The value of utime.ticks_us() when the counter was last
+        #              sampled by the timer interrupt. Only updated in
+        #              sampling mode.
+        self.sample_time = 0
+        
+        # Sampling mode is off until start_sampling() is called, which makes
+        # the queue of samples the first time
+        self._samples = None
+        self._sample_timer = None
+        
+    def start_sampling(self, timerID, freq, size=64):
+        '''!Starts reading the encoder from a timer interrupt. At each
+            interrupt the time in microseconds and the counter value are put
+            into a queue, so samples are taken at exact intervals no matter
+            how late the tasks run. Tasks then take the samples in bulk with
+            read_samples(), or just the latest position with read().
+            
+            @param      timerID     Timer ID number of a free timer to use
+                                    for the interrupt, such as 6 or 7
+            @param      freq        Sampling frequency in Hz
+            @param      size        Number of samples the queue can hold.
+                                    When it's full, new samples are dropped.
+                                    The queue is made by the first call and
+                                    used again by later ones, which must
+                                    give the same size.
+        '''
+        self.stop_sampling()
+        # Each sample is a (time, counter) pair of items in one queue, which
+        # the interrupt puts in together so the pairs never come apart.
+        # Queues can't be freed, as they're kept in task_share.share_list
+        if self._samples is None:
+            self._samples = task_share.Queue('l', 2 * size, name='Encoder'
+                                             + str(timerID))
+            self._pairs = array.array('l', [0] * (2 * size))
+            self._pairs_view = memoryview(self._pairs)
+        elif len(self._pairs) != 2 * size:
+            raise ValueError('Sampling was started before with a queue of '
+                             '{:d} samples'.format(len(self._pairs) // 2))
+        self.currentTick = self._timer.counter()
+        self._sample_timer = pyb.Timer(timerID, freq=freq,
+                                       callback=self._sample)
+        
+    def stop_sampling(self):
+        '''!Stops reading the encoder from a timer interrupt. Samples which
+            were not taken yet are dropped.
+        '''
+        if self._sample_timer is not None:
+            self._sample_timer.callback(None)
+            self._sample_timer = None
+        if self._samples is not None:
+            self._samples.clear()
+
+    def is_sampling(self):
+        '''!Tells whether the encoder is being read by a timer interrupt.
+            
+            @return     @c True between start_sampling() and stop_sampling()
+        '''
+        return self._sample_timer is not None
+        
+    def _sample(self, timer):
+        '''!Timer interrupt callback which records the time and the counter.
+            It must not allocate memory, so it only puts two integers into
+            the queue.
+            
+            @param      timer       The timer which caused the interrupt
+        '''
+        self._samples.put(utime.ticks_us(), in_ISR=True)
+        self._samples.put(self._timer.counter(), in_ISR=True)
+        
+    def read_samples(self, times, positions):
+        '''!Takes the samples recorded by the timer interrupt since the last
+            call, oldest first, and converts them to positions.
+            
+            @param      times       An array into which the sample times
+                                    from utime.ticks_us() are written
+            @param      positions   An array into which the positions in
+                                    ticks are written
+            @return     The number of samples written into the arrays
+        '''
+        if self._samples is None:
+            raise ValueError('start_sampling() must be called before '
+                             'read_samples()')
+        count = min(len(times), len(positions), len(self._pairs) // 2)
+        count = self._samples.get_many(self._pairs_view[:2 * count]) // 2
+        for n in range(count):
+            times[n] = self._pairs[2 * n]
+            positions[n] = self._update(self._pairs[2 * n + 1])
+        if count:
+            self.sample_time = times[count - 1]
+        return count
+        
     def read(self):
         '''!Updates and returns encoder position. Updates variables which store
-            position values. Compensates for overflow and underflow.
+            position values. Compensates for overflow and underflow. In
+            sampling mode, any samples waiting in the queue are used up and
+            the position at the latest one is returned.
             
             @return     The position of the encoder shaft in ticks                    
         '''
+        if self._sample_timer is None:
+            return self._update(self._timer.counter())
+        
+        while self._samples.any():
+            count = self._samples.get_many(self._pairs_view) // 2
+            for n in range(count):
+                self._update(self._pairs[2 * n + 1])
+            if count:
+                self.sample_time = self._pairs[2 * count - 2]
+        return self.position
+    
+    def _update(self, tick):
+        '''!Updates the position with a new counter value.
+            
+            @param      tick        A value read from the timer's counter
+            @return     The position of the encoder shaft in ticks
+        '''
         # Calculate the change in position in ticks using the last
         # measured value
         lastTick = self.currentTick
-        self.currentTick = self._timer.counter()
+        self.currentTick = tick
         delta = self.currentTick - lastTick
         
         # Compensate for overflow.
@@ -0,0 +1,296 @@
+'''!@file       estimator.py
+    Estimators which find the velocity of an encoder from its positions.
+
+    A finite difference of two positions taken a few ms apart is noisy,
+    because the position only changes by whole ticks and the times of the
+    readings jitter. The estimators here give a smoother velocity, in ticks
+    per second, from timestamped positions:
+    - @ref DifferenceVelocity is the plain finite difference, which the
+      others are built on and can be compared with
+    - @ref LeastSquaresVelocity fits a line to a window of recent samples
+    - @ref EdgeTimingVelocity times how long the position takes to change,
+      which is accurate at low speeds where few ticks go by per sample
+    - @ref AlphaBetaFilter tracks position, velocity and, optionally,
+      acceleration with fixed gains
+
+    Each keeps its state in arrays or attributes made when it's created, so
+    nothing is allocated to store a sample; only working out a velocity,
+    which is a float, does. Samples can come from an
+    @c encoder.EncoderDriver one at a time with @c read() or in bulk from
+    its timer interrupt samples with @c update_many():
+    @code
+    velocity = estimator.LeastSquaresVelocity(window=8)
+    encoder1.start_sampling(6, freq=1000)
+    ...
+    count = encoder1.read_samples(times, positions)
+    speed = velocity.update_many(times, positions, count)
+    @endcode
+'''
+
+import array
+import utime
+
+
+class DifferenceVelocity:
+    '''!Finds the velocity as the change in position between the last two
+        samples over the time between them. The other estimators are built
+        on this one, and share its methods for taking samples in bulk and
+        from an encoder, overriding @c update() with their own estimates.
+    '''
+
+    def __init__(self):
+        '''!Creates an estimator which hasn't seen any samples.
+        '''
+        ##  @brief  The most recent velocity estimate in ticks per second
+        self.velocity = 0.0
+
+        self._last_time = 0
+        self._last_position = 0
+        self._started = False
+
+    def update(self, time_us, position):
+        '''!Takes one sample and updates the estimate.
+            @param time_us      The time of the sample from utime.ticks_us()
+            @param position     The position in ticks
+            @return             The velocity estimate in ticks per second
+        '''
+        if self._started:
+            elapsed = utime.ticks_diff(time_us, self._last_time)
+            if elapsed <= 0:
+                return self.velocity
+            self.velocity = (position - self._last_position)*1000000.0/elapsed
+        self._started = True
+        self._last_time = time_us
+        self._last_position = position
+        return self.velocity
+
+    def update_many(self, times, positions, count):
+        '''!Takes a block of samples, oldest first, such as those from
+            @c encoder.EncoderDriver.read_samples().
+            @param times        An array of times from utime.ticks_us()
+            @param positions    An array of positions in ticks
+            @param count        The number of samples in the arrays to use
+            @return             The velocity estimate in ticks per second
+        '''
+        for n in range(count):
+            self.update(times[n], positions[n])
+        return self.velocity
+
+    def read(self, encoder):
+        '''!Reads an encoder and updates the estimate with its position. If
+            the encoder is sampled by its timer interrupt, the time of its
+            latest sample is used; otherwise the time now is.
+            @param encoder      An @c encoder.EncoderDriver
+            @return             The velocity estimate in ticks per second
+        '''
+        time_us = utime.ticks_us()
+        position = encoder.read()
+        if encoder.is_sampling():
+            time_us = encoder.sample_time
+        return self.update(time_us, position)
+
+
+class LeastSquaresVelocity(DifferenceVelocity):
+    '''!Finds the velocity as the slope of the straight line which best fits
+        the last few samples. A longer window gives a smoother estimate which
+        lags further behind changes in speed.
+
+        The line is fitted to the positions against the samples' places in
+        the window, taken to be evenly spaced as timer interrupt samples are,
+        and its slope is scaled by the average time between them. The sums
+        in the fit then stay small integers, and @c update_many() fits the
+        line only once for a whole block of samples.
+    '''
+
+    def __init__(self, window=8):
+        '''!Creates an estimator with an empty window.
+            @param window       The number of samples to fit, at least 2
+        '''
+        super().__init__()
+        if window < 2:
+            raise ValueError("window must hold at least 2 samples")
+        self._window = window
+        self._times = array.array('l', [0]*window)
+        self._positions = array.array('l', [0]*window)
+        self._index = 0
+        self._count = 0
+
+    def _add(self, time_us, position):
+        '''!Adds a sample to the window, dropping the oldest one.
+        '''
+        self._times[self._index] = time_us
+        self._positions[self._index] = position
+        self._index += 1
+        if self._index >= self._window:
+            self._index = 0
+        if self._count < self._window:
+            self._count += 1
+
+    def _fit(self):
+        '''!Fits a line to the window and sets the velocity from its slope.
+            @return             The velocity estimate in ticks per second
+        '''
+        n = self._count
+        if n < 2:
+            return self.velocity
+
+        # Number the samples back from the newest, 0, -1, -2 and so on, and
+        # measure positions from the newest, so the sums stay small; the
+        # sums of the numbers and their squares are known in advance
+        newest = self._index - 1 if self._index > 0 else self._window - 1
+        position = self._positions[newest]
+        p_sum = 0
+        xp_sum = 0
+        k = newest
+        for x in range(n):
+            p = self._positions[k] - position
+            p_sum += p
+            xp_sum -= x*p
+            k = k - 1 if k > 0 else self._window - 1
+        x_sum = -n*(n - 1)//2
+        denominator = n*n*(n*n - 1)//12
+
+        # The slope is in ticks per sample; the oldest sample is n - 1
+        # samples back, which gives the time per sample
+        oldest = k + 1 if k < self._window - 1 else 0
+        span = utime.ticks_diff(self._times[newest], self._times[oldest])
+        if span > 0:
+            self.velocity = (n*xp_sum - x_sum*p_sum)*(n - 1)*1000000.0 \
+                / (denominator*span)
+        return self.velocity
+
+    def update(self, time_us, position):
+        '''!Adds a sample to the window, dropping the oldest one, and fits a
+            line to the window.
+            @param time_us      The time of the sample from utime.ticks_us()
+            @param position     The position in ticks
+            @return             The velocity estimate in ticks per second
+        '''
+        self._add(time_us, position)
+        return self._fit()
+
+    def update_many(self, times, positions, count):
+        '''!Adds a block of samples, oldest first, to the window and fits a
+            line to the window once.
+            @param times        An array of times from utime.ticks_us()
+            @param positions    An array of positions in ticks
+            @param count        The number of samples in the arrays to use
+            @return             The velocity estimate in ticks per second
+        '''
+        for n in range(count):
+            self._add(times[n], positions[n])
+        return self._fit()
+
+    def reset(self):
+        '''!Empties the window and sets the velocity to zero.
+        '''
+        self._count = 0
+        self._index = 0
+        self.velocity = 0.0
+
+
+class EdgeTimingVelocity(DifferenceVelocity):
+    '''!Finds the velocity from the time between changes in position, the
+        1/T method. When the position changes, the velocity is the change
+        divided by the time since the last change. When it hasn't changed for
+        longer than that, the velocity can be no more than one tick over the
+        time since the last change, so the estimate falls toward zero as a
+        motor stops instead of holding its last value.
+    '''
+
+    def __init__(self, timeout_ms=100):
+        '''!Creates an estimator which hasn't seen any samples.
+            @param timeout_ms   The time without a change in position after
+                                which the velocity is taken to be zero
+        '''
+        super().__init__()
+        self._timeout_us = timeout_ms*1000
+        self._edge_time = 0
+        self._edge_position = 0
+        self._interval = 0
+
+    def update(self, time_us, position):
+        '''!Takes one sample and updates the estimate.
+            @param time_us      The time of the sample from utime.ticks_us()
+            @param position     The position in ticks
+            @return             The velocity estimate in ticks per second
+        '''
+        if not self._started:
+            self._started = True
+            self._edge_time = time_us
+            self._edge_position = position
+            return self.velocity
+
+        elapsed = utime.ticks_diff(time_us, self._edge_time)
+        change = position - self._edge_position
+        if change != 0:
+            if elapsed > 0:
+                self.velocity = change*1000000.0/elapsed
+            self._edge_time = time_us
+            self._edge_position = position
+            self._interval = elapsed
+        elif elapsed >= self._timeout_us:
+            self.velocity = 0.0
+        elif elapsed > self._interval and elapsed > 0:
+            # No edge yet, so the speed is less than one tick per elapsed time
+            bound = 1000000.0/elapsed
+            if self.velocity > bound:
+                self.velocity = bound
+            elif self.velocity < -bound:
+                self.velocity = -bound
+        return self.velocity
+
+
+class AlphaBetaFilter(DifferenceVelocity):
+    '''!Tracks position and velocity, and acceleration if @c gamma is given,
+        by predicting them forward to each sample and correcting the
+        prediction by fixed fractions of the difference from the measured
+        position. Larger gains follow changes faster; smaller ones filter out
+        more noise.
+    '''
+
+    def __init__(self, alpha=0.5, beta=0.1, gamma=0.0):
+        '''!Creates a filter which starts at the first sample with zero
+            velocity.
+            @param alpha        Gain for position, between 0 and 1
+            @param beta         Gain for velocity, between 0 and 2
+            @param gamma        Gain for acceleration, or 0 to track only
+                                position and velocity
+        '''
+        super().__init__()
+        self._alpha = alpha
+        self._beta = beta
+        self._gamma = gamma
+
+        ##  @brief  The estimated position in ticks
+        self.position = 0.0
+
+        ##  @brief  The estimated acceleration in ticks per second squared
+        self.acceleration = 0.0
+
+    def update(self, time_us, position):
+        '''!Takes one sample and updates the estimates.
+            @param time_us      The time of the sample from utime.ticks_us()
+            @param position     The position in ticks
+            @return             The velocity estimate in ticks per second
+        '''
+        if not self._started:
+            self._started = True
+            self._last_time = time_us
+            self.position = float(position)
+            return self.velocity
+
+        dt = utime.ticks_diff(time_us, self._last_time)/1000000.0
+        if dt <= 0:
+            return self.velocity
+        self._last_time = time_us
+
+        # Predict where the motor should be now, then correct the prediction
+        self.position += (self.velocity + 0.5*self.acceleration*dt)*dt
+        self.velocity += self.acceleration*dt
+        residual = position - self.position
+        self.position += self._alpha*residual
+        self.velocity += self._beta*residual/dt
+        if self._gamma:
+            self.acceleration += 2.0*self._gamma*residual/(dt*dt)
+        return self.velocity
@@ -21,7 +21,9 @@ import print_task
 import encoder
 import motor
 import pidcontroller
-import time
+import telemetry
+import utime
+import sys
 
 _PPR = 256*4*16
 kp = 0.9*(360/_PPR)
@@ -29,6 +31,8 @@ ki = 0*(360/_PPR)
 kd = 0*(360/_PPR)
 # Read time length of step response from serial port
 _stepResponseTime = 1.5*1000  #ms
+# Run the tasks from a precomputed cyclic schedule rather than by priority
+_CYCLIC = False
 
 def task_enc1_fun():
     """!
@@ -55,10 +59,19 @@ def task_controller1_fun ():
         yield ()
         
 def task_data1_fun ():
+    """!
+    Task which sends the controllers' data to the PC as binary records, on
+    channels 1 and 2, then sends "Done!" as text when the step response is
+    over. The plotter on the PC finds the records among any text.
+    """
     done = False
+    records = bytearray(2*telemetry.RECORD_SIZE)
     while True:
-        if time.ticks_diff(time.ticks_ms(), tasks_start_time) < _stepResponseTime:
-            print_task.put(pidController1.get_data_str())
+        if utime.ticks_diff(utime.ticks_ms(), tasks_start_time) < _stepResponseTime:
+            pidController1.pack_record_into(records, 0, 1)
+            pidController2.pack_record_into(records,
+                                            telemetry.RECORD_SIZE, 2)
+            print_task.put_bytes(records)
         else:
             if not done:
                 print_task.put("Done!\n")
@@ -74,9 +87,21 @@ def task_controller2_fun ():
         yield ()
 
 
-# This code creates a share for each encoder object, creates encoder objects to read from, creates controller
-# objects and sets the gain and set point positions. 
-if __name__ == "__main__":
+def create_tasks (Kp = kp, Ki = ki, Kd = kd, encoder_period = 10,
+                  controller_period = 300, data_period = 10):
+    """!
+    Creates a share for each encoder object, creates encoder objects to read
+    from, creates controller objects and sets the gain and set point
+    positions, then creates the tasks and adds them to the task list.
+    @param Kp                   The proportional gain of both controllers
+    @param Ki                   The integral gain of both controllers
+    @param Kd                   The derivative gain of both controllers
+    @param encoder_period       The encoder tasks' period in ms
+    @param controller_period    The controller tasks' period in ms
+    @param data_period          The data collection task's period in ms
+    """
+    global encoder1_share, encoder2_share, encoder1, encoder2
+    global pidController1, pidController2, motor1, motor2, tasks_start_time
 
     # Create 2 encoder shares to share position data.
     encoder1_share = task_share.Share('i', thread_protect = False, name = "Encoder 1 Share")
@@ -90,8 +115,8 @@ if __name__ == "__main__":
     pidController1 = pidcontroller.PIDController(0, 1, 0, 0, encoder1_share)
     pidController2 = pidcontroller.PIDController(0, 1, 0, 0, encoder2_share)
     
-    pidController1.set_gains(kp, ki, kd)
-    pidController2.set_gains(kp, ki, kd)
+    pidController1.set_gains(Kp, Ki, Kd)
+    pidController2.set_gains(Kp, Ki, Kd)
     # Read desired set point position from serial port
     # Converts degrees to ticks
     pidController1.set_set_point(float(360)*(_PPR/360))
@@ -103,20 +128,20 @@ if __name__ == "__main__":
     motor2 = motor.MotorDriver(pyb.Pin.board.PC1, pyb.Pin.board.PA0,
                                pyb.Pin.board.PA1, pyb.Timer(5, freq=20000))
 
-    # Create the tasks. If trace is enabled for any task, memory will be
-    # allocated for state transition tracing, and the application will run out
-    # of memory after a while and quit. Therefore, use tracing only for 
-    # debugging and set trace to False when it's not needed
+    # Create the tasks. If trace is enabled for any task, the most recent
+    # state transitions are kept in a fixed size ring buffer which is made
+    # when the task is created, so tracing may be left on; it costs a little
+    # time each run and memory for trace_size times and states per task
     task_encoder1 = cotask.Task (task_enc1_fun, name = 'Encoder_1_Task', priority = 2, 
-                         period = 10, profile = True, trace = False)
+                         period = encoder_period, profile = True, trace = False)
     task_encoder2 = cotask.Task (task_enc2_fun, name = 'Encoder_2_Task', priority = 2, 
-                         period = 10, profile = True, trace = False)
+                         period = encoder_period, profile = True, trace = False)
     task_controller1 = cotask.Task (task_controller1_fun, name = 'Controller_1_Task', priority = 1, 
-                         period = 300, profile = True, trace = False)
+                         period = controller_period, profile = True, trace = False)
     task_controller2 = cotask.Task (task_controller2_fun, name = 'Controller_2_Task', priority = 1, 
-                         period = 300, profile = True, trace = False)
+                         period = controller_period, profile = True, trace = False)
     task_data1 = cotask.Task (task_data1_fun, name = 'Data Collection Task', priority = 0,
-                              period = 10, profile = True, trace = False)
+                              period = data_period, profile = True, trace = False)
     
     cotask.task_list.append (task_encoder1)
     cotask.task_list.append (task_controller1)
@@ -124,14 +149,28 @@ if __name__ == "__main__":
     cotask.task_list.append (task_controller2)
     cotask.task_list.append (task_data1)
 
+    # Data collection time is measured from when the tasks are created
+    tasks_start_time = utime.ticks_ms()
+
+
+if __name__ == "__main__":
+
+    create_tasks ()
+
+    # Binary records must be sent without newlines being changed
+    print_task.set_stream(sys.stdout.buffer)
+
     # Run the memory garbage collector to ensure memory is as defragmented as
     # possible before the real-time scheduler is started
     gc.collect ()
 
-    # Run the scheduler with the chosen scheduling algorithm. Quit if KeyboardInterrupt
-    tasks_start_time = time.ticks_ms()
-    while True:
-        try:
-            cotask.task_list.pri_sched ()
-        except KeyboardInterrupt:
-            break
\ No newline at end of file
+    # Run the scheduler with the chosen scheduling algorithm, sleeping while
+    # no task is ready. Quit if KeyboardInterrupt
+    try:
+        if _CYCLIC:
+            cotask.task_list.make_cyclic ()
+            cotask.task_list.run_forever (cotask.task_list.cyclic_sched)
+        else:
+            cotask.task_list.run_forever (cotask.task_list.pri_sched)
+    except KeyboardInterrupt:
+        pass
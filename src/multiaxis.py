@@ -0,0 +1,216 @@
+'''!@file       multiaxis.py
+    A PID controller for several motors which runs all of them in one task.
+
+    Rather than one encoder task and one controller task per motor, a
+    @ref MultiAxisController reads every encoder, computes every motor's duty
+    cycle and sets every motor driver in one run. The cost of scheduling
+    then depends on how many different rates there are, not how many motors,
+    and all the axes are sampled at the same moment. The control law is that
+    of @c pidcontroller.FixedPIDController, with each axis's gains and state
+    kept in integer arrays so that running the controller doesn't allocate
+    memory.
+
+    @code
+    axes = multiaxis.MultiAxisController([encoder1, encoder2],
+                                         [motor1, motor2],
+                                         Kp=kp, set_points=[16384, 16384],
+                                         period=10)
+    task_axes = cotask.Task(axes.task_fun, name='Axes', priority=2,
+                            period=10, profile=True)
+    cotask.task_list.append(task_axes)
+    @endcode
+'''
+
+import array
+import utime
+import micropython
+import telemetry
+from pidcontroller import SHIFT, DUTY_MAX, fixed_gains, fixed_integral, \
+    fixed_derivative
+
+
+def _per_axis(value, count):
+    '''!Makes a list with one value for each axis.
+        @param value    A single value for all axes or a sequence of values
+        @param count    The number of axes
+        @return         A list of @c count values
+    '''
+    try:
+        values = list(value)
+    except TypeError:
+        values = [value]*count
+    if len(values) != count:
+        raise ValueError("need one value per axis")
+    return values
+
+
+class MultiAxisController:
+    '''!
+    Integer PID control of several motors in a single pass. Each axis has an
+    encoder driver, a motor driver, a set point and its own gains; gains are
+    given in the same units as for @c pidcontroller.PIDController.
+    '''
+
+    def __init__(self, encoders, motors, Kp, Ki=0, Kd=0, set_points=0,
+                 period=None):
+        '''!
+        Creates a controller for as many axes as there are encoders.
+
+        @param encoders     A list of @c encoder.EncoderDriver objects
+        @param motors       A list of @c motor.MotorDriver objects, one per
+                            encoder
+        @param Kp           Proportional gain, one for all axes or a list
+        @param Ki           Integral gain, one for all axes or a list
+        @param Kd           Derivative gain, one for all axes or a list
+        @param set_points   Set point in ticks, one for all axes or a list
+        @param period       The period in ms of the task which runs the
+                            controller, or @c None to measure the time
+                            between runs
+        '''
+        if len(motors) != len(encoders):
+            raise ValueError("need one motor per encoder")
+        self._encoders = list(encoders)
+        self._motors = list(motors)
+
+        ##  @brief  The number of axes
+        self.count = len(encoders)
+        self._period = int(period) if period != None else None
+
+        ##  @brief  The most recently read position of each axis in ticks
+        self.positions = array.array('l', [0]*self.count)
+
+        ##  @brief  The most recently set duty cycle of each axis in percent
+        self.duties = array.array('l', [0]*self.count)
+
+        self._set_points = array.array('l', [0]*self.count)
+        self._Kp = array.array('l', [0]*self.count)
+        self._Ki = array.array('l', [0]*self.count)
+        self._Kd = array.array('l', [0]*self.count)
+        self._err_max = array.array('l', [0]*self.count)
+        self._Iduty = array.array('l', [0]*self.count)
+        self._last_error = array.array('l', [0]*self.count)
+
+        self.set_gains(Kp, Ki, Kd)
+        self.set_set_points(set_points)
+
+        ##  @brief  The time of the first run, in ms
+        self.step_start_time = None
+        self._last_time = 0
+
+        ##  @brief  The time of the most recent encoder sample, in ms
+        self.sample_time = 0
+
+        ##  @brief Data Collection Start Time
+        self.data_start_time = None
+
+    def set_gains(self, Kp, Ki=0, Kd=0):
+        '''!
+        Sets the gains of every axis, converting them to fixed point.
+
+        @param Kp   Proportional gain, one for all axes or a list
+        @param Ki   Integral gain, one for all axes or a list
+        @param Kd   Derivative gain, one for all axes or a list
+        '''
+        gains = zip(_per_axis(Kp, self.count), _per_axis(Ki, self.count),
+                    _per_axis(Kd, self.count))
+        for axis, (kp, ki, kd) in enumerate(gains):
+            (self._Kp[axis], self._Ki[axis], self._Kd[axis],
+             self._err_max[axis]) = fixed_gains(kp, ki, kd)
+
+    def set_set_points(self, set_points):
+        '''!
+        Sets the desired position of every axis.
+
+        @param set_points   Set point in ticks, one for all axes or a list
+        '''
+        for axis, set_point in enumerate(_per_axis(set_points, self.count)):
+            self._set_points[axis] = int(set_point)
+
+    @micropython.native
+    def sample(self):
+        '''!
+        Reads every encoder, one right after the other, and records the time.
+        This may be called by a faster task than the one which calls
+        @c run() if the encoders must be read often to catch overflows.
+        '''
+        self.sample_time = utime.ticks_ms()
+        for axis in range(self.count):
+            self.positions[axis] = self._encoders[axis].read()
+
+    @micropython.native
+    def run(self):
+        '''!
+        Reads every encoder, computes every axis's duty cycle and sets every
+        motor's duty cycle.
+        '''
+        self.sample()
+
+        # Find the time step, precomputed if the controller is periodic
+        if self.step_start_time == None:
+            self.step_start_time = self.sample_time
+            dt = 0
+        elif self._period != None:
+            dt = self._period
+        else:
+            curr_time = utime.ticks_diff(self.sample_time,
+                                         self.step_start_time)
+            dt = curr_time - self._last_time
+            self._last_time = curr_time
+
+        for axis in range(self.count):
+            # Clip the error where the proportional term saturates
+            error = self.positions[axis] - self._set_points[axis]
+            err_max = self._err_max[axis]
+            if err_max:
+                if error > err_max:
+                    error = err_max
+                elif error < -err_max:
+                    error = -err_max
+
+            duty = -self._Kp[axis]*error
+
+            if dt > 0:
+                self._Iduty[axis] = fixed_integral(self._Iduty[axis],
+                                                   self._Ki[axis], error, dt)
+                duty += fixed_derivative(self._Kd[axis],
+                                         error - self._last_error[axis], dt)
+            duty += self._Iduty[axis]
+
+            if duty > DUTY_MAX:
+                duty = DUTY_MAX
+            elif duty < -DUTY_MAX:
+                duty = -DUTY_MAX
+            self.duties[axis] = duty >> SHIFT
+            self._last_error[axis] = error
+
+        # Set all the motors once every duty cycle has been computed
+        for axis in range(self.count):
+            self._motors[axis].set_duty_cycle(self.duties[axis])
+
+    def task_fun(self):
+        '''!
+        A generator which runs the controller each time it's resumed, to be
+        used as the run function of a @c cotask.Task.
+        '''
+        while True:
+            self.run()
+            yield 0
+
+    def pack_record_into(self, buf, offset, axis, channel):
+        '''!
+        Writes one axis's time (ms), position (ticks), duty cycle (%) and
+        error (ticks) into a buffer as a binary telemetry record.
+
+        @param buf      A @c bytearray with room for @c telemetry.RECORD_SIZE
+                        bytes after @c offset
+        @param offset   The index in @c buf at which the record starts
+        @param axis     The number of the axis, starting from zero
+        @param channel  A number which identifies this axis's data
+        '''
+        if self.data_start_time == None:
+            self.data_start_time = utime.ticks_ms()
+        telemetry.pack_into(buf, offset, channel,
+                            utime.ticks_diff(self.sample_time,
+                                             self.data_start_time),
+                            self.positions[axis], self.duties[axis],
+                            self._last_error[axis])
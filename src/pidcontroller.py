@@ -7,7 +7,106 @@
     @date       February 10, 2022
 '''
 
-import time
+import utime
+import micropython
+import telemetry
+
+##  @brief      Number of fraction bits in the fixed point gains.
+#   @details    Gains are stored multiplied by 2**SHIFT, so duty cycles are
+#               computed in units of 1/65536 percent.
+SHIFT = 16
+
+##  @brief      The largest duty cycle, 100%, in fixed point units.
+DUTY_MAX = 100 << SHIFT
+
+##  @brief      The size past which the derivative term is saturated.
+#   @details    The proportional term is at most twice @c DUTY_MAX and the
+#               integral term at most @c DUTY_MAX, so a derivative term this
+#               big saturates the duty cycle whatever the others are.
+_D_MAX = 4*DUTY_MAX
+
+##  @brief      The longest time step in ms used for the derivative term.
+_DT_MAX = 32767
+
+
+def fixed_gains(Kp, Ki, Kd):
+    '''!Converts gains to fixed point and finds the error at which the
+        proportional term saturates on its own.
+        @param Kp   Proportional gain in duty cycle per tick
+        @param Ki   Integral gain
+        @param Kd   Derivative gain
+        @return     A tuple (Kp, Ki, Kd, err_max) of integers. An error bigger
+                    than @c err_max gives a duty cycle past the limits from
+                    the proportional term alone, so errors are clipped to it
+                    to keep products with the gains small; it's zero, and no
+                    clipping is done, if the proportional gain is zero.
+    '''
+    Kp_fx = round(Kp*(1 << SHIFT))
+    Ki_fx = round(Ki*(1 << SHIFT))
+    Kd_fx = round(Kd*(1 << SHIFT))
+    for gain in (Kp_fx, Ki_fx, Kd_fx):
+        if abs(gain) > DUTY_MAX:
+            raise ValueError("gains must be at most 100")
+    err_max = DUTY_MAX//abs(Kp_fx) + 1 if Kp_fx != 0 else 0
+    return Kp_fx, Ki_fx, Kd_fx, err_max
+
+
+@micropython.native
+def fixed_integral(Iduty, Ki, error, dt):
+    '''!Adds one time step to a fixed point integral term, which saturates
+        at the duty cycle limits and starts again from zero when the error
+        changes sign. A step which would take the term past a limit on its
+        own is found without multiplying, so the products stay small.
+        @param Iduty    The integral term so far
+        @param Ki       The fixed point integral gain
+        @param error    The error in ticks
+        @param dt       The time step in ms, more than zero
+        @return         The new integral term
+    '''
+    if Ki == 0 or error == 0:
+        Iduty_new = 0
+    elif abs(error) > DUTY_MAX//abs(Ki)//dt:
+        Iduty_new = DUTY_MAX if (Ki > 0) == (error > 0) else -DUTY_MAX
+    else:
+        Iduty_new = Ki*error*dt
+    if (Iduty > 0 and Iduty_new < 0) or (Iduty < 0 and Iduty_new > 0):
+        Iduty = Iduty_new
+    else:
+        Iduty += Iduty_new
+    if Iduty > DUTY_MAX:
+        Iduty = DUTY_MAX
+    elif Iduty < -DUTY_MAX:
+        Iduty = -DUTY_MAX
+    return Iduty
+
+
+@micropython.native
+def fixed_derivative(Kd, derr, dt):
+    '''!Finds a fixed point derivative term, @c Kd*derr//dt, without
+        making products bigger than small integers. The change in error and
+        the gain are each split into whole multiples of the time step and a
+        remainder, so that multiplying still comes before dividing and small
+        gains still count. A term big enough to saturate the duty cycle on
+        its own is limited to @c _D_MAX.
+        @param Kd       The fixed point derivative gain
+        @param derr     The change in error in ticks
+        @param dt       The time step in ms, more than zero; steps longer
+                        than @c _DT_MAX ms are taken as that long
+        @return         The derivative term
+    '''
+    if Kd == 0:
+        return 0
+    if dt > _DT_MAX:
+        dt = _DT_MAX
+    whole = derr//dt
+    part = derr - whole*dt
+    limit = _D_MAX//abs(Kd)
+    if whole > limit:
+        return _D_MAX if Kd > 0 else -_D_MAX
+    if whole < -limit - 1:
+        return -_D_MAX if Kd > 0 else _D_MAX
+    return Kd*whole + (Kd//dt)*part + (Kd % dt)*part//dt
+
 
 class PIDController:
     '''! 
@@ -42,6 +141,7 @@ class PIDController:
         self._last_time = 0
         self._last_error = 0
         self._Iduty = 0
+        self._duty = 0
         
         ##  @brief Data Collection Start Time
         self.data_start_time = None
@@ -58,12 +158,12 @@ class PIDController:
         '''
         # Store initial step time
         if self.step_start_time == None:
-            self.step_start_time = time.ticks_ms()
+            self.step_start_time = utime.ticks_ms()
             self._last_time = self.step_start_time
         
         # Calculate the current error in position
         error = self._sensor_share.get() - self._set_point
-        curr_time = time.ticks_diff(time.ticks_ms(),self.step_start_time)
+        curr_time = utime.ticks_diff(utime.ticks_ms(),self.step_start_time)
         
         # Calculate the PID actuation value
         Pduty = -self._Kp*error
@@ -88,6 +188,7 @@ class PIDController:
         # Store values for next iteration
         self._last_error = error
         self._last_time = curr_time
+        self._duty = actuation_value
         
         return actuation_value
     
@@ -120,5 +221,149 @@ class PIDController:
         The string output is: "time,position\r\n"
         '''
         if self.data_start_time == None:
-            self.data_start_time = time.ticks_ms()
-        return f"{time.ticks_diff(time.ticks_ms(),self.data_start_time)},{self._sensor_share.get()}\n"
+            self.data_start_time = utime.ticks_ms()
+        return f"{utime.ticks_diff(utime.ticks_ms(),self.data_start_time)},{self._sensor_share.get()}\n"
+
+    def pack_record_into(self, buf, offset=0, channel=0):
+        '''!
+        Writes the current time (ms), position (ticks), duty cycle (%) and
+        error (ticks) into a buffer as a binary telemetry record. This does
+        the job of @c get_data_str() without allocating memory, so it can be
+        used in a fast control loop; see @c telemetry.py for the format.
+        
+        @param buf      A @c bytearray with room for @c telemetry.RECORD_SIZE
+                        bytes after @c offset
+        @param offset   The index in @c buf at which the record starts
+        @param channel  A number which identifies this controller's data
+        '''
+        if self.data_start_time == None:
+            self.data_start_time = utime.ticks_ms()
+        telemetry.pack_into(buf, offset, channel,
+                            utime.ticks_diff(utime.ticks_ms(),
+                                             self.data_start_time),
+                            self._sensor_share.get(), int(self._duty),
+                            int(self._last_error))
+
+
+class FixedPIDController(PIDController):
+    '''!
+    A PID controller which uses only integer arithmetic. It has the same
+    methods and gain units as @c PIDController, but the gains are stored as
+    fixed point integers multiplied by 2**16, the position error is an
+    integer number of ticks, and the integral term is kept in an integer
+    accumulator which saturates at the duty cycle limits. Gains may be at
+    most 100 in these units. Every value is kept small enough to be a
+    MicroPython small integer, as long as the positions are, so a call to
+    @c run() doesn't allocate memory and can't cause a garbage collection.
+    
+    To keep the products small, the error is clipped where the proportional
+    term alone saturates the duty cycle, and the integral and derivative
+    terms are computed from the clipped error. While the error is that big
+    the integral term grows more slowly than in @c PIDController, and the
+    derivative term doesn't see changes in it.
+    
+    If the controller is run by a task with a fixed period, giving that
+    period to the constructor lets the time step be known in advance, so the
+    clock is only read to record the start time. The duty cycle returned
+    is an integer percentage.
+    '''
+
+    def __init__ (self, set_point, Kp, Ki, Kd, sensor_share, period=None):
+        '''!
+        Creates an integer PID controller by initializing setpoints and gains
+        
+        @param setpoint      The initial desired location of the step response  
+        @param Kp            The proportional gain for the controller.
+                             Units of (dutyCycle/ticks)
+        @param Ki            The integral gain for the controller.
+                             Units of (dutyCycle/(ticks*seconds))
+        @param Kd            The derivative gain for the controller.
+                             Units of (dutyCycle/(ticks/seconds))
+        @param sensor_share  A share the contains the read position from sensor
+        @param period        The period in ms of the task which runs the
+                             controller, or @c None to measure the time
+                             between runs
+        '''
+        self._period = int(period) if period != None else None
+        super().__init__(int(set_point), Kp, Ki, Kd, sensor_share)
+        self.set_gains(Kp, Ki, Kd)
+    
+    @micropython.native
+    def run(self):
+        '''! 
+        Runs the control algorithm once with integer arithmetic. Reads the
+        position from the sensor share, finds the error from the set point
+        and computes the same proportional, integral and derivative terms as
+        @c PIDController.run().
+        
+        @return The duty cycle, an integer from -100 to 100.
+        '''
+        # Find the time step, precomputed if the controller is periodic
+        if self.step_start_time == None:
+            self.step_start_time = utime.ticks_ms()
+            dt = 0
+        elif self._period != None:
+            dt = self._period
+        else:
+            curr_time = utime.ticks_diff(utime.ticks_ms(),
+                                         self.step_start_time)
+            dt = curr_time - self._last_time
+            self._last_time = curr_time
+        
+        # Calculate the current error in position, clipped where the
+        # proportional term saturates so products stay small integers
+        error = self._sensor_share.get() - self._set_point
+        if self._err_max:
+            if error > self._err_max:
+                error = self._err_max
+            elif error < -self._err_max:
+                error = -self._err_max
+        
+        duty = -self._Kp_fx*error
+        
+        # The integral and derivative terms need a time step; on the first
+        # run or if no time has passed there isn't one
+        if dt > 0:
+            self._Iduty = fixed_integral(self._Iduty, self._Ki_fx, error, dt)
+            duty += fixed_derivative(self._Kd_fx, error - self._last_error,
+                                      dt)
+        duty += self._Iduty
+        
+        # Filter saturated values and drop the fraction bits
+        if duty > DUTY_MAX:
+            duty = DUTY_MAX
+        elif duty < -DUTY_MAX:
+            duty = -DUTY_MAX
+        duty >>= SHIFT
+        
+        # Store values for next iteration
+        self._last_error = error
+        self._duty = duty
+        
+        return duty
+    
+    def set_set_point(self, set_point):
+        '''! 
+        Sets the desired setpoint for the step response.
+        
+        @param set_point  The desired steady state response value, rounded
+                          to a whole number of ticks
+        '''
+        self._set_point = int(set_point)
+    
+    def set_gains(self, Kp, Ki, Kd):
+        '''! 
+        Sets the controller gains, converting them to fixed point.
+        
+        @param Kp           The proportional gain for the controller.
+                            Units of (dutyCycle/ticks)
+        @param Ki           The integral gain for the controller.
+                            Units of (dutyCycle/(ticks*seconds))
+        @param Kd           The derivative gain for the controller.
+                            Units of (dutyCycle/(ticks/seconds))
+        '''
+        super().set_gains(Kp, Ki, Kd)
+        
+        # The integral and derivative terms see the clipped error too
+        self._Kp_fx, self._Ki_fx, self._Kd_fx, self._err_max = \
+            fixed_gains(Kp, Ki, Kd)
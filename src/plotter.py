@@ -2,50 +2,351 @@
     The main code to run on the PC to run and plot a step response on
     a motor. Includes functionality to set the setpoint and controller gain.
     The data is exchanged with the microcontroller over serial.
+
+    The data arrives as binary records (see @c telemetry.py) from one or
+    more controllers. A @ref Receiver reads the serial port in a background
+    thread, decodes the records in blocks and sorts them by channel, and a
+    @ref LivePlot shows each channel's step response while it's running.
+    The receiver works with any object which has a @c read(n) method, such
+    as a serial port, a pseudo-terminal or a file holding a recorded capture,
+    so it can be used from other programs and tests:
+    @code
+    with open('capture.bin', 'rb') as capture:
+        receiver = plotter.Receiver(capture)
+        receiver.start()
+        receiver.join()
+        times = receiver.channels[1].data['time']
+    @endcode
+
+    Usage: @c python plotter.py [port] [--capture FILE] [--record FILE]
     @author     Tori Bornino
     @author     Jackson McLaughlin
     @author     Zach Stednitz
     @date       January 27, 2022
 '''
 
-from matplotlib import pyplot
-import serial
+import argparse
+import threading
 import time
 
+import numpy
+
+import telemetry
+
 _PPR = 256*4*16
 _set_point = 360 # deg
 
-# Open serial port with the Nucleo
-_port = "COM3"
-with serial.Serial(_port, 115200, timeout=1) as ser_port:
-    # Reset the Nucleo and start its program
+##  @brief      The text the microcontroller sends when it's done.
+_DONE = b'Done!'
+
+
+class Channel:
+    '''!The data received from one controller. Records are stored in a
+        NumPy structured array which grows by doubling, so adding a block of
+        records doesn't copy all the old data each time.
+    '''
+
+    def __init__(self, number, capacity=1024):
+        '''!Creates an empty channel.
+            @param number       The channel number in the records
+            @param capacity     The number of records there's room for at
+                                first
+        '''
+        ##  @brief  The channel number in the records
+        self.number = number
+
+        ##  @brief  The number of records received
+        self.count = 0
+
+        self._store = None
+        self._capacity = capacity
+
+    def extend(self, records):
+        '''!Adds a block of records to the end of the channel's data.
+            @param records  A structured array from @c telemetry.decode()
+        '''
+        if self._store is None:
+            self._store = numpy.empty(self._capacity, dtype=records.dtype)
+        needed = self.count + len(records)
+        if needed > len(self._store):
+            bigger = numpy.empty(max(needed, 2 * len(self._store)),
+                                 dtype=self._store.dtype)
+            bigger[:self.count] = self._store[:self.count]
+            self._store = bigger
+        self._store[self.count:needed] = records
+        self.count = needed
+
+    @property
+    def data(self):
+        '''!The records received so far, as a structured array with fields
+            @c time, @c ticks, @c duty and @c error.
+        '''
+        if self._store is None:
+            return numpy.empty(0, dtype=[('time', '<u4'), ('ticks', '<i4'),
+                                         ('duty', '<i2'), ('error', '<i4')])
+        return self._store[:self.count]
+
+
+class Receiver:
+    '''!Receives binary telemetry records from a stream. A background
+        thread reads the stream in large blocks into a ring buffer which is
+        allocated once; @c poll() takes what has arrived, decodes all the
+        complete records at once and sorts them by channel.
+    '''
+
+    def __init__(self, stream, buf_size=1 << 20, chunk_size=4096,
+                 record=None):
+        '''!Creates a receiver for a stream; call @c start() to begin reading.
+            @param stream       An object with a @c read(n) method which
+                                returns up to @c n bytes, or an empty result
+                                at the end of the data
+            @param buf_size     The size in bytes of the ring buffer
+            @param chunk_size   The most bytes to ask the stream for at once
+            @param record       A binary file into which all received bytes
+                                are written, or @c None
+        '''
+        self._stream = stream
+        self._chunk_size = chunk_size
+        self._record = record
+
+        # The ring buffer and the total number of bytes written into and read
+        # out of it; the indices into the buffer are these modulo its size
+        self._ring = numpy.zeros(buf_size, dtype=numpy.uint8)
+        self._written = 0
+        self._taken = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+        # Bytes which may hold the start of a record not yet fully received
+        self._pending = b''
+
+        ##  @brief  The data from each controller, by channel number
+        self.channels = {}
+
+        ##  @brief  The number of bytes lost because the ring buffer was full
+        self.overruns = 0
+
+        ##  @brief  Set when the microcontroller has said it's done
+        self.done = False
+
+        ##  @brief  Set when the stream has no more data
+        self.eof = False
+
+    def start(self):
+        '''!Starts the thread which reads from the stream.
+        '''
+        self._running = True
+        self._thread = threading.Thread(target=self._read_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        '''!Stops the reading thread and waits for it to finish.
+        '''
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+
+    def join(self):
+        '''!Waits until the stream has no more data or the microcontroller
+            is done, then decodes everything which was received.
+        '''
+        while not (self.eof or self.done):
+            self.poll()
+            time.sleep(0.01)
+        self.stop()
+        self.poll()
+
+    def _read_loop(self):
+        '''!Reads blocks from the stream into the ring buffer until stopped
+            or the stream runs out.
+        '''
+        size = len(self._ring)
+        while self._running:
+            data = self._stream.read(self._chunk_size)
+            if not data:
+                # A serial port returns nothing on timeout; a file at its end
+                if getattr(self._stream, 'timeout', None) is None:
+                    self.eof = True
+                    return
+                continue
+            if self._record is not None:
+                self._record.write(data)
+
+            block = numpy.frombuffer(data, dtype=numpy.uint8)
+            with self._lock:
+                # If the reader has fallen a whole buffer behind, drop the
+                # oldest bytes
+                if len(block) > size:
+                    self.overruns += len(block) - size
+                    block = block[-size:]
+                behind = self._written + len(block) - self._taken - size
+                if behind > 0:
+                    self.overruns += behind
+                    self._taken += behind
+
+                # Copy in up to two slices around the end of the ring
+                start = self._written % size
+                first = min(len(block), size - start)
+                self._ring[start:start + first] = block[:first]
+                self._ring[:len(block) - first] = block[first:]
+                self._written += len(block)
+
+    def _take(self):
+        '''!Takes all the bytes which have arrived since the last call.
+            @return     The bytes, in order, as a @c bytes object
+        '''
+        size = len(self._ring)
+        with self._lock:
+            start = self._taken % size
+            count = self._written - self._taken
+            first = min(count, size - start)
+            data = (self._ring[start:start + first].tobytes()
+                    + self._ring[:count - first].tobytes())
+            self._taken = self._written
+        return data
+
+    def poll(self):
+        '''!Decodes the records which have arrived and adds them to their
+            channels.
+            @return     The number of records decoded
+        '''
+        data = self._pending + self._take()
+        if _DONE in data:
+            self.done = True
+        records, used = telemetry.decode(data)
+        self._pending = data[used:]
+
+        for number in numpy.unique(records['channel']):
+            number = int(number)
+            if number not in self.channels:
+                self.channels[number] = Channel(number)
+            self.channels[number].extend(
+                records[records['channel'] == number])
+        return len(records)
+
+
+class LivePlot:
+    '''!A plot of position against time for each channel of a receiver,
+        updated while data arrives. Only the lines are redrawn each time,
+        over a saved copy of the axes (blitting), unless the axes' limits
+        have to grow to fit the data.
+    '''
+
+    def __init__(self, receiver, set_point_ticks=None, t_max=1500):
+        '''!Creates the figure.
+            @param receiver         The receiver whose data is plotted
+            @param set_point_ticks  The set point in ticks, drawn as a dashed
+                                    line, or @c None
+            @param t_max            The time in ms which the time axis shows
+                                    at first
+        '''
+        from matplotlib import pyplot
+        self._pyplot = pyplot
+        self._receiver = receiver
+        self._fig, self._ax = pyplot.subplots()
+        self._ax.set_xlabel("time [ms]")
+        self._ax.set_ylabel("position [ticks]")
+        self._ax.set_xlim(0, t_max)
+        y_max = set_point_ticks * 1.2 if set_point_ticks else 1
+        self._ax.set_ylim(-0.05 * y_max, y_max)
+        if set_point_ticks is not None:
+            self._ax.axhline(set_point_ticks, color='r', linestyle='--')
+        self._lines = {}
+        self._background = None
+        self._fig.canvas.mpl_connect('draw_event', self._on_draw)
+        pyplot.show(block=False)
+        self._fig.canvas.draw()
+
+    def _on_draw(self, event):
+        '''!Saves the axes without the lines after each full redraw.
+        '''
+        self._background = self._fig.canvas.copy_from_bbox(self._ax.bbox)
+        for line in self._lines.values():
+            self._ax.draw_artist(line)
+
+    def update(self):
+        '''!Takes new data from the receiver and redraws the lines.
+        '''
+        self._receiver.poll()
+        redraw = False
+        for number, channel in self._receiver.channels.items():
+            if number not in self._lines:
+                self._lines[number], = self._ax.plot(
+                    [], [], animated=True, label='Motor ' + str(number))
+                self._ax.legend(loc='lower right')
+                redraw = True
+            data = channel.data
+            self._lines[number].set_data(data['time'], data['ticks'])
+            if len(data):
+                x_min, x_max = self._ax.get_xlim()
+                y_min, y_max = self._ax.get_ylim()
+                if data['time'][-1] > x_max:
+                    self._ax.set_xlim(x_min, 1.5 * data['time'][-1])
+                    redraw = True
+                if data['ticks'].max() > y_max or data['ticks'].min() < y_min:
+                    self._ax.set_ylim(min(y_min, data['ticks'].min()),
+                                      max(y_max, 1.1 * data['ticks'].max()))
+                    redraw = True
+
+        canvas = self._fig.canvas
+        if redraw or self._background is None:
+            canvas.draw()
+        else:
+            canvas.restore_region(self._background)
+            for line in self._lines.values():
+                self._ax.draw_artist(line)
+            canvas.blit(self._ax.bbox)
+        canvas.flush_events()
+
+    def run(self, interval=0.05):
+        '''!Updates the plot until the receiver is finished, then leaves
+            the finished plot on the screen.
+            @param interval     The time in seconds between updates
+        '''
+        while not (self._receiver.done or self._receiver.eof):
+            self.update()
+            self._pyplot.pause(interval)
+        self.update()
+        for line in self._lines.values():
+            line.set_animated(False)
+        self._pyplot.show()
+
+
+def _reset_nucleo(ser_port):
+    '''!Resets the Nucleo and starts its program.
+        @param ser_port     The serial port connected to the Nucleo
+    '''
     ser_port.write(b'\x03')
     time.sleep(1)
     ser_port.write(b'\x02')
     time.sleep(1)
     ser_port.write(b'\x04')
-    # Receive data from the Nucleo and process it into 2 lists
-    _xs = []
-    _ys = []
-    while True:
-        _line = ser_port.readline()
-        print(_line.decode('utf-8'), end='')
-        if _line == b'Done!\r\n':
-            break
-        _cells = _line.split(b',')
-        try:
-            _x = float(_cells[0].strip())
-            _y = float(_cells[1].strip())
-        except (ValueError, IndexError):
-            continue
-        _xs.append(_x)
-        _ys.append(_y)
-# Plot step response
-pyplot.plot(_xs, _ys)
-# Plot line for setpoint
-_t_max = _xs[-1]
-_set_point_ticks = _set_point * _PPR / 360
-pyplot.plot([0, _t_max], [_set_point_ticks, _set_point_ticks], 'r--')
-pyplot.xlabel("time [ms]")
-pyplot.ylabel("position [ticks]")
-pyplot.show()
\ No newline at end of file
+
+
+if __name__ == '__main__':
+    _parser = argparse.ArgumentParser(
+        description='Receive and plot step responses from the Nucleo')
+    _parser.add_argument('port', nargs='?', default='COM3',
+                         help='serial port connected to the Nucleo')
+    _parser.add_argument('--capture', help='plot a recorded capture file '
+                         'instead of reading the serial port')
+    _parser.add_argument('--record', help='save received bytes to a file')
+    _args = _parser.parse_args()
+
+    _record = open(_args.record, 'wb') if _args.record else None
+    if _args.capture:
+        _stream = open(_args.capture, 'rb')
+    else:
+        import serial
+        _stream = serial.Serial(_args.port, 115200, timeout=0.1)
+        _reset_nucleo(_stream)
+
+    with _stream:
+        _receiver = Receiver(_stream, record=_record)
+        _receiver.start()
+        _plot = LivePlot(_receiver, _set_point * _PPR / 360)
+        _plot.run()
+        _receiver.stop()
+    if _record is not None:
+        _record.close()
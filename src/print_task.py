@@ -1,11 +1,12 @@
 ## @file print_task.py
 #  This file contains code for a task which prints things from a queue. It
 #  helps to reduce latency in a system having tasks which print because it
-#  sends things to be printed out the serial port one character at a time,
-#  even when other tasks put whole strings into the queue at once. When run
-#  as a low-priority task, this allows higher priority tasks to interrupt
-#  the printing between characters, even when all the tasks are being 
-#  cooperatively scheduled with a priority-based scheduler. 
+#  sends things to be printed out the serial port a few characters at a time,
+#  even when other tasks put whole strings into the queue at once. Each time
+#  the task runs it sends blocks of characters until a time budget has been
+#  used up. When run as a low-priority task, this allows higher priority
+#  tasks to interrupt the printing between blocks, even when all the tasks
+#  are being cooperatively scheduled with a priority-based scheduler. 
 #
 #    Example code:
 #    @code
@@ -25,6 +26,8 @@
 #  @copyright This program is copyrighted by JR Ridgely and released under the
 #  GNU Public License, version 3.0. 
 
+import sys
+import utime
 import pyb
 import cotask
 import task_share
@@ -33,9 +36,18 @@ import task_share
 #  print task has time to print them. 
 BUF_SIZE = const (5000)
 
-## A flag which is passed to the queue constructor to control whether the 
-#  queue will protect puts and gets from being corrupted by interrupts. 
-THREAD_PROTECT = True
+## The number of characters which are sent to the serial port at once
+CHUNK_SIZE = const (64)
+
+## The time in microseconds for which the print task may keep sending blocks
+#  of characters each time it runs. It may be changed by the program.
+BUDGET_US = 1000
+
+## A flag which controls whether the print queue protects puts and gets from
+#  being corrupted by interrupts by disabling them. When it's @c False, the
+#  queue is a single-producer, single-consumer queue which needs no
+#  protection as long as only tasks, and not ISR's, put things into it.
+THREAD_PROTECT = False
 
 ## A flag which controls if the printing task is to be profiled
 PROFILE = True
@@ -47,58 +59,141 @@ def put (a_string):
     printing task whenever that task gets a chance. If the print queue is
     full, characters are lost; this is better than blocking to wait for
     space in the queue, as we'd block the printing task and space would
-    never open up. When a character has been put into the queue, the @c go()
-    method of the print task is called so that the run method will be called
-    as soon as the print task is run by the task scheduler. 
+    never open up. Putting characters into the queue resumes the print task,
+    which waits for the queue while it's empty, so that the run method will
+    be called as soon as the print task is run by the task scheduler. 
+    MicroPython's strings are buffers of UTF-8 bytes, so they're copied
+    into the queue as they are without being encoded into a new object;
+    elsewhere, such as on a PC, they must be encoded first.
     @param a_string A string to be put into the queue """
 
-    for a_ch in a_string:
-        if not print_queue.full ():
-            print_queue.put (ord (a_ch))
-            print_task.go ()
+    try:
+        print_queue.put_many (a_string)
+    except TypeError:
+        print_queue.put_many (a_string.encode ())
 
 
 #@micropython.native
 def put_bytes (b_arr):
-    """ Put bytes from a @c bytearray or @c bytes into the print queue. When 
-    characters have been put into the queue, the @c go() method of the print
-    task is called so that the run method will be called as soon as the print 
-    task is run by the task scheduler. 
+    """ Put bytes from a @c bytearray or @c bytes into the print queue. The
+    bytes are copied into the queue as a block; any which don't fit are lost.
+    Putting characters into the queue resumes the print task, which waits for
+    the queue while it's empty, so that the run method will be called as soon
+    as the print task is run by the task scheduler. 
     @param b_arr The bytearray whose contents go into the queue """
 
-    for byte in b_arr:
-        if not print_queue.full ():
-            print_queue.put (byte)
-            print_task.go ()
+    print_queue.put_many (b_arr)
+
+
+class _TextWriter:
+    """ Passes the blocks which the print task writes to a text stream, such
+    as an @c io.StringIO, which only accepts strings. A block may end part
+    way through a UTF-8 character, so the start of a character which is cut
+    off is kept until the rest of it arrives with the next block; bytes
+    which aren't UTF-8 text, such as binary data, are written as the
+    replacement character rather than stopping the print task. """
+
+    def __init__ (self, text_stream):
+        self._stream = text_stream
+        self._partial = b''
+
+    def write (self, data):
+        size = len (data)
+        data = self._partial + bytes (data)
+
+        # Look back from the end for the first byte of the last character,
+        # and keep that character back if it's missing some of its bytes
+        keep = 0
+        for back in range (1, min (4, len (data)) + 1):
+            byte = data[-back]
+            if byte & 0xC0 != 0x80:
+                if byte >= 0xF0:
+                    needed = 4
+                elif byte >= 0xE0:
+                    needed = 3
+                elif byte >= 0xC0:
+                    needed = 2
+                else:
+                    needed = 1
+                if back < needed:
+                    keep = back
+                break
+
+        self._partial = data[len (data) - keep:]
+        self._stream.write (data[:len (data) - keep].decode ('utf-8',
+                                                             'replace'))
+        return size
+
+
+def set_stream (a_stream):
+    """ Choose the stream to which the print task writes. Blocks are written
+    straight from the queue's buffer as @c memoryview objects, so the stream
+    should accept buffers. By default it's the binary stream underneath
+    @c sys.stdout, which sends bytes unchanged, as is needed for binary data.
+    A text stream, which has an @c encoding, is written to through its
+    binary @c buffer if it has one, or else the blocks are decoded into
+    strings for it.
+    @param a_stream A stream object with a @c write() method """
+
+    global stream
+    if hasattr (a_stream, 'encoding'):
+        if hasattr (a_stream, 'buffer'):
+            a_stream = a_stream.buffer
+        else:
+            a_stream = _TextWriter (a_stream)
+    stream = a_stream
 
 
 def run ():
     """ Run function for the task which prints stuff. This function checks for
     any characters to be printed in the queue; if any characters are found 
-    then one character is printed, after which the print task yields so other 
-    tasks can run. This functino must be called periodically; the normal way 
-    is to make it the run function of a low priority task in a cooperatively 
-    multitasked system so that the task scheduler calls this function when 
-    the higher priority tasks don't need to run. 
+    then blocks of up to @c CHUNK_SIZE characters are written to the stream
+    straight from the queue's buffer, without being copied, until the queue
+    is empty or @c BUDGET_US microseconds have passed, after which the print
+    task yields so other tasks can run. When the queue is empty the task
+    yields the queue's wait object, so it's parked until something is put in.
+    This function must be called periodically; the normal way is to make it
+    the run function of a low priority task in a cooperatively multitasked
+    system so that the task scheduler calls this function when the higher
+    priority tasks don't need to run. 
     """
 
     while True:
-        # If there's a character in the queue, print it
-        if print_queue.any ():
-            print (chr (print_queue.get ()), end = '')
-
-        # If there's another character, tell this task to run again ASAP
+        # Send blocks of characters until the queue is empty or time is up
+        start = utime.ticks_us ()
+        while print_queue.any ():
+            first, second = print_queue.peek_view ()
+            count = len (first)
+            if count > CHUNK_SIZE:
+                count = CHUNK_SIZE
+            stream.write (first[:count])
+            print_queue.commit_read (count)
+            if utime.ticks_diff (utime.ticks_us (), start) >= BUDGET_US:
+                break
+
+        # If there's another character, tell this task to run again ASAP;
+        # if not, wait until there is one
         if print_queue.any ():
             print_task.go ()
+            yield (0)
+        else:
+            yield print_queue.wait_data ()
 
-        yield (0)
+
+## The stream to which the print task writes characters, which must accept
+#  buffers such as @c memoryview objects; see @c set_stream()
+global stream
+stream = getattr (sys.stdout, 'buffer', sys.stdout)
 
 
 ## This queue holds characters to be printed when the print task gets around
 #  to it.
 global print_queue
-print_queue = task_share.Queue ('B', BUF_SIZE, name = "Print_Queue", 
-                        thread_protect = THREAD_PROTECT, overwrite = False)
+if THREAD_PROTECT:
+    print_queue = task_share.Queue ('B', BUF_SIZE, name = "Print_Queue", 
+                            thread_protect = True, overwrite = False)
+else:
+    print_queue = task_share.SPSCQueue ('B', BUF_SIZE, name = "Print_Queue")
 
 ## This is the task which schedules printing. 
 global print_task
@@ -107,3 +202,6 @@ print_task = cotask.Task (run, name = 'Printing', priority = 0,
 
 # This line tells the task scheduler to add this task to the system task list
 cotask.task_list.append (print_task)
+
+# Run the task once so it starts waiting for characters to print
+print_task.go ()
@@ -0,0 +1,526 @@
+'''!@file       simhal.py
+    A simulated hardware layer which lets the code written for the Nucleo,
+    including the task scheduler, run on a PC.
+
+    @c install() puts stand-ins for the MicroPython modules @c pyb, @c utime,
+    @c machine and @c micropython into @c sys.modules, so @c cotask.py,
+    @c task_share.py, @c encoder.py, @c motor.py and the rest can be imported
+    unchanged. Time is kept by a simulated @ref Clock which only moves when
+    the simulation moves it, so a program runs as fast as the PC can go
+    rather than in real time, and runs are exactly repeatable. The tick
+    counters wrap around as MicroPython's do. A timer given a frequency and a
+    callback calls it at exact intervals of simulated time whenever the clock
+    moves ahead, as a timer interrupt would.
+
+    Timers count encoder ticks from a @ref DCMotor plant whose input is the
+    PWM duty cycle set on a motor driver's timer, so the step response
+    experiments of @c main.py can be run in simulation:
+    @code
+    import simhal
+    board = simhal.install()
+    board.add_motor(simhal.DCMotor(), pwm_timer=3, encoder_timer=4)
+    board.add_motor(simhal.DCMotor(), pwm_timer=5, encoder_timer=8)
+    import cotask, main
+    main.create_tasks()
+    board.run(cotask.task_list, 1500)
+    @endcode
+'''
+
+import builtins
+import math
+import sys
+import types
+
+##  @brief      The period with which MicroPython's tick counters wrap around.
+TICKS_PERIOD = 1 << 30
+
+##  @brief      The modules written for the Nucleo which keep state in
+#               module variables, such as @c cotask.task_list.
+#   @details    @c install() removes them from @c sys.modules so that each
+#               simulation starts with fresh copies.
+BOARD_MODULES = ('cotask', 'task_share', 'print_task', 'encoder', 'motor',
+                 'pidcontroller', 'telemetry', 'multiaxis', 'estimator',
+                 'timeline', 'aiotask', 'main')
+
+
+class Clock:
+    '''!A simulated clock which provides the functions of @c utime. It keeps
+        time in microseconds as an integer which never wraps; the tick values
+        it returns wrap around every @c TICKS_PERIOD as on the Nucleo.
+    '''
+
+    def __init__(self, start_us=0, read_cost_us=0):
+        '''!Creates a clock stopped at the given time.
+            @param start_us     The time at which the clock starts, in us
+            @param read_cost_us Simulated time in microseconds which passes
+                                each time the clock is read, so that code
+                                which polls the clock makes progress
+        '''
+        ##  @brief  The current simulated time in microseconds
+        self.now = start_us
+
+        ##  @brief  The number of times the tick counters have been read
+        self.reads = 0
+
+        ##  @brief  The number of times @c idle() has put the CPU to sleep
+        self.sleeps = 0
+
+        self._read_cost = read_cost_us
+
+        # Periodic interrupts, each a list [next time, period, function]
+        self._events = []
+
+    def advance(self, delta_us, wake=False):
+        '''!Moves the clock ahead. Periodic interrupts which come due on the
+            way are called at their exact times, in time order.
+            @param delta_us     The number of microseconds to move ahead
+            @param wake         Set to @c True to stop right after the first
+                                interrupt, as a sleeping CPU wakes up
+        '''
+        if delta_us <= 0:
+            return
+        target = self.now + delta_us
+        while self._events:
+            event = min(self._events, key=lambda event: event[0])
+            if event[0] > target:
+                break
+            self.now = max(self.now, event[0])
+            event[0] += event[1]
+            event[2]()
+            if wake:
+                return
+        self.now = max(self.now, target)
+
+    def add_periodic(self, period_us, fun):
+        '''!Calls a function every so often, as a timer interrupt would.
+            @param period_us    The time between calls in microseconds
+            @param fun          The function, which is called with no
+                                arguments
+            @return             A handle to pass to @c remove_periodic()
+        '''
+        event = [self.now + period_us, period_us, fun]
+        self._events.append(event)
+        return event
+
+    def remove_periodic(self, event):
+        '''!Stops a function added with @c add_periodic() from being called.
+            @param event        The handle returned by @c add_periodic()
+        '''
+        if event in self._events:
+            self._events.remove(event)
+
+    def next_event(self):
+        '''!Finds how long it will be until the next periodic interrupt.
+            @return             The time in microseconds, or @c None if no
+                                periodic interrupts have been added
+        '''
+        if not self._events:
+            return None
+        return max(min(event[0] for event in self._events) - self.now, 0)
+
+    def ticks_us(self):
+        '''!Returns the time in microseconds, wrapped as @c utime does.
+        '''
+        self.reads += 1
+        self.now += self._read_cost
+        return self.now & (TICKS_PERIOD - 1)
+
+    def ticks_ms(self):
+        '''!Returns the time in milliseconds, wrapped as @c utime does.
+        '''
+        self.reads += 1
+        self.now += self._read_cost
+        return (self.now // 1000) & (TICKS_PERIOD - 1)
+
+    @staticmethod
+    def ticks_diff(ticks1, ticks2):
+        '''!Returns the signed difference between two tick values, taking
+            wraparound into account as @c utime.ticks_diff() does.
+        '''
+        half = TICKS_PERIOD >> 1
+        return ((ticks1 - ticks2 + half) & (TICKS_PERIOD - 1)) - half
+
+    @staticmethod
+    def ticks_add(ticks, delta):
+        '''!Adds a number of ticks to a tick value, wrapping around as
+            @c utime.ticks_add() does.
+        '''
+        return (ticks + delta) & (TICKS_PERIOD - 1)
+
+    def sleep_us(self, delay):
+        '''!Simulates @c utime.sleep_us() by moving the clock ahead.
+        '''
+        self.advance(delay)
+
+    def sleep_ms(self, delay):
+        '''!Simulates @c utime.sleep_ms() by moving the clock ahead.
+        '''
+        self.advance(delay * 1000)
+
+    def sleep(self, delay):
+        '''!Simulates @c utime.sleep(), whose delay is in seconds.
+        '''
+        self.advance(int(delay * 1000000))
+
+    def idle(self):
+        '''!Simulates @c machine.idle() by moving the clock ahead to the
+            next system tick interrupt, which comes once per millisecond, or
+            to a timer interrupt if one comes first.
+        '''
+        self.sleeps += 1
+        self.advance(1000 - self.now % 1000, wake=True)
+
+
+class DCMotor:
+    '''!A model of a DC motor with an encoder. The speed responds to the
+        PWM duty cycle as a first order system with a time constant, and the
+        position is the integral of the speed. Between changes of duty cycle
+        the model is solved exactly, so it's only updated when the duty cycle
+        changes or the position is read.
+    '''
+
+    def __init__(self, max_speed=60000.0, time_constant=0.05, clock=None):
+        '''!Creates a motor which is stopped at position zero.
+            @param max_speed        The steady state speed in encoder ticks
+                                    per second at 100% duty cycle
+            @param time_constant    The motor's mechanical time constant in
+                                    seconds
+            @param clock            The clock; @c Board.add_motor() sets it
+        '''
+        self.max_speed = max_speed
+        self.time_constant = time_constant
+        self.clock = clock
+
+        ##  @brief  The position in encoder ticks at the last update
+        self.position = 0.0
+
+        ##  @brief  The speed in encoder ticks per second at the last update
+        self.speed = 0.0
+
+        ##  @brief  The duty cycle in percent, from -100 to 100
+        self.duty = 0.0
+
+        self._last_us = None
+
+    def update(self):
+        '''!Brings the position and speed up to the clock's current time.
+        '''
+        now = self.clock.now
+        if self._last_us is None:
+            self._last_us = now
+            return
+        delta = (now - self._last_us) / 1000000.0
+        self._last_us = now
+        if delta <= 0:
+            return
+        final = self.max_speed * self.duty / 100.0
+        decay = math.exp(-delta / self.time_constant)
+        self.position += (final * delta + (self.speed - final)
+                          * self.time_constant * (1.0 - decay))
+        self.speed = final + (self.speed - final) * decay
+
+    def set_duty(self, duty):
+        '''!Changes the duty cycle applied to the motor.
+            @param duty     The duty cycle in percent, from -100 to 100
+        '''
+        self.update()
+        self.duty = duty
+
+    def ticks(self):
+        '''!Returns the position at the current time in whole encoder ticks.
+        '''
+        self.update()
+        return math.floor(self.position)
+
+
+class Pin:
+    '''!A stand-in for @c pyb.Pin. Pins are named by strings such as
+        @c 'B6' and just remember their output level.
+    '''
+    OUT_PP = 'OUT_PP'
+    IN = 'IN'
+
+    def __init__(self, pin_id, mode=None, *args, **kwargs):
+        '''!Creates a pin.
+            @param pin_id   A pin name or another @c Pin
+            @param mode     The pin's mode, which is remembered but not used
+        '''
+        self.name = pin_id.name if isinstance(pin_id, Pin) else str(pin_id)
+        self.mode = mode
+        self._value = 0
+
+    def high(self):
+        '''!Sets the pin's output high.
+        '''
+        self._value = 1
+
+    def low(self):
+        '''!Sets the pin's output low.
+        '''
+        self._value = 0
+
+    def value(self, level=None):
+        '''!Sets the pin's output level, or returns it if no level is given.
+        '''
+        if level is None:
+            return self._value
+        self._value = 1 if level else 0
+
+    def __repr__(self):
+        return 'Pin(' + self.name + ')'
+
+
+class _PinNames:
+    '''!Makes pin names such as @c pyb.Pin.cpu.B6 and @c pyb.Pin.board.PA10
+        available as attributes.
+    '''
+
+    def __getattr__(self, name):
+        return Pin(name)
+
+
+Pin.cpu = _PinNames()
+Pin.board = _PinNames()
+
+
+class TimerChannel:
+    '''!A stand-in for a channel of a @c pyb.Timer, which remembers its PWM
+        duty cycle.
+    '''
+
+    def __init__(self, timer, number, mode, pin):
+        self.timer = timer
+        self.number = number
+        self.mode = mode
+        self.pin = pin
+        self._percent = 0
+
+    def pulse_width_percent(self, percent=None):
+        '''!Sets or returns the PWM duty cycle of this channel.
+        '''
+        if percent is None:
+            return self._percent
+        self._percent = percent
+        self.timer._duty_changed()
+
+
+class Timer:
+    '''!A stand-in for @c pyb.Timer. In encoder mode its counter follows
+        the position of a motor connected with @c Board.add_motor(), wrapping
+        around like the 16-bit hardware counter. Setting the PWM duty cycle of
+        channels 1 and 2 drives a connected motor forward and backward.
+    '''
+    ENC_AB = 'ENC_AB'
+    PWM = 'PWM'
+
+    ##  @brief  The board which the timers belong to, set by @c install()
+    board = None
+
+    def __init__(self, timer_id, period=0xFFFF, prescaler=0, freq=None,
+                 callback=None, **kwargs):
+        '''!Creates a timer and registers it with the board by number.
+            @param timer_id     The timer number
+            @param period       The counter's largest value before it wraps
+            @param prescaler    The prescaler, which is remembered but not used
+            @param freq         The frequency in Hz with which a callback is
+                                called
+            @param callback     A function called with the timer as its
+                                argument at each update, as an interrupt
+        '''
+        self.timer_id = timer_id
+        self.period = period
+        self.prescaler = prescaler
+        self.freq = freq
+        self.channels = {}
+        self._event = None
+        old = self.board.timers.get(timer_id)
+        if old is not None:
+            old.callback(None)
+        self.board.timers[timer_id] = self
+        self.callback(callback)
+
+    def callback(self, fun):
+        '''!Sets the function called at each update of the timer, whose
+            interval in simulated time is set by the timer's frequency.
+            @param fun      A function taking the timer as its argument, or
+                            @c None to stop calling one
+        '''
+        if self._event is not None:
+            self.board.clock.remove_periodic(self._event)
+            self._event = None
+        if fun is not None:
+            if not self.freq:
+                raise ValueError('timer callback needs a frequency')
+            self._event = self.board.clock.add_periodic(
+                max(1, round(1000000 / self.freq)), lambda: fun(self))
+
+    def deinit(self):
+        '''!Stops the timer, along with its callback.
+        '''
+        self.callback(None)
+
+    def channel(self, number, mode=None, pin=None, **kwargs):
+        '''!Sets up a channel of the timer and returns it.
+        '''
+        chan = TimerChannel(self, number, kwargs.get('mode', mode), pin)
+        self.channels[number] = chan
+        return chan
+
+    def counter(self):
+        '''!Returns the counter value, which in encoder mode is the position
+            of the connected motor modulo the counter's period plus one.
+        '''
+        motor = self.board.encoders.get(self.timer_id)
+        if motor is None:
+            return 0
+        return motor.ticks() % (self.period + 1)
+
+    def _duty_changed(self):
+        '''!Passes the PWM duty cycle to a connected motor.
+        '''
+        motor = self.board.drives.get(self.timer_id)
+        if motor is not None:
+            forward = self.channels.get(1)
+            reverse = self.channels.get(2)
+            motor.set_duty((forward.pulse_width_percent() if forward else 0)
+                           - (reverse.pulse_width_percent() if reverse else 0))
+
+
+class _Stop(Exception):
+    '''!Raised to stop the scheduler when the simulated time is up.
+    '''
+
+
+class Board:
+    '''!The simulated Nucleo: a clock, its timers and the motors connected
+        to them.
+    '''
+
+    def __init__(self, clock):
+        ##  @brief  The simulated clock
+        self.clock = clock
+
+        ##  @brief  The timers which have been created, by timer number
+        self.timers = {}
+
+        ##  @brief  Motors whose encoders are read by a timer, by timer number
+        self.encoders = {}
+
+        ##  @brief  Motors driven by a timer's PWM, by timer number
+        self.drives = {}
+
+    def add_motor(self, motor, pwm_timer, encoder_timer):
+        '''!Connects a motor to the timer which drives it and the timer which
+            counts its encoder ticks.
+            @param motor            A @c DCMotor
+            @param pwm_timer        The number of the timer whose channels 1
+                                    and 2 drive the motor
+            @param encoder_timer    The number of the timer which counts the
+                                    motor's encoder ticks
+            @return                 The motor
+        '''
+        motor.clock = self.clock
+        motor.update()
+        self.drives[pwm_timer] = motor
+        self.encoders[encoder_timer] = motor
+        return motor
+
+    def run(self, task_list, duration_ms, sched=None, pass_us=20):
+        '''!Runs a task list's scheduler for a length of simulated time. When
+            no task is ready the clock jumps ahead to when the next one is.
+            @param task_list    The @c cotask.TaskList to be run
+            @param duration_ms  The simulated time to run for, in ms
+            @param sched        The scheduler method, by default the task
+                                list's @c pri_sched
+            @param pass_us      Simulated time taken by each scheduler pass
+        '''
+        sched = sched if sched is not None else task_list.pri_sched
+        clock = self.clock
+        end = clock.now + int(duration_ms * 1000)
+
+        def timed_sched():
+            if clock.now >= end:
+                raise _Stop
+            clock.advance(pass_us)
+            return sched()
+
+        def idle(wait_us):
+            if wait_us is None:
+                clock.idle()
+            else:
+                clock.advance(min(wait_us, end - clock.now), wake=True)
+
+        try:
+            task_list.run_forever(timed_sched, idle)
+        except _Stop:
+            pass
+
+
+def install(clock=None):
+    '''!Puts stand-ins for @c pyb, @c utime, @c machine and @c micropython
+        into @c sys.modules and removes any copies of the board modules which
+        were already imported, so that they'll be imported afresh using the
+        stand-ins.
+        @param clock    The simulated clock, or @c None to make a new one
+        @return         The simulated @c Board
+    '''
+    clock = clock if clock is not None else Clock()
+    board = Board(clock)
+
+    utime = types.ModuleType('utime')
+    for name in ('ticks_us', 'ticks_ms', 'ticks_diff', 'ticks_add',
+                 'sleep', 'sleep_ms', 'sleep_us'):
+        setattr(utime, name, getattr(clock, name))
+
+    pyb = types.ModuleType('pyb')
+    pyb.Pin = Pin
+    pyb.Timer = type('Timer', (Timer,), {'board': board})
+    pyb.disable_irq = lambda: True
+    pyb.enable_irq = lambda state=True: None
+    pyb.delay = clock.sleep_ms
+    pyb.udelay = clock.sleep_us
+    pyb.millis = clock.ticks_ms
+    pyb.micros = clock.ticks_us
+    pyb.wfi = clock.idle
+
+    machine = types.ModuleType('machine')
+    machine.idle = clock.idle
+    machine.disable_irq = pyb.disable_irq
+    machine.enable_irq = pyb.enable_irq
+
+    micropython = types.ModuleType('micropython')
+    micropython.native = lambda fun: fun
+    micropython.viper = lambda fun: fun
+    micropython.const = lambda value: value
+    micropython.alloc_emergency_exception_buf = lambda size: None
+
+    sys.modules.update({'utime': utime, 'pyb': pyb, 'machine': machine,
+                        'micropython': micropython})
+
+    # MicroPython lets const() be used without importing it
+    builtins.const = micropython.const
+
+    for name in BOARD_MODULES:
+        sys.modules.pop(name, None)
+    return board
+
+
+if __name__ == '__main__':
+    # Run the step response experiment of main.py in simulated time
+    _board = install()
+    _board.add_motor(DCMotor(), pwm_timer=3, encoder_timer=4)
+    _board.add_motor(DCMotor(), pwm_timer=5, encoder_timer=8)
+
+    import io
+    import cotask
+    import print_task
+    import main
+
+    main.create_tasks()
+    print_task.set_stream(io.BytesIO())
+    _board.run(cotask.task_list, main._stepResponseTime + 100)
+
+    print(cotask.task_list)
+    for _num in (1, 2):
+        _enc = getattr(main, 'encoder' + str(_num))
+        print(f'Motor {_num} final position {_enc.read()} ticks')
@@ -0,0 +1,270 @@
+'''!@file       sweep.py
+    Runs the step response experiment of @c main.py, with its real tasks,
+    scheduler and controllers, for every combination of gains and task
+    periods in a grid, spread over all of the PC's cores.
+
+    @c batchsim.py is much faster but models the tasks; a sweep runs the
+    code which goes on the Nucleo, in @c simhal.py's simulated time, so it
+    also shows scheduling effects such as lateness and missed deadlines.
+    The configurations are shared out among worker processes, one for each
+    core, and each run starts from fresh copies of the board modules, which
+    keep their state in module variables. Results are cached on disk
+    under a hash of the configuration and of the board modules' source code,
+    so running a sweep again only runs the configurations which are new or
+    whose code has changed. The results are written one column per quantity,
+    as a NumPy @c .npz file or as CSV.
+
+    @code
+    configs = sweep.grid(Kp=numpy.linspace(0.5, 2.0, 16)*(360/sweep._PPR),
+                         controller_period=[10, 20, 50, 100])
+    results = sweep.run(configs)
+    sweep.save('sweep.npz', configs, results)
+    @endcode
+
+    Usage: @c python sweep.py [-o FILE] [--kp ...] [--controller-period ...]
+'''
+
+import concurrent.futures
+import hashlib
+import importlib
+import io
+import json
+import os
+
+import numpy
+
+import batchsim
+import simhal
+
+_PPR = 256*4*16
+
+##  @brief      The set point of @c main.py, one revolution, in encoder ticks.
+SET_POINT = 360 * _PPR / 360
+
+##  @brief      The default directory in which results are cached.
+CACHE_DIR = '.sweep_cache'
+
+##  @brief      The names of the columns of results, in order.
+RESULT_NAMES = ('overshoot', 'settling_time', 'steady_state_error',
+                'final_position', 'max_late', 'misses', 'overruns')
+
+_SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def grid(Kp=0.0, Ki=0.0, Kd=0.0, controller_period=10, encoder_period=10,
+         data_period=10):
+    '''!Makes every combination of the given parameter values, as
+        @c batchsim.grid() does, with the data task's period as well.
+        @param Kp                   Proportional gains in duty cycle per tick
+        @param Ki                   Integral gains
+        @param Kd                   Derivative gains
+        @param controller_period    Controller task periods in ms
+        @param encoder_period       Encoder task periods in ms
+        @param data_period          Data collection task periods in ms
+        @return                     A dictionary of flat arrays with one
+                                    element per combination
+    '''
+    configs = {}
+    for period in numpy.atleast_1d(data_period):
+        part = batchsim.grid(Kp, Ki, Kd, controller_period, encoder_period)
+        part['data_period'] = numpy.full(len(part['Kp']), period)
+        for name, values in part.items():
+            configs[name] = numpy.concatenate((configs[name], values)) \
+                if name in configs else values
+    return configs
+
+
+def _code_hash():
+    '''!Hashes the source of every module a configuration's results depend
+        on, so that cached results are only used with the code which made
+        them.
+    '''
+    digest = hashlib.sha1()
+    for name in simhal.BOARD_MODULES + ('simhal', 'sweep', 'batchsim'):
+        path = os.path.join(_SOURCE_DIR, name + '.py')
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                digest.update(file.read())
+    return digest.hexdigest()
+
+
+def config_key(config, code_hash, duration_ms):
+    '''!Finds the name under which a configuration's results are cached.
+        @param config       A dictionary of one configuration's parameters
+        @param code_hash    The hash of the source code
+        @param duration_ms  The simulated time of each run in ms
+        @return             A hexadecimal hash
+    '''
+    text = json.dumps({'config': config, 'code': code_hash,
+                       'duration_ms': duration_ms}, sort_keys=True)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def run_one(config, duration_ms=1600):
+    '''!Runs @c main.py's tasks with one configuration in simulated time and
+        measures motor 1's step response from the telemetry they send. Only
+        one configuration may run at a time in a process.
+        @param config       A dictionary with the keyword arguments of
+                            @c main.create_tasks()
+        @param duration_ms  The simulated time to run for in ms
+        @return             A dictionary of results: @c overshoot in percent
+                            of the set point, @c settling_time in ms (@c nan
+                            if never settled), @c steady_state_error and
+                            @c final_position in ticks, and the largest
+                            lateness in us and total deadline misses and
+                            overruns of all the tasks
+    '''
+    board = simhal.install()
+    board.add_motor(simhal.DCMotor(), pwm_timer=3, encoder_timer=4)
+    board.add_motor(simhal.DCMotor(), pwm_timer=5, encoder_timer=8)
+    cotask = importlib.import_module('cotask')
+    print_task = importlib.import_module('print_task')
+    telemetry = importlib.import_module('telemetry')
+    main = importlib.import_module('main')
+
+    main.create_tasks(**config)
+    stream = io.BytesIO()
+    print_task.set_stream(stream)
+    board.run(cotask.task_list, duration_ms)
+
+    records, _ = telemetry.decode(stream.getvalue())
+    records = records[records['channel'] == 1]
+    times = records['time'].astype(float)
+    ticks = records['ticks'].astype(float)
+    results = dict.fromkeys(RESULT_NAMES, numpy.nan)
+    if len(records):
+        band = 0.02 * abs(SET_POINT)
+        outside = times[numpy.abs(ticks - SET_POINT) > band]
+        last_outside = outside[-1] if len(outside) else 0.0
+        results['overshoot'] = max(ticks.max() - SET_POINT, 0) \
+            / abs(SET_POINT) * 100.0
+        results['settling_time'] = last_outside \
+            if last_outside < times[-1] else numpy.nan
+        results['steady_state_error'] = SET_POINT - ticks[-1]
+        results['final_position'] = ticks[-1]
+
+    stats = cotask.task_list.stats()
+    results['max_late'] = max((task['max_late'] or 0) for task in stats)
+    results['misses'] = sum(task['misses'] for task in stats)
+    results['overruns'] = sum(task['overruns'] for task in stats)
+    return {name: float(value) for name, value in results.items()}
+
+
+def _run_cached(args):
+    '''!Runs one configuration in a worker process, unless its results are
+        already in the cache, and caches them.
+    '''
+    config, duration_ms, cache_path = args
+    if cache_path is not None and os.path.exists(cache_path):
+        with open(cache_path) as file:
+            return json.load(file), True
+    results = run_one(config, duration_ms)
+    if cache_path is not None:
+        # Write to a temporary file first so a crash can't leave half a file
+        with open(cache_path + '.tmp', 'w') as file:
+            json.dump(results, file)
+        os.replace(cache_path + '.tmp', cache_path)
+    return results, False
+
+
+def run(configs, duration_ms=1600, workers=None, cache_dir=CACHE_DIR):
+    '''!Runs every configuration in a grid, in parallel.
+        @param configs      A dictionary of equal length arrays of the
+                            keyword arguments of @c main.create_tasks(), such
+                            as from @c grid()
+        @param duration_ms  The simulated time of each run in ms
+        @param workers      The number of worker processes, by default one
+                            for each core
+        @param cache_dir    The directory holding cached results, or
+                            @c None to run every configuration
+        @return             A dictionary of arrays with one element per
+                            configuration, named as in @c RESULT_NAMES, and
+                            @c cached, which is @c True for each
+                            configuration whose results came from the cache
+    '''
+    names = list(configs)
+    count = len(configs[names[0]])
+    code_hash = _code_hash()
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    jobs = []
+    for num in range(count):
+        config = {name: configs[name][num].item() for name in names}
+        cache_path = os.path.join(cache_dir, config_key(
+            config, code_hash, duration_ms) + '.json') \
+            if cache_dir is not None else None
+        jobs.append((config, duration_ms, cache_path))
+
+    results = {name: numpy.empty(count) for name in RESULT_NAMES}
+    results['cached'] = numpy.zeros(count, dtype=bool)
+    workers = workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        chunk = max(1, count // (4*workers))
+        for num, (result, hit) in enumerate(pool.map(_run_cached, jobs,
+                                                     chunksize=chunk)):
+            for name in RESULT_NAMES:
+                results[name][num] = result[name]
+            results['cached'][num] = hit
+    return results
+
+
+def save(path, configs, results):
+    '''!Writes the configurations and their results, one column for each
+        parameter and result.
+        @param path         The file name; if it ends in @c .csv the file is
+                            CSV with a header row, otherwise it's a NumPy
+                            @c .npz file holding one array per column
+        @param configs      The configurations given to @c run()
+        @param results      The results returned by @c run()
+    '''
+    columns = dict(configs)
+    columns.update(results)
+    if path.endswith('.csv'):
+        numpy.savetxt(path, numpy.column_stack(list(columns.values())),
+                      delimiter=',', header=','.join(columns), comments='',
+                      fmt='%.9g')
+    else:
+        numpy.savez(path, **columns)
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description="Sweep main.py's gains and task periods in simulation")
+    parser.add_argument('-o', '--output', default='sweep.npz',
+                        help='results file, .npz or .csv')
+    parser.add_argument('--kp', type=float, nargs='+',
+                        default=[0.3, 0.6, 0.9, 1.2, 1.5],
+                        help='proportional gains in %% duty per degree')
+    parser.add_argument('--ki', type=float, nargs='+', default=[0.0],
+                        help='integral gains in %% duty per degree ms')
+    parser.add_argument('--kd', type=float, nargs='+', default=[0.0],
+                        help='derivative gains in %% duty ms per degree')
+    parser.add_argument('--controller-period', type=int, nargs='+',
+                        default=[10, 20, 30, 40, 50, 75, 100, 150, 500],
+                        help='controller task periods in ms')
+    parser.add_argument('--encoder-period', type=int, nargs='+',
+                        default=[10], help='encoder task periods in ms')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, by default one per core')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='run every configuration again')
+    args = parser.parse_args()
+
+    _scale = 360 / _PPR
+    _configs = grid(Kp=numpy.array(args.kp) * _scale,
+                    Ki=numpy.array(args.ki) * _scale,
+                    Kd=numpy.array(args.kd) * _scale,
+                    controller_period=args.controller_period,
+                    encoder_period=args.encoder_period)
+    _start = time.perf_counter()
+    _results = run(_configs, workers=args.workers,
+                   cache_dir=None if args.no_cache else CACHE_DIR)
+    _elapsed = time.perf_counter() - _start
+    save(args.output, _configs, _results)
+    print(f'{len(_configs["Kp"])} configurations '
+          f'({int(_results["cached"].sum())} cached) in '
+          f'{_elapsed:.2f} s, written to {args.output}')
@@ -14,6 +14,7 @@ import array
 import gc
 import pyb
 import micropython
+import cotask
 
 
 ## This is a system-wide list of all the queues and shared variables. It is
@@ -50,6 +51,9 @@ class BaseShare:
     classes @c Queue and @c Share. 
     """
 
+    ## The class of the wait objects on which waiting tasks are parked
+    _wait_type = cotask.Wait
+
     def __init__ (self, type_code, thread_protect = True, name = None):
         """!
         Create a base queue object when called by a child class initializer.
@@ -59,10 +63,45 @@ class BaseShare:
         self._type_code = type_code
         self._thread_protect = thread_protect
 
+        # Tasks which are waiting for data are parked on these wait objects,
+        # one for each timeout which has been asked for, so that tasks which
+        # wait with different timeouts don't change each other's. A task
+        # isn't parked if _wait_check returns True
+        self._waits = []
+        self._wait_check = None
+
         # Add this queue to the global share and queue list
         share_list.append (self)
 
 
+    def _get_wait (self, timeout_ms):
+        """!
+        Find the wait object which tasks yield to wait with a given timeout,
+        making it the first time that timeout is asked for. After that no
+        memory is allocated, and a wait object's timeout never changes.
+        @param timeout_ms The longest time in milliseconds to wait, or
+               @c None to wait for as long as it takes
+        @return The wait object for the timeout
+        """
+        timeout_us = int (timeout_ms * 1000) if timeout_ms != None else None
+        for wait in self._waits:
+            if wait.timeout_us == timeout_us:
+                return wait
+        wait = self._wait_type (self._wait_check, timeout_ms)
+        self._waits.append (wait)
+        return wait
+
+
+    @micropython.native
+    def _wake (self):
+        """!
+        Resume the tasks which are waiting for this queue or share. This may
+        be called from an interrupt service routine.
+        """
+        for wait in self._waits:
+            wait.wake ()
+
+
 # ============================================================================
 
 class Queue (BaseShare):
@@ -134,6 +173,10 @@ class Queue (BaseShare):
         # Allocate memory in which the queue's data will be stored
         try:
             self._buffer = array.array (type_code, range (size))
+        except OverflowError:
+            # CPython, unlike MicroPython, won't fill a small integer array
+            # with numbers too big for it, so fill with zeros instead
+            self._buffer = array.array (type_code, [0]) * size
         except MemoryError:
             self._buffer = None
             raise
@@ -141,9 +184,15 @@ class Queue (BaseShare):
             self._buffer = None
             raise
 
+        # A view of the buffer which lets blocks of data be copied in and out
+        self._view = memoryview (self._buffer)
+
         # Initialize pointers to be used for reading and writing data
         self.clear ()
 
+        # Tasks which wait for data aren't parked if there's some already
+        self._wait_check = self.any
+
         # Since we may have allocated a bunch of memory, call the garbage
         # collector to neaten up what memory is left for future use
         gc.collect ()
@@ -201,6 +250,9 @@ class Queue (BaseShare):
         if self._thread_protect and not in_ISR:
             pyb.enable_irq (_irq_state)
 
+        # Resume any tasks which are waiting for data
+        self._wake ()
+
 
     @micropython.native
     def get (self, in_ISR = False):
@@ -249,6 +301,190 @@ class Queue (BaseShare):
         return (to_return)
 
 
+    @micropython.native
+    def put_many (self, items, in_ISR = False):
+        """!
+        Put a block of items into the queue.
+
+        The items are copied into the queue's buffer in at most two slices,
+        one up to the end of the buffer and one from its beginning, with
+        interrupts disabled only once for the whole block. This method does
+        not wait for room in the queue; if there isn't room for all the items,
+        as many as fit are put in and the rest are not, unless the
+        @c overwrite constructor parameter was set to @c True, in which case
+        the oldest data is clobbered.
+        @param items An object such as a @c bytes, @c bytearray, @c array or
+               @c memoryview holding items of the queue's type
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return The number of items which were put into the queue
+        """
+        src = memoryview (items)
+        count = len (src)
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        # If there isn't room, either drop the oldest data or the extra items
+        space = self._size - self._num_items
+        if count > space:
+            if self._overwrite:
+                if count > self._size:
+                    src = src[count - self._size:]
+                    count = self._size
+                self._rd_idx += count - space
+                if self._rd_idx >= self._size:
+                    self._rd_idx -= self._size
+                self._num_items -= count - space
+            else:
+                count = space
+
+        # Copy up to the end of the buffer, then wrap around to its start
+        wr_idx = self._wr_idx
+        first = self._size - wr_idx
+        if first > count:
+            first = count
+        self._view[wr_idx:wr_idx + first] = src[:first]
+        if count > first:
+            self._view[:count - first] = src[first:count]
+
+        wr_idx += count
+        if wr_idx >= self._size:
+            wr_idx -= self._size
+        self._wr_idx = wr_idx
+        self._num_items += count
+        if self._num_items > self._max_full:     # Record maximum fillage
+            self._max_full = self._num_items
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        # Resume any tasks which are waiting for data
+        if count:
+            self._wake ()
+
+        return count
+
+
+    @micropython.native
+    def get_many (self, buf, in_ISR = False):
+        """!
+        Read a block of items from the queue into a buffer.
+
+        As many items as are in the queue, up to the length of the buffer, are
+        copied out in at most two slices with interrupts disabled only once.
+        This method does not wait for data; if the queue is empty, nothing is
+        copied.
+        @param buf A @c bytearray, @c array or @c memoryview with the same
+               item type as the queue, into which items are copied
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return The number of items which were copied into @c buf
+        """
+        dst = memoryview (buf)
+
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        count = len (dst)
+        if count > self._num_items:
+            count = self._num_items
+
+        # Copy up to the end of the buffer, then wrap around to its start
+        rd_idx = self._rd_idx
+        first = self._size - rd_idx
+        if first > count:
+            first = count
+        dst[:first] = self._view[rd_idx:rd_idx + first]
+        if count > first:
+            dst[first:count] = self._view[:count - first]
+
+        rd_idx += count
+        if rd_idx >= self._size:
+            rd_idx -= self._size
+        self._rd_idx = rd_idx
+        self._num_items -= count
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        return count
+
+
+    ## Another name for @c get_many(), which copies items into a buffer
+    get_into = get_many
+
+
+    @micropython.native
+    def peek_view (self):
+        """!
+        Look at the items in the queue without copying or removing them.
+
+        The items waiting to be read may wrap around the end of the queue's
+        buffer, so they're returned as two views of the buffer: the first
+        holds the oldest items, up to the end of the buffer, and the second
+        holds the rest, starting at the beginning of the buffer. Either may be
+        empty. Once the items have been used, @c commit_read() removes them
+        from the queue. Interrupts are disabled only while the read position
+        and item count are looked at. The views stay valid until the items
+        are committed, except that in a queue made with @c overwrite set,
+        new data may clobber them.
+        @code
+        first, second = my_queue.peek_view ()
+        stream.write (first)
+        my_queue.commit_read (len (first))
+        @endcode
+        @return A tuple of two @c memoryview objects holding the items in the
+                queue, oldest first
+        """
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect:
+            irq_state = pyb.disable_irq ()
+
+        rd_idx = self._rd_idx
+        count = self._num_items
+
+        # Re-enable interrupts
+        if self._thread_protect:
+            pyb.enable_irq (irq_state)
+
+        first = self._size - rd_idx
+        if first > count:
+            first = count
+        return (self._view[rd_idx:rd_idx + first], self._view[:count - first])
+
+
+    @micropython.native
+    def commit_read (self, count, in_ISR = False):
+        """!
+        Remove items from the queue after they've been used through the
+        views given by @c peek_view().
+        @param count The number of items to remove, oldest first
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return The number of items removed, which is less than @c count if
+                the queue didn't hold that many
+        """
+        # Prevent data corruption by blocking interrupts during data transfer
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        if count > self._num_items:
+            count = self._num_items
+        rd_idx = self._rd_idx + count
+        if rd_idx >= self._size:
+            rd_idx -= self._size
+        self._rd_idx = rd_idx
+        self._num_items -= count
+
+        # Re-enable interrupts
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        return count
+
+
     @micropython.native
     def any (self):
         """!
@@ -297,6 +533,27 @@ class Queue (BaseShare):
         return (self._num_items)
 
 
+    def wait_data (self, timeout_ms = None):
+        """!
+        Get an object which a task yields to wait until there's data in the
+        queue. The task is parked, costing the scheduler nothing, until an
+        item is put into the queue or the timeout runs out; if the queue
+        already holds data, the task isn't parked. Only tasks with no period
+        can wait. 
+        @code
+        |   def some_task ():
+        |       while True:
+        |           while my_queue.any ():
+        |               do_something_with (my_queue.get ())
+        |           yield my_queue.wait_data ()
+        @endcode
+        @param timeout_ms The longest time in milliseconds to wait, or
+               @c None to wait until data arrives
+        @return A @c cotask.Wait object to be yielded
+        """
+        return self._get_wait (timeout_ms)
+
+
     def clear (self):
         """!
         Remove all contents from the queue.
@@ -318,6 +575,276 @@ class Queue (BaseShare):
                 type_code_strings[self._type_code], self._max_full, self._size))
 
 
+# ============================================================================
+
+class SPSCQueue (Queue):
+    """!
+    A queue for one producer and one consumer which never disables interrupts.
+
+    A regular @c Queue keeps a count of its items which both the writer and
+    the reader change, so each access must be protected by disabling
+    interrupts. In this queue the writer only changes the write index and the
+    reader only changes the read index; the number of items is found from the
+    difference between the two, and one slot of the buffer is always left
+    empty so that a full queue can be told apart from an empty one. As long as
+    only one task or ISR puts data in and only one takes data out, no
+    interrupts need to be disabled for any transfer. This suits an ISR which
+    fills a queue read by a task, or a print queue which tasks fill and the
+    print task empties, since tasks which are scheduled cooperatively don't
+    interrupt each other.
+
+    This queue can't overwrite old data, as that would mean the writer moving
+    the read index.
+
+    @code
+    import task_share
+
+    # This queue holds samples put in by an ISR and read by a task
+    samples = task_share.SPSCQueue ('H', 100, name = "Samples")
+    @endcode
+    """
+
+    ## Only the one consumer waits for data, so it's parked and woken on a
+    #  wait object which doesn't disable interrupts either
+    _wait_type = cotask.SingleWait
+
+    def __init__ (self, type_code, size, name = None):
+        """!
+        Initialize a single-producer, single-consumer queue.
+
+        @param type_code The type of data items which the queue can hold, as
+               for @c Queue
+        @param size The maximum number of items which the queue can hold
+        @param name A short name for the queue, default @c QueueN where @c N
+               is a serial number for the queue
+        """
+        # The buffer has one slot more than the queue can hold
+        super ().__init__ (type_code, size + 1, thread_protect = False,
+                           overwrite = False, name = name)
+
+
+    @micropython.native
+    def put (self, item, in_ISR = False):
+        """!
+        Put an item into the queue.
+
+        If the queue is full, wait until the consumer makes room for the item;
+        in an ISR, which can't wait, the item is dropped instead.
+        @param item The item to be placed into the queue
+        @param in_ISR Set this to @c True if calling from within an ISR
+        """
+        wr_idx = self._wr_idx
+        next_idx = wr_idx + 1
+        if next_idx >= self._size:
+            next_idx = 0
+        if next_idx == self._rd_idx:
+            if in_ISR:
+                return
+            while next_idx == self._rd_idx:
+                pass
+
+        # Write the data before moving the index which makes it readable
+        self._buffer[wr_idx] = item
+        self._wr_idx = next_idx
+
+        count = self.num_in ()
+        if count > self._max_full:               # Record maximum fillage
+            self._max_full = count
+
+        # Resume any tasks which are waiting for data
+        self._wake ()
+
+
+    @micropython.native
+    def get (self, in_ISR = False):
+        """!
+        Read an item from the queue, waiting until there is one.
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return The oldest item in the queue
+        """
+        while self._rd_idx == self._wr_idx:
+            pass
+
+        rd_idx = self._rd_idx
+        to_return = self._buffer[rd_idx]
+
+        # Read the data before moving the index which frees its slot
+        rd_idx += 1
+        if rd_idx >= self._size:
+            rd_idx = 0
+        self._rd_idx = rd_idx
+
+        return (to_return)
+
+
+    @micropython.native
+    def put_many (self, items, in_ISR = False):
+        """!
+        Put a block of items into the queue in at most two slices. This
+        method doesn't wait; items which don't fit are not put in.
+        @param items An object such as a @c bytes, @c bytearray, @c array or
+               @c memoryview holding items of the queue's type
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return The number of items which were put into the queue
+        """
+        src = memoryview (items)
+        count = len (src)
+
+        wr_idx = self._wr_idx
+        space = self._rd_idx - wr_idx - 1
+        if space < 0:
+            space += self._size
+        if count > space:
+            count = space
+
+        # Copy up to the end of the buffer, then wrap around to its start
+        first = self._size - wr_idx
+        if first > count:
+            first = count
+        self._view[wr_idx:wr_idx + first] = src[:first]
+        if count > first:
+            self._view[:count - first] = src[first:count]
+
+        wr_idx += count
+        if wr_idx >= self._size:
+            wr_idx -= self._size
+        self._wr_idx = wr_idx
+
+        count_in = self.num_in ()
+        if count_in > self._max_full:            # Record maximum fillage
+            self._max_full = count_in
+
+        # Resume any tasks which are waiting for data
+        if count:
+            self._wake ()
+
+        return count
+
+
+    @micropython.native
+    def get_many (self, buf, in_ISR = False):
+        """!
+        Read a block of items from the queue into a buffer in at most two
+        slices. This method doesn't wait for data.
+        @param buf A @c bytearray, @c array or @c memoryview with the same
+               item type as the queue, into which items are copied
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return The number of items which were copied into @c buf
+        """
+        dst = memoryview (buf)
+
+        rd_idx = self._rd_idx
+        count = self._wr_idx - rd_idx
+        if count < 0:
+            count += self._size
+        if count > len (dst):
+            count = len (dst)
+
+        # Copy up to the end of the buffer, then wrap around to its start
+        first = self._size - rd_idx
+        if first > count:
+            first = count
+        dst[:first] = self._view[rd_idx:rd_idx + first]
+        if count > first:
+            dst[first:count] = self._view[:count - first]
+
+        rd_idx += count
+        if rd_idx >= self._size:
+            rd_idx -= self._size
+        self._rd_idx = rd_idx
+
+        return count
+
+
+    ## Another name for @c get_many(), which copies items into a buffer
+    get_into = get_many
+
+
+    @micropython.native
+    def peek_view (self):
+        """!
+        Look at the items in the queue without copying or removing them, as
+        for @c Queue.peek_view().
+        @return A tuple of two @c memoryview objects holding the items in the
+                queue, oldest first
+        """
+        rd_idx = self._rd_idx
+        wr_idx = self._wr_idx
+        if wr_idx >= rd_idx:
+            return (self._view[rd_idx:wr_idx], self._view[:0])
+        return (self._view[rd_idx:], self._view[:wr_idx])
+
+
+    @micropython.native
+    def commit_read (self, count, in_ISR = False):
+        """!
+        Remove items from the queue after they've been used through the
+        views given by @c peek_view().
+        @param count The number of items to remove, oldest first
+        @param in_ISR Set this to @c True if calling from within an ISR
+        @return The number of items removed
+        """
+        count_in = self.num_in ()
+        if count > count_in:
+            count = count_in
+        rd_idx = self._rd_idx + count
+        if rd_idx >= self._size:
+            rd_idx -= self._size
+        self._rd_idx = rd_idx
+        return count
+
+
+    @micropython.native
+    def any (self):
+        """!
+        Check if there are any items in the queue.
+        @return @c True if items are in the queue, @c False if not
+        """
+        return (self._rd_idx != self._wr_idx)
+
+
+    @micropython.native
+    def empty (self):
+        """!
+        Check if the queue is empty.
+        @return @c True if queue is empty, @c False if it's not empty
+        """
+        return (self._rd_idx == self._wr_idx)
+
+
+    @micropython.native
+    def full (self):
+        """!
+        Check if the queue is full.
+        @return @c True if the queue is full
+        """
+        next_idx = self._wr_idx + 1
+        if next_idx >= self._size:
+            next_idx = 0
+        return (next_idx == self._rd_idx)
+
+
+    @micropython.native
+    def num_in (self):
+        """!
+        Check how many items are in the queue.
+        @return The number of items in the queue
+        """
+        count = self._wr_idx - self._rd_idx
+        if count < 0:
+            count += self._size
+        return (count)
+
+
+    def __repr__ (self):
+        """!
+        This method puts diagnostic information about the queue into a string.
+        """
+        return ('{:<12s} SPSC<{:s}> Max Full {:d}/{:d}'.format (self._name,
+                type_code_strings[self._type_code], self._max_full,
+                self._size - 1))
+
+
 # ============================================================================
 
 class Share (BaseShare):
@@ -404,6 +931,9 @@ class Share (BaseShare):
         if self._thread_protect and not in_ISR:
             pyb.enable_irq (irq_state)
 
+        # Resume any tasks which are waiting for new data
+        self._wake ()
+
 
     @micropython.native
     def get (self, in_ISR = False):
@@ -428,6 +958,19 @@ class Share (BaseShare):
         return (to_return)
 
 
+    def wait_change (self, timeout_ms = None):
+        """!
+        Get an object which a task yields to wait until new data is put into
+        the share, even if it's the same as the old data. The task is parked,
+        costing the scheduler nothing, until then or until the timeout runs
+        out. Only tasks with no period can wait.
+        @param timeout_ms The longest time in milliseconds to wait, or
+               @c None to wait until new data is put
+        @return A @c cotask.Wait object to be yielded
+        """
+        return self._get_wait (timeout_ms)
+
+
     def __repr__ (self):
         """!
         Puts diagnostic information about the share into a string.
@@ -438,3 +981,175 @@ class Share (BaseShare):
                 type_code_strings[self._type_code]))
 
 
+# ============================================================================
+
+class RecordShare (BaseShare):
+    """!
+    A share which holds a record of several items, such as a position, a
+    velocity and the time at which they were measured, and lets readers get
+    a consistent copy of all of them without disabling interrupts.
+
+    The record is kept twice in one buffer. A writer fills in the copy which
+    readers aren't using, then publishes it by counting up a sequence number
+    whose lowest bit says which copy is current. A reader copies the current
+    record, then checks that the sequence number hasn't changed; if it has,
+    a writer published a new record in the meantime, so the reader copies
+    again. Thus readers never see half of one record and half of another,
+    and a reader in an ISR never has to wait for a writer in a task.
+
+    There should be only one writer at a time. If records are written both by
+    tasks and by an ISR, create the share with @c thread_protect set so that
+    writes from tasks disable interrupts; reads never do.
+
+    @code
+    import task_share
+
+    # This share holds a time, a position and a velocity, all 32 bit integers
+    motion = task_share.RecordShare ('l', ('time', 'position', 'velocity'),
+                                     name = "Motion")
+
+    # In one task, publish a record
+    motion.put ((now, position, velocity))
+
+    # In another task, copy the record into an array made beforehand
+    record = array.array ('l', [0, 0, 0])
+    motion.read_into (record)
+    @endcode
+    """
+    ## A counter used to give serial numbers to shares for diagnostic use.
+    ser_num = 0
+
+    ## The sequence number wraps around before it becomes a long integer
+    _SEQ_MASK = 0x3FFFFFFF
+
+
+    def __init__ (self, type_code, fields, thread_protect = False,
+                  name = None):
+        """!
+        Create a record share in which all items are zero.
+
+        @param type_code The type of the items in the record, as for @c Share
+        @param fields The number of items in the record, or a tuple of names
+               for them which can be given to @c index()
+        @param thread_protect @c True if writes disable interrupts, which is
+               only needed if both tasks and an ISR write records
+        @param name A short name for the share, default @c RecordN where @c N
+               is a serial number for the share
+        """
+        # First call the parent class initializer
+        super ().__init__ (type_code, thread_protect, name)
+
+        if isinstance (fields, int):
+            self._size = fields
+            self.fields = None
+        else:
+            ## The names of the items in the record, if they were given
+            self.fields = tuple (fields)
+            self._size = len (self.fields)
+
+        # Two copies of the record, one after the other
+        self._buffer = array.array (type_code, [0] * (2 * self._size))
+        self._seq = 0
+
+        self._name = str (name) if name != None \
+            else 'Record' + str (RecordShare.ser_num)
+        RecordShare.ser_num += 1
+
+
+    def index (self, field):
+        """!
+        Find where an item is in the record, by its name.
+        @param field The name of the item
+        @return The index of the item in the record
+        """
+        return self.fields.index (field)
+
+
+    @micropython.native
+    def put (self, values, in_ISR = False):
+        """!
+        Write and publish a whole record.
+        @param values A sequence, such as a tuple or @c array, holding at
+               least as many items as the record
+        @param in_ISR Set this to True if calling from within an ISR
+        """
+        if self._thread_protect and not in_ISR:
+            irq_state = pyb.disable_irq ()
+
+        # Fill in the copy which isn't current, then make it current
+        size = self._size
+        base = size if (self._seq & 1) == 0 else 0
+        for idx in range (size):
+            self._buffer[base + idx] = values[idx]
+        self._seq = (self._seq + 1) & RecordShare._SEQ_MASK
+
+        if self._thread_protect and not in_ISR:
+            pyb.enable_irq (irq_state)
+
+        # Resume any tasks which are waiting for a new record
+        self._wake ()
+
+
+    @micropython.native
+    def read_into (self, buf):
+        """!
+        Copy the current record into a buffer without disabling interrupts.
+        If a new record is published while it's being copied, it's copied
+        again, so the buffer always holds one whole record.
+        @param buf An @c array or other mutable sequence with room for the
+               record's items
+        @return The sequence number of the record, which changes each time a
+                record is published
+        """
+        size = self._size
+        while True:
+            seq = self._seq
+            base = size if (seq & 1) else 0
+            for idx in range (size):
+                buf[idx] = self._buffer[base + idx]
+            if seq == self._seq:
+                return seq
+
+
+    def get (self, in_ISR = False):
+        """!
+        Read the current record as a tuple. This allocates memory for the
+        tuple; use @c read_into() where that matters.
+        @param in_ISR Set this to True if calling from within an ISR
+        @return A tuple holding the items of the record
+        """
+        buf = array.array (self._type_code, [0] * self._size)
+        self.read_into (buf)
+        return tuple (buf)
+
+
+    @micropython.native
+    def sequence (self):
+        """!
+        Get the sequence number of the current record, which changes each
+        time a record is published, so that a reader can tell if there's a
+        new one without copying it.
+        @return The sequence number
+        """
+        return self._seq
+
+
+    def wait_change (self, timeout_ms = None):
+        """!
+        Get an object which a task yields to wait until new data is put into
+        the share, even if it's the same as the old data. The task is parked,
+        costing the scheduler nothing, until then or until the timeout runs
+        out. Only tasks with no period can wait.
+        @param timeout_ms The longest time in milliseconds to wait, or
+               @c None to wait until new data is put
+        @return A @c cotask.Wait object to be yielded
+        """
+        return self._get_wait (timeout_ms)
+
+
+    def __repr__ (self):
+        """!
+        Puts diagnostic information about the share into a string.
+        """
+        return ("{:<12s} Record<{:s}>[{:d}]".format (self._name,
+                type_code_strings[self._type_code], self._size))
@@ -0,0 +1,147 @@
+'''!@file       telemetry.py
+    A packed binary record format for sending controller data from the
+    microcontroller to the PC, used instead of lines of text.
+
+    Each record is @c RECORD_SIZE bytes long and holds, in little endian
+    order, a two byte sync word, a channel number which tells which controller
+    the record came from, the time in milliseconds, the position in encoder
+    ticks, the duty cycle in percent, the position error in ticks, and a
+    CRC-16 of everything between the sync word and the CRC. The sync word and
+    CRC let the receiver find records in a stream which may also contain text
+    or damaged bytes.
+
+    This file is used on both sides of the link. On the microcontroller,
+    @c pack_into() writes a record into a buffer which was allocated once, so
+    no memory is allocated while the control loop runs. On the PC,
+    @c decode() uses NumPy to find and check all the records in a block of
+    received bytes at once.
+'''
+
+import array
+import struct
+
+try:
+    import micropython
+except ImportError:
+    class micropython:
+        '''!Stands in for the @c micropython module on the PC, where there
+            is no native code emitter, so functions are left as they are.
+        '''
+        @staticmethod
+        def native(fun):
+            return fun
+
+
+##  @brief      The sync word at the start of each record.
+#   @details    It is sent as the bytes @c 0xA5, @c 0x5A.
+SYNC = 0x5AA5
+
+##  @brief      The layout of a record, not including its CRC.
+#   @details    Sync word, channel, time (ms), position (ticks), duty (%)
+#               and error (ticks).
+_FORMAT = '<HBIihi'
+
+##  @brief      The number of bytes covered by the CRC, which are all those
+#               after the sync word and before the CRC.
+_CRC_LEN = struct.calcsize(_FORMAT) - 2
+
+##  @brief      The number of bytes in one record including its CRC.
+RECORD_SIZE = struct.calcsize(_FORMAT) + 2
+
+
+def _make_crc_table():
+    '''!Creates the lookup table for CRC-16/CCITT (polynomial 0x1021).
+        @return     An array of 256 16-bit table entries
+    '''
+    table = array.array('H', range(256))
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            if crc & 0x8000:
+                crc = ((crc << 1) ^ 0x1021) & 0xFFFF
+            else:
+                crc = (crc << 1) & 0xFFFF
+        table[byte] = crc
+    return table
+
+##  @brief      The CRC-16/CCITT lookup table, one entry per byte value.
+_CRC_TABLE = _make_crc_table()
+
+
+@micropython.native
+def crc16(buf, start, length):
+    '''!Computes the CRC-16/CCITT of part of a buffer without allocating
+        memory. The CRC starts at @c 0xFFFF.
+        @param buf      The buffer holding the data
+        @param start    The index of the first byte to be checked
+        @param length   The number of bytes to be checked
+        @return         The CRC as an integer from 0 to 65535
+    '''
+    crc = 0xFFFF
+    table = _CRC_TABLE
+    for idx in range(start, start + length):
+        crc = ((crc << 8) & 0xFFFF) ^ table[((crc >> 8) ^ buf[idx]) & 0xFF]
+    return crc
+
+
+def pack_into(buf, offset, channel, time_ms, ticks, duty, error):
+    '''!Writes one record into a buffer. Nothing is allocated, so this may
+        be called in a control loop with a buffer made ahead of time.
+        @param buf      A @c bytearray at least @c RECORD_SIZE bytes long
+                        after @c offset
+        @param offset   The index in @c buf at which the record starts
+        @param channel  The channel number, 0 to 255, of the data's source
+        @param time_ms  The time in milliseconds
+        @param ticks    The position in encoder ticks
+        @param duty     The duty cycle in percent, an integer
+        @param error    The position error in ticks, an integer
+    '''
+    struct.pack_into(_FORMAT, buf, offset, SYNC, channel,
+                     time_ms & 0xFFFFFFFF, ticks, duty, error)
+    struct.pack_into('<H', buf, offset + RECORD_SIZE - 2,
+                     crc16(buf, offset + 2, _CRC_LEN))
+
+
+def decode(data):
+    '''!Finds, checks and unpacks all the complete records in a block of
+        received bytes. This runs on the PC and needs NumPy. Sync words are
+        found and CRCs are checked for all candidate records at once; bytes
+        which aren't part of a good record, such as text, are skipped.
+        @param data     A @c bytes, @c bytearray or NumPy @c uint8 array
+        @return         A tuple (records, used) where @c records is a NumPy
+                        structured array with fields @c channel, @c time,
+                        @c ticks, @c duty and @c error, and @c used is the
+                        number of bytes at the start of @c data which have
+                        been dealt with. The rest may hold the beginning of a
+                        record and should be kept until more data arrives.
+    '''
+    import numpy
+
+    dtype = numpy.dtype([('sync', '<u2'), ('channel', 'u1'),
+                         ('time', '<u4'), ('ticks', '<i4'),
+                         ('duty', '<i2'), ('error', '<i4'),
+                         ('crc', '<u2')])
+    raw = numpy.frombuffer(data, dtype=numpy.uint8)
+    last = len(raw) - RECORD_SIZE
+
+    # Every place a sync word starts a complete record is a candidate
+    starts = numpy.flatnonzero((raw[:-1] == (SYNC & 0xFF))
+                               & (raw[1:] == (SYNC >> 8)))
+    starts = starts[starts <= last]
+    rows = raw[starts[:, None] + numpy.arange(RECORD_SIZE)]
+
+    # Run the CRC over each byte position for all the candidates together
+    table = numpy.array(_CRC_TABLE, dtype=numpy.uint16)
+    crc = numpy.full(len(rows), 0xFFFF, dtype=numpy.uint16)
+    for col in range(2, 2 + _CRC_LEN):
+        crc = (crc << 8) ^ table[(crc >> 8) ^ rows[:, col]]
+    sent = rows[:, -2].astype(numpy.uint16) | (rows[:, -1].astype(
+        numpy.uint16) << 8)
+    good = crc == sent
+
+    records = numpy.ascontiguousarray(rows[good]).view(dtype).ravel()
+    if good.any():
+        used = int(starts[good][-1]) + RECORD_SIZE
+    else:
+        used = max(last + 1, 0)
+    return records, used
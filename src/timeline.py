@@ -0,0 +1,263 @@
+'''!@file       timeline.py
+    A recorder of when each task was released, started and finished, and a
+    tool which turns a recording into a trace which can be looked at in the
+    Chrome trace viewer or Perfetto.
+
+    A task's profile gives averages and maxima but doesn't show how the tasks
+    get in each other's way. When @c cotask.TaskList.record_timeline() is
+    called, the scheduler logs an event each time a task is released (or
+    released late), starts and ends. Each event is a time from
+    @c utime.ticks_us(), a task number and an event code, kept in one ring of
+    preallocated arrays, so recording doesn't allocate memory and the newest
+    events overwrite the oldest.
+
+    @code
+    timeline = cotask.task_list.record_timeline(size=2000)
+    ...
+    with open('timeline.bin', 'wb') as file:
+        timeline.dump(file, binary=True)
+    @endcode
+
+    On the PC, a dump is converted to JSON which can be opened at
+    @c chrome://tracing or @c ui.perfetto.dev, with one row for each task:
+    @code
+    python timeline.py timeline.bin -o timeline.json
+    @endcode
+'''
+
+import array
+import struct
+
+try:
+    import micropython
+except ImportError:
+    class micropython:
+        '''!Stands in for the @c micropython module on the PC, where there
+            is no native code emitter, so functions are left as they are.
+        '''
+        @staticmethod
+        def native(fun):
+            return fun
+
+##  @brief      Event code for a timed task being released.
+READY = 0
+
+##  @brief      Event code for a task being released later than allowed.
+LATE = 1
+
+##  @brief      Event code for a run of a task starting.
+START = 2
+
+##  @brief      Event code for a run of a task ending.
+END = 3
+
+##  @brief      The names of the events, indexed by event code.
+EVENT_NAMES = ('ready', 'late', 'start', 'end')
+
+##  @brief      The period with which the recorded times wrap around.
+_TICKS_PERIOD = 1 << 30
+
+_MAGIC = b'TL'
+
+
+class Timeline:
+    '''!A ring buffer of scheduler events. Tasks are numbered in the order
+        they're given names with @c add_task(); @c cotask.TaskList sets this
+        up and records the events, so it's rarely used directly.
+    '''
+
+    def __init__(self, size=1000, late_us=1000):
+        '''!Creates an empty timeline.
+            @param size     The number of events which are kept
+            @param late_us  A task released more than this many microseconds
+                            after its time is logged as @c LATE, not @c READY
+        '''
+        self._times = array.array('i', [0]*size)
+        self._tasks = array.array('B', [0]*size)
+        self._events = array.array('B', [0]*size)
+        self._size = size
+        self._idx = 0
+
+        ##  @brief  The number of events recorded, including overwritten ones
+        self.count = 0
+
+        ##  @brief  The lateness above which a release is logged as late
+        self.late_us = late_us
+
+        ##  @brief  The names of the tasks, indexed by task number
+        self.names = []
+
+    def add_task(self, name):
+        '''!Gives the next task number to a task.
+            @param name     The task's name
+            @return         The task number, which is given to @c record()
+        '''
+        if len(self.names) >= 256:
+            raise ValueError("a timeline can't tell more than 256 tasks apart")
+        self.names.append(name)
+        return len(self.names) - 1
+
+    @micropython.native
+    def record(self, task_id, event, time_us):
+        '''!Logs one event, overwriting the oldest if the ring is full. This
+            must only be called from the scheduler, not from an ISR.
+            @param task_id  The task's number from @c add_task()
+            @param event    The event code, such as @c START
+            @param time_us  The time of the event from @c utime.ticks_us()
+        '''
+        idx = self._idx
+        self._times[idx] = time_us
+        self._tasks[idx] = task_id
+        self._events[idx] = event
+        idx += 1
+        if idx >= self._size:
+            idx = 0
+        self._idx = idx
+        self.count += 1
+
+    def clear(self):
+        '''!Forgets all the recorded events.
+        '''
+        self._idx = 0
+        self.count = 0
+
+    def _slices(self, data):
+        '''!Splits one of the ring's arrays into two views holding the kept
+            events, oldest first.
+        '''
+        view = memoryview(data)
+        if self.count <= self._size:
+            return (view[:self.count], view[:0])
+        return (view[self._idx:], view[:self._idx])
+
+    def dump(self, stream, binary=False):
+        '''!Writes the recorded events, oldest first, to a stream.
+
+            As text, the first line names the columns, and each line after
+            it holds an event's time in microseconds, task name and event
+            name, separated by commas; the task name may hold commas too. In binary, there are the bytes @c TL,
+            a byte holding the number of tasks, each task's name as a length
+            byte followed by the name, the number of events as a little endian
+            32 bit unsigned integer, and then all the events' times as 32 bit
+            signed integers, task numbers as bytes and event codes as bytes.
+            @param stream   A stream with a @c write() method
+            @param binary   Set to @c True for the binary format
+        '''
+        count = min(self.count, self._size)
+        if binary:
+            stream.write(_MAGIC + bytes([len(self.names)]))
+            for name in self.names:
+                name = name.encode()
+                stream.write(bytes([len(name)]) + name)
+            stream.write(struct.pack('<I', count))
+            for data in (self._times, self._tasks, self._events):
+                for part in self._slices(data):
+                    stream.write(part)
+            return
+
+        stream.write('time_us,task,event\n')
+        for times, tasks, events in zip(self._slices(self._times),
+                                        self._slices(self._tasks),
+                                        self._slices(self._events)):
+            for num in range(len(times)):
+                stream.write('{:d},{:s},{:s}\n'.format(
+                    times[num], self.names[tasks[num]],
+                    EVENT_NAMES[events[num]]))
+
+
+def load(data):
+    '''!Reads a dump written by @c Timeline.dump() in either format. Times
+        are unwrapped, so they keep counting up past where the tick counter
+        wrapped around, and start from zero at the first event.
+        @param data     The dump, as @c bytes
+        @return         A list of (time in us, task name, event name) tuples
+    '''
+    if data[:2] == _MAGIC:
+        num_tasks = data[2]
+        pos = 3
+        names = []
+        for _ in range(num_tasks):
+            length = data[pos]
+            names.append(data[pos + 1:pos + 1 + length].decode())
+            pos += 1 + length
+        count = struct.unpack_from('<I', data, pos)[0]
+        pos += 4
+        times = struct.unpack_from('<{:d}i'.format(count), data, pos)
+        pos += 4*count
+        tasks = data[pos:pos + count]
+        events = data[pos + count:pos + 2*count]
+        raw = [(times[num], names[tasks[num]], EVENT_NAMES[events[num]])
+               for num in range(count)]
+    else:
+        lines = data.decode().splitlines()[1:]
+        raw = []
+        for line in lines:
+            if line:
+                # Neither the time nor the event name holds a comma, so
+                # split them off each end and leave any in the task's name
+                time_us, rest = line.split(',', 1)
+                name, event = rest.rsplit(',', 1)
+                raw.append((int(time_us), name, event))
+
+    result = []
+    total = 0
+    last = raw[0][0] if raw else 0
+    for time_us, name, event in raw:
+        total += (time_us - last) % _TICKS_PERIOD
+        last = time_us
+        result.append((total, name, event))
+    return result
+
+
+def to_chrome(events):
+    '''!Converts loaded events into the Chrome trace event format, which
+        Perfetto also reads. Each task gets its own row, with a bar for each
+        run from start to end and a mark at each release.
+        @param events   A list of (time in us, task name, event name) tuples
+                        as returned by @c load()
+        @return         A dictionary which can be written out with
+                        @c json.dump()
+    '''
+    rows = {}
+    trace = []
+    started = {}
+    for time_us, name, event in events:
+        if name not in rows:
+            rows[name] = len(rows) + 1
+            trace.append({'name': 'thread_name', 'ph': 'M', 'pid': 1,
+                          'tid': rows[name], 'args': {'name': name}})
+            trace.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': 1,
+                          'tid': rows[name],
+                          'args': {'sort_index': rows[name]}})
+        tid = rows[name]
+        if event == 'start':
+            started[name] = time_us
+        elif event == 'end':
+            if name in started:
+                start = started.pop(name)
+                trace.append({'name': name, 'ph': 'X', 'pid': 1, 'tid': tid,
+                              'ts': start, 'dur': time_us - start})
+        else:
+            trace.append({'name': event, 'ph': 'i', 's': 't', 'pid': 1,
+                          'tid': tid, 'ts': time_us})
+    return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(
+        description='Convert a scheduler timeline dump to Chrome trace JSON')
+    parser.add_argument('dump', help='file written by Timeline.dump()')
+    parser.add_argument('-o', '--output', default=None,
+                        help='JSON file to write, by default the dump file '
+                             'name with .json')
+    args = parser.parse_args()
+
+    with open(args.dump, 'rb') as file:
+        _events = load(file.read())
+    _output = args.output or args.dump.rsplit('.', 1)[0] + '.json'
+    with open(_output, 'w') as file:
+        json.dump(to_chrome(_events), file)
+    print(f'{len(_events)} events written to {_output}')
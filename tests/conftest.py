@@ -0,0 +1,10 @@
+'''!@file       conftest.py
+    Lets the tests import the board modules from @c src, which run on the PC
+    with the stand-ins in @c simhal.py.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'src'))
@@ -0,0 +1,355 @@
+'''!@file       test_cotask.py
+    Tests of the scheduler in @c cotask.py, run in @c simhal.py's simulated
+    time.
+'''
+
+import importlib
+
+import pytest
+
+import simhal
+
+## The schedulers which take releases from the clock
+_SCHEDULERS = ('pri_sched', 'rr_sched', 'deadline_sched', 'event_sched',
+               'cyclic_sched')
+
+
+def _late_task(sched_name, overrun=None, catch_up_limit=1):
+    '''!Makes a task with a 10 ms period and runs it once the clock is 3.5
+        periods past its first release, so four releases are due at once.
+        @return     The simulated board, the task and the times at which it ran
+    '''
+    board = simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_list = cotask.TaskList()
+    runs = []
+
+    def task_fun():
+        while True:
+            runs.append(board.clock.now)
+            yield 0
+
+    task = cotask.Task(task_fun, name='Late', priority=1, period=10,
+                       profile=True, overrun=overrun,
+                       catch_up_limit=catch_up_limit)
+    task_list.append(task)
+    if sched_name == 'cyclic_sched':
+        task_list.make_cyclic()
+    sched = getattr(task_list, sched_name)
+    board.clock.now = 45000
+    while sched():
+        pass
+    return board, sched, task, runs
+
+
+@pytest.mark.parametrize('sched_name', _SCHEDULERS)
+def test_late_runs_every_release(sched_name):
+    _, _, task, runs = _late_task(sched_name)
+    stats = task.stats()
+    assert len(runs) == 4
+    assert stats['overruns'] == 3
+    assert stats['skipped'] == 0
+    assert stats['misses'] == 3
+    assert stats['max_late'] == 35000
+    assert task._late_sum == 35000 + 25000 + 15000 + 5000
+
+
+@pytest.mark.parametrize('sched_name', _SCHEDULERS)
+def test_late_skip(sched_name):
+    _, _, task, runs = _late_task(sched_name, overrun='skip')
+    stats = task.stats()
+    assert len(runs) == 1
+    assert stats['overruns'] == 3
+    assert stats['skipped'] == 3
+    assert stats['misses'] == 0
+    assert stats['max_late'] == 5000
+
+
+@pytest.mark.parametrize('sched_name', _SCHEDULERS)
+def test_late_catch_up(sched_name):
+    _, _, task, runs = _late_task(sched_name, overrun='catch_up',
+                                  catch_up_limit=2)
+    stats = task.stats()
+    assert len(runs) == 3
+    assert stats['overruns'] == 3
+    assert stats['skipped'] == 1
+    assert stats['misses'] == 2
+
+
+@pytest.mark.parametrize('sched_name', _SCHEDULERS)
+def test_late_then_on_time(sched_name):
+    board, sched, task, runs = _late_task(sched_name)
+    board.clock.now = 49999
+    assert not sched()
+    board.clock.now = 50001
+    assert sched()
+    assert not sched()
+    assert runs[-2:] == [45000, 50001]
+    assert task.stats()['overruns'] == 3
+    assert task.stats()['misses'] == 3
+
+
+def test_many_priorities():
+    simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_list = cotask.TaskList()
+
+    def task_fun():
+        while True:
+            yield 0
+
+    # Lists with more priorities than the ready bitmap has room for still
+    # work with the other schedulers, but not with event_sched()
+    for pri in range(31):
+        task_list.append(cotask.Task(task_fun, priority=pri))
+    task_list.tasks()[0].go()
+    assert task_list.pri_sched()
+    with pytest.raises(ValueError):
+        task_list.event_sched()
+
+    # Once event_sched() has run, a 31st priority is refused and the task
+    # isn't added
+    task_list = cotask.TaskList()
+    for pri in range(30):
+        task_list.append(cotask.Task(task_fun, priority=pri))
+    assert not task_list.event_sched()
+    extra = cotask.Task(task_fun, priority=30)
+    with pytest.raises(ValueError):
+        task_list.append(extra)
+    assert extra not in task_list.tasks()
+    assert len(task_list.pri_list) == 30
+    extra.go()
+    assert not task_list.event_sched()
+
+
+def test_wait_woken_before_timeout():
+    board = simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_share = importlib.import_module('task_share')
+    task_list = cotask.TaskList()
+    queue = task_share.Queue('i', 4)
+    runs = []
+
+    def consumer_fun():
+        while True:
+            runs.append(board.clock.now)
+            while queue.any():
+                queue.get()
+            yield queue.wait_data(timeout_ms=100)
+
+    consumer = cotask.Task(consumer_fun, priority=1)
+    task_list.append(consumer)
+    consumer.go()
+    assert task_list.pri_sched()
+    assert len(task_list._sleepers) == 1
+
+    # Data arriving before the timeout wakes the task and cancels the timeout
+    board.clock.now = 10000
+    queue.put(1)
+    assert task_list._sleepers == []
+    assert task_list.pri_sched()
+    assert len(task_list._sleepers) == 1
+
+    # The task is parked again, so go() resumes it and cancels the timeout;
+    # the first timeout, long past, doesn't resume it again later
+    board.clock.now = 20000
+    consumer.go()
+    assert consumer._wait is None
+    assert task_list._sleepers == []
+    assert task_list.pri_sched()
+    board.clock.now = 115000
+    assert not task_list.pri_sched()
+    board.clock.now = 120001
+    assert task_list.pri_sched()
+    assert runs == [0, 10000, 20000, 120001]
+
+
+def test_sleep_ms_reuses_wait():
+    simhal.install()
+    cotask = importlib.import_module('cotask')
+    assert cotask.sleep_ms(500) is cotask.sleep_ms(500)
+    assert cotask.sleep_ms(500) is not cotask.sleep_ms(20)
+
+
+def test_trace_any_state():
+    board = simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_list = cotask.TaskList()
+
+    def tuple_fun():
+        while True:
+            yield ()
+
+    def state_fun():
+        state = 0
+        while True:
+            state = (state + 1) % 3
+            yield state
+
+    # main.py's tasks yield an empty tuple rather than a state number
+    plain = cotask.Task(tuple_fun, name='Plain', priority=1, trace=True)
+    states = cotask.Task(state_fun, name='States', priority=1, trace=True,
+                         trace_size=4)
+    task_list.append(plain)
+    task_list.append(states)
+    for _ in range(6):
+        board.clock.now += 1000
+        plain.go()
+        states.go()
+        while task_list.pri_sched():
+            pass
+    assert plain.get_trace().splitlines()[1:] == ['    0.001000:  0 -> ()']
+    lines = states.get_trace().splitlines()
+    assert lines[1] == '  (2 older transitions overwritten)'
+    assert [line.split(': ')[1] for line in lines[2:]] \
+        == [' ? -> 0', ' 0 -> 1', ' 1 -> 2', ' 2 -> 0']
+
+
+@pytest.mark.parametrize('sched_name',
+                         ('pri_sched', 'rr_sched', 'event_sched'))
+def test_go_between_releases(sched_name):
+    board = simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_list = cotask.TaskList()
+    runs = []
+
+    def task_fun():
+        while True:
+            runs.append(board.clock.now)
+            yield 0
+
+    task = cotask.Task(task_fun, name='Timed', priority=1, period=10,
+                       deadline=5, profile=True)
+    task_list.append(task)
+    sched = getattr(task_list, sched_name)
+    board.clock.now = 10001
+    assert sched()
+    assert not sched()
+
+    # A run started by go() rather than a release is neither late nor a miss
+    board.clock.now = 19000
+    task.go()
+    assert sched()
+    assert not sched()
+    stats = task.stats()
+    assert runs == [10001, 19000]
+    assert stats['max_late'] == 1
+    assert stats['misses'] == 0
+    assert stats['overruns'] == 0
+
+
+@pytest.mark.parametrize('sched_name', ('pri_sched', 'event_sched'))
+def test_on_post(sched_name):
+    simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_list = cotask.TaskList()
+    posted = []
+
+    def task_fun():
+        while True:
+            yield 0
+
+    task = cotask.Task(task_fun, name='Untimed', priority=1)
+    task_list.append(task)
+    sched = getattr(task_list, sched_name)
+    assert not sched()
+
+    # The hook sees each go() under any scheduler, after the task is posted
+    task_list.on_post = posted.append
+    task.go()
+    assert posted == [task]
+    assert sched()
+    task_list.on_post = None
+    task.go()
+    assert posted == [task]
+    assert sched()
+
+
+def test_repr_untimed_lateness():
+    board = simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_list = cotask.TaskList()
+
+    def task_fun():
+        while True:
+            board.clock.now += 2000
+            yield 0
+
+    untimed = cotask.Task(task_fun, name='Untimed', priority=1,
+                          profile=True)
+    timed = cotask.Task(task_fun, name='Timed', priority=1, period=10,
+                        profile=True)
+    task_list.append(untimed)
+    task_list.append(timed)
+    untimed.go()
+    board.clock.now = 10000
+    while task_list.pri_sched():
+        pass
+
+    # Untimed tasks show dashes for all their lateness columns, as a timed
+    # task shows numbers for them
+    columns = repr(untimed).split()
+    assert len(columns) == 14
+    assert columns[6:8] == ['-', '-']
+    assert '-' not in columns[8:11]
+    assert columns[11:] == ['-', '-', '-']
+    columns = repr(timed).split()
+    assert '-' not in columns
+    assert len(columns) == 17
+
+
+@pytest.mark.parametrize('minor_ms', (0, -10, 0.0001))
+def test_make_cyclic_bad_minor(minor_ms):
+    simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_list = cotask.TaskList()
+
+    def task_fun():
+        while True:
+            yield 0
+
+    task_list.append(cotask.Task(task_fun, priority=1, period=10))
+    with pytest.raises(ValueError):
+        task_list.make_cyclic(minor_ms=minor_ms)
+
+
+def test_histogram_buckets():
+    simhal.install()
+    cotask = importlib.import_module('cotask')
+    hist = cotask.Histogram()
+    assert hist.percentile(50) == 0
+
+    # Each time falls in the bucket whose bounds hold it, and the buckets
+    # cover every time without gaps
+    for idx in range(cotask.Histogram.BUCKETS - 1):
+        low, high = cotask.Histogram.bounds(idx)
+        assert cotask.Histogram.bounds(idx + 1)[0] == high
+        assert high - low <= max(1, low // 4)
+    for time_us in (0, 1, 7, 8, 9, 15, 16, 100, 12345, 1 << 29):
+        hist.clear()
+        hist.add(time_us)
+        idx = list(hist.counts).index(1)
+        low, high = cotask.Histogram.bounds(idx)
+        assert low <= time_us < high
+    hist.clear()
+    hist.add(-5)
+    hist.add(1 << 40)
+    assert hist.counts[0] == 1
+    assert hist.counts[cotask.Histogram.BUCKETS - 1] == 1
+
+
+def test_histogram_percentiles():
+    simhal.install()
+    cotask = importlib.import_module('cotask')
+    hist = cotask.Histogram()
+    for time_us in range(1, 1001):
+        hist.add(time_us)
+    assert hist.count == 1000
+
+    # Percentiles are the top of their bucket: never short, at most a
+    # quarter long
+    for pct, exact in ((50, 500), (99, 990), (99.9, 999), (100, 1000)):
+        assert exact <= hist.percentile(pct) <= exact * 1.25
+    hist.clear()
+    assert hist.count == 0
+    assert hist.percentile(99) == 0
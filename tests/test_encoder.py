@@ -0,0 +1,72 @@
+'''!@file       test_encoder.py
+    Tests of the timer interrupt sampling mode of @c encoder.py.
+'''
+
+import array
+import importlib
+
+import pytest
+
+import simhal
+
+
+class _Shaft:
+    '''!A motor shaft which turns at a steady speed, read by the simulated
+        encoder timer.
+    '''
+
+    def __init__(self, clock, ticks_per_ms):
+        self.clock = clock
+        self.ticks_per_ms = ticks_per_ms
+
+    def ticks(self):
+        return self.clock.now * self.ticks_per_ms // 1000
+
+
+def _encoder(ticks_per_ms=3):
+    board = simhal.install()
+    board.encoders[4] = _Shaft(board.clock, ticks_per_ms)
+    encoder = importlib.import_module('encoder')
+    pyb = importlib.import_module('pyb')
+    task_share = importlib.import_module('task_share')
+    driver = encoder.EncoderDriver(pyb.Pin.cpu.B6, pyb.Pin.cpu.B7, 4)
+    return board, driver, task_share
+
+
+def test_read_samples():
+    board, driver, _ = _encoder()
+    driver.start_sampling(6, freq=1000, size=8)
+    assert driver.is_sampling()
+    board.clock.advance(5000)
+    times = array.array('l', [0] * 8)
+    positions = array.array('l', [0] * 8)
+    assert driver.read_samples(times, positions) == 5
+    assert list(times[:5]) == [1000, 2000, 3000, 4000, 5000]
+    assert list(positions[:5]) == [3, 6, 9, 12, 15]
+    assert driver.sample_time == 5000
+    board.clock.advance(2000)
+    assert driver.read() == 21
+    assert driver.sample_time == 7000
+
+
+def test_restart_reuses_queue():
+    board, driver, task_share = _encoder()
+    driver.start_sampling(6, freq=1000, size=8)
+    shares = len(task_share.share_list)
+    board.clock.advance(3000)
+    driver.stop_sampling()
+    assert not driver.is_sampling()
+    board.clock.advance(1000)
+    assert driver.read() == 12
+    for _ in range(3):
+        driver.start_sampling(6, freq=1000, size=8)
+        driver.stop_sampling()
+    assert len(task_share.share_list) == shares
+    with pytest.raises(ValueError):
+        driver.start_sampling(6, freq=1000, size=16)
+
+
+def test_read_samples_needs_sampling():
+    _, driver, _ = _encoder()
+    with pytest.raises(ValueError):
+        driver.read_samples(array.array('l', [0]), array.array('l', [0]))
@@ -0,0 +1,113 @@
+'''!@file       test_estimator.py
+    Tests of the velocity estimators in @c estimator.py with samples of a
+    shaft turning at known speeds.
+'''
+
+import array
+import importlib
+
+import pytest
+
+import simhal
+
+
+def _estimator():
+    simhal.install()
+    return importlib.import_module('estimator')
+
+
+def _ramp(speed, count, interval_us=10000, start_us=0, start=0):
+    '''!Makes the sample times and positions of a shaft turning at a steady
+        speed in ticks per second.
+    '''
+    times = array.array('l', [start_us + n*interval_us
+                              for n in range(count)])
+    positions = array.array('l', [start + speed*n*interval_us//1000000
+                                  for n in range(count)])
+    return times, positions
+
+
+@pytest.mark.parametrize('name', ('DifferenceVelocity',
+                                  'LeastSquaresVelocity',
+                                  'EdgeTimingVelocity', 'AlphaBetaFilter'))
+@pytest.mark.parametrize('speed', (0, 2000, -35000, 3000000))
+def test_steady_speed(name, speed):
+    estimator = _estimator()
+    velocity = getattr(estimator, name)()
+    times, positions = _ramp(speed, 200, start_us=(1 << 30) - 500000)
+    for time_us, position in zip(times, positions):
+        # The simulated clock's ticks wrap at 2**30, as on the Nucleo
+        result = velocity.update(time_us & ((1 << 30) - 1), position)
+    assert result == pytest.approx(speed, rel=1e-6, abs=1e-6)
+
+
+def test_least_squares_block():
+    estimator = _estimator()
+    one = estimator.LeastSquaresVelocity(window=8)
+    block = estimator.LeastSquaresVelocity(window=8)
+    times, positions = _ramp(1000, 20, interval_us=1000)
+    for n in range(20):
+        positions[n] += (n*7) % 3
+    for time_us, position in zip(times, positions):
+        expected = one.update(time_us, position)
+
+    # A block fits the last window of samples, once
+    assert block.update_many(times, positions, 13) \
+        == pytest.approx(_fit(times, positions, 5, 13))
+    assert block.update_many(times[13:], positions[13:], 7) \
+        == pytest.approx(expected)
+    assert expected == pytest.approx(_fit(times, positions, 12, 20))
+
+
+def _fit(times, positions, start, end):
+    '''!Fits a line by least squares in floating point.
+    '''
+    n = end - start
+    ts = [t/1000000.0 for t in times[start:end]]
+    ps = [float(p) for p in positions[start:end]]
+    t_mean = sum(ts)/n
+    p_mean = sum(ps)/n
+    return sum((t - t_mean)*(p - p_mean) for t, p in zip(ts, ps)) \
+        / sum((t - t_mean)**2 for t in ts)
+
+
+def test_least_squares_window():
+    estimator = _estimator()
+    with pytest.raises(ValueError):
+        estimator.LeastSquaresVelocity(window=1)
+    velocity = estimator.LeastSquaresVelocity(window=4)
+    assert velocity.update(0, 5) == 0.0
+    assert velocity.update(1000, 6) == pytest.approx(1000.0)
+    velocity.reset()
+    assert velocity.velocity == 0.0
+
+
+def test_edge_timing_slows_to_zero():
+    estimator = _estimator()
+    velocity = estimator.EdgeTimingVelocity(timeout_ms=100)
+    velocity.update(0, 0)
+    assert velocity.update(1000, 1) == pytest.approx(1000.0)
+    assert velocity.update(4000, 1) == pytest.approx(1000/3)
+    assert velocity.update(101000, 1) == 0.0
+
+
+def test_read_from_sampling_encoder():
+    board = simhal.install()
+    estimator = importlib.import_module('estimator')
+    encoder = importlib.import_module('encoder')
+    pyb = importlib.import_module('pyb')
+
+    class Shaft:
+        def ticks(self):
+            return board.clock.now * 3 // 1000
+
+    board.encoders[4] = Shaft()
+    driver = encoder.EncoderDriver(pyb.Pin.cpu.B6, pyb.Pin.cpu.B7, 4)
+    velocity = estimator.DifferenceVelocity()
+    driver.start_sampling(6, freq=1000)
+    for _ in range(3):
+        board.clock.advance(2500)
+        velocity.read(driver)
+    # The times of the samples are used, not the times of the reads
+    assert driver.sample_time == 7000
+    assert velocity.velocity == pytest.approx(3000.0)
@@ -0,0 +1,74 @@
+'''!@file       test_multiaxis.py
+    Tests of @c multiaxis.py, whose axes should behave just like
+    @c pidcontroller.FixedPIDController objects.
+'''
+
+import importlib
+import random
+
+import pytest
+
+import simhal
+
+
+class _Encoder:
+    '''!An encoder whose position the test sets.
+    '''
+
+    def __init__(self):
+        self.position = 0
+
+    def read(self):
+        return self.position
+
+    def get(self):
+        return self.position
+
+
+class _Motor:
+    '''!A motor driver which remembers the duty cycle it was given.
+    '''
+
+    def __init__(self):
+        self.duty = None
+
+    def set_duty_cycle(self, duty):
+        self.duty = duty
+
+
+@pytest.mark.parametrize('dt', (1, 10, 300, 30000))
+def test_axes_match_fixed_pid(dt):
+    simhal.install()
+    pid = importlib.import_module('pidcontroller')
+    multiaxis = importlib.import_module('multiaxis')
+    gains = [(100, 100, 100), (0.0198, 0.0198, 0.5), (0, 3, -2)]
+    set_points = [0, 1000, -500]
+    encoders = [_Encoder() for _ in gains]
+    motors = [_Motor() for _ in gains]
+    axes = multiaxis.MultiAxisController(
+        encoders, motors, [gain[0] for gain in gains],
+        [gain[1] for gain in gains], [gain[2] for gain in gains],
+        set_points, period=dt)
+    singles = [pid.FixedPIDController(set_point, *gain, encoder, period=dt)
+               for gain, set_point, encoder in zip(gains, set_points,
+                                                   encoders)]
+    rand = random.Random(dt)
+    for _ in range(100):
+        for encoder in encoders:
+            encoder.position = rand.choice((0, 7, -7, 5057, 10**6,
+                                            rand.randint(-10**7, 10**7)))
+        expected = [single.run() for single in singles]
+        axes.run()
+        assert [motor.duty for motor in motors] == expected
+        assert list(axes.duties) == expected
+        assert list(axes.positions) == [encoder.position
+                                        for encoder in encoders]
+
+
+def test_needs_one_motor_per_encoder():
+    simhal.install()
+    multiaxis = importlib.import_module('multiaxis')
+    with pytest.raises(ValueError):
+        multiaxis.MultiAxisController([_Encoder()], [], 1)
+    with pytest.raises(ValueError):
+        multiaxis.MultiAxisController([_Encoder()], [_Motor()], [1, 2])
@@ -0,0 +1,98 @@
+'''!@file       test_pidcontroller.py
+    Tests of the integer PID controller in @c pidcontroller.py against the
+    same control law worked out with unbounded integers.
+'''
+
+import importlib
+import random
+
+import pytest
+
+import simhal
+
+## The largest MicroPython small integer is just below this
+_SMALL = 1 << 30
+
+
+class _Sensor:
+    '''!A share holding the position which the controller reads.
+    '''
+
+    def __init__(self):
+        self.value = 0
+
+    def get(self):
+        return self.value
+
+
+def _reference(Kp, Ki, Kd, errors, dt):
+    '''!Works out the controller's duty cycles with unbounded integers, as
+        the law was written before its products were kept small.
+    '''
+    pid = importlib.import_module('pidcontroller')
+    Kp, Ki, Kd, err_max = pid.fixed_gains(Kp, Ki, Kd)
+    limit = pid.DUTY_MAX
+    Iduty = 0
+    last_error = 0
+    duties = []
+    for num, error in enumerate(errors):
+        if err_max:
+            error = max(-err_max, min(err_max, error))
+        duty = -Kp*error
+        if num > 0:
+            Iduty_new = Ki*error*dt
+            if (Iduty > 0 and Iduty_new < 0) or (Iduty < 0 and Iduty_new > 0):
+                Iduty = Iduty_new
+            else:
+                Iduty += Iduty_new
+            Iduty = max(-limit, min(limit, Iduty))
+            duty += Kd*(error - last_error)//dt
+        duty += Iduty
+        duties.append(max(-limit, min(limit, duty)) >> pid.SHIFT)
+        last_error = error
+    return duties
+
+
+@pytest.mark.parametrize('dt', (1, 10, 300, 1000, 30000))
+@pytest.mark.parametrize('gains', ((100, 100, 100), (-100, -100, -100),
+                                   (0.0198, 0.0198, 0), (0, 0.0198, 0.5),
+                                   (1e-5, 100, 1e-5), (0.02, 0, 100)))
+def test_matches_unbounded_law(gains, dt):
+    simhal.install()
+    pid = importlib.import_module('pidcontroller')
+    rand = random.Random(dt)
+    errors = [rand.choice((0, 1, -1, 5057, -5057, 100000, -100000,
+                           rand.randint(-10000000, 10000000)))
+              for _ in range(200)]
+    sensor = _Sensor()
+    controller = pid.FixedPIDController(0, *gains, sensor, period=dt)
+    duties = []
+    for error in errors:
+        sensor.value = error
+        duties.append(controller.run())
+        assert abs(controller._Iduty) < _SMALL
+    assert duties == _reference(*gains, errors, dt)
+
+
+def test_terms_stay_small():
+    simhal.install()
+    pid = importlib.import_module('pidcontroller')
+    biggest = pid.DUTY_MAX
+    for gain in (1, 1296, biggest, -biggest):
+        for dt in (1, 7, 300, 32767, 100000):
+            for change in (1, -1, 5057, -2*5057, biggest, -2*biggest,
+                           _SMALL - 1, -_SMALL):
+                term = pid.fixed_derivative(gain, change, dt)
+                assert abs(term) <= pid._D_MAX + 2*biggest
+                if dt <= pid._DT_MAX and abs(gain*change//dt) < pid._D_MAX:
+                    assert term == gain*change//dt
+                term = pid.fixed_integral(0, gain, change, dt)
+                assert abs(term) <= biggest
+                assert term == max(-biggest, min(biggest, gain*change*dt))
+
+
+def test_gain_limit():
+    simhal.install()
+    pid = importlib.import_module('pidcontroller')
+    with pytest.raises(ValueError):
+        pid.FixedPIDController(0, 101, 0, 0, _Sensor())
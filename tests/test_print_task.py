@@ -0,0 +1,48 @@
+'''!@file       test_print_task.py
+    Tests of the print task in @c print_task.py writing to streams, run with
+    @c simhal.py's simulated hardware.
+'''
+
+import importlib
+import io
+
+import simhal
+
+
+def _print_all(text_stream, *items):
+    '''!Puts strings and bytes into the print queue and runs the print task
+        until it has written them all to a text stream.
+    '''
+    simhal.install()
+    cotask = importlib.import_module('cotask')
+    print_task = importlib.import_module('print_task')
+    print_task.set_stream(text_stream)
+    for item in items:
+        if isinstance(item, str):
+            print_task.put(item)
+        else:
+            print_task.put_bytes(item)
+    while cotask.task_list.pri_sched():
+        pass
+    assert not print_task.print_queue.any()
+
+
+def test_characters_cut_between_blocks():
+    # The first block of 64 bytes ends half way through a character
+    text = 'a' + 'é'*40 + '€'*30 + '\U0001f600'*20 + '\n'
+    stream = io.StringIO()
+    _print_all(stream, text)
+    assert stream.getvalue() == text
+
+
+def test_binary_bytes_replaced():
+    stream = io.StringIO()
+    _print_all(stream, 'ok ', b'\xa5\x5a\xff', ' done')
+    assert stream.getvalue() == 'ok \ufffdZ\ufffd done'
+
+
+def test_buffer_used_when_there_is_one():
+    raw = io.BytesIO()
+    text_stream = io.TextIOWrapper(raw, encoding='utf-8')
+    _print_all(text_stream, b'\xa5\x5a', 'x')
+    assert raw.getvalue() == b'\xa5\x5ax'
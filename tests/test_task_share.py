@@ -0,0 +1,197 @@
+'''!@file       test_task_share.py
+    Tests of the queues and shares in @c task_share.py, run with
+    @c simhal.py's simulated hardware.
+'''
+
+import array
+import importlib
+import sys
+
+import pytest
+
+import simhal
+
+
+def _no_irq():
+    '''!Stands in for @c disable_irq() where interrupts mustn't be disabled.
+    '''
+    raise AssertionError('interrupts disabled')
+
+
+def test_spsc_wakes_without_disabling_irq(monkeypatch):
+    simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_share = importlib.import_module('task_share')
+    task_list = cotask.TaskList()
+    queue = task_share.SPSCQueue('B', 8)
+    got = []
+
+    def consumer_fun():
+        while True:
+            while queue.any():
+                got.append(queue.get())
+            yield queue.wait_data()
+
+    consumer = cotask.Task(consumer_fun, priority=1)
+    task_list.append(consumer)
+    consumer.go()
+    monkeypatch.setattr(sys.modules['pyb'], 'disable_irq', _no_irq)
+    monkeypatch.setattr(sys.modules['machine'], 'disable_irq', _no_irq)
+    assert task_list.pri_sched()
+    assert consumer._wait is queue.wait_data()
+
+    # Putting data in resumes the parked consumer
+    queue.put(1)
+    assert consumer._wait is None
+    assert task_list.pri_sched()
+    assert not task_list.pri_sched()
+    queue.put_many(b'\x02\x03')
+    assert task_list.pri_sched()
+    assert got == [1, 2, 3]
+
+    # Data which is already there when the consumer yields isn't waited for
+    queue.put(4)
+    assert not queue.wait_data()._add_waiter(consumer)
+    assert consumer._wait is None
+
+
+def test_waits_keep_their_timeouts():
+    board = simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_share = importlib.import_module('task_share')
+    task_list = cotask.TaskList()
+    share = task_share.Share('h')
+    runs = {'Short': [], 'Long': []}
+
+    def make_fun(name, timeout_ms):
+        def task_fun():
+            while True:
+                runs[name].append(board.clock.now)
+                yield share.wait_change(timeout_ms)
+        return task_fun
+
+    for name, timeout_ms in (('Short', 50), ('Long', None)):
+        task = cotask.Task(make_fun(name, timeout_ms), name=name, priority=1)
+        task_list.append(task)
+        task.go()
+    while task_list.pri_sched():
+        pass
+    assert share.wait_change(50) is not share.wait_change()
+    assert share.wait_change(50).timeout_us == 50000
+    assert share.wait_change().timeout_us is None
+
+    # Only the task which asked for a timeout is resumed by it
+    board.clock.now = 50001
+    while task_list.pri_sched():
+        pass
+    assert runs == {'Short': [0, 50001], 'Long': [0]}
+
+    # Both are resumed by new data
+    board.clock.now = 60000
+    share.put(7)
+    while task_list.pri_sched():
+        pass
+    assert runs == {'Short': [0, 50001, 60000], 'Long': [0, 60000]}
+
+
+@pytest.mark.parametrize('kind', ('Queue', 'SPSCQueue'))
+def test_wait_data_reuses_waits(kind):
+    simhal.install()
+    task_share = importlib.import_module('task_share')
+    queue = getattr(task_share, kind)('h', 4)
+    assert queue.wait_data(10) is queue.wait_data(10)
+    assert queue.wait_data() is queue.wait_data()
+    assert len(queue._waits) == 2
+
+
+def test_spsc_items_and_blocks():
+    simhal.install()
+    task_share = importlib.import_module('task_share')
+    queue = task_share.SPSCQueue('h', 5)
+    assert queue.empty() and not queue.any()
+
+    # Single items come out in order, and the queue holds as many as asked
+    for item in (-3, 0, 7, 300, -32768):
+        queue.put(item, in_ISR=True)
+    assert queue.full() and queue.num_in() == 5
+    queue.put(99, in_ISR=True)
+    assert queue.num_in() == 5
+    assert [queue.get() for _ in range(2)] == [-3, 0]
+
+    # A block which wraps around the end of the buffer is split in two,
+    # and only as many items as fit are put in
+    assert queue.put_many(array.array('h', (1, 2, 3, 4))) == 2
+    first, second = queue.peek_view()
+    assert list(first) + list(second) == [7, 300, -32768, 1, 2]
+    assert len(second) > 0
+    assert queue.commit_read(1) == 1
+    buf = array.array('h', [0]*8)
+    assert queue.get_many(buf) == 4
+    assert list(buf[:4]) == [300, -32768, 1, 2]
+    assert queue.empty()
+    assert queue.commit_read(3) == 0
+
+
+def test_record_share_fields():
+    simhal.install()
+    task_share = importlib.import_module('task_share')
+    record = task_share.RecordShare('f', ('pos', 'vel', 'time'))
+    assert record.get() == (0.0, 0.0, 0.0)
+    assert record.index('vel') == 1
+    with pytest.raises(ValueError):
+        record.index('accel')
+
+    seq = record.sequence()
+    record.put((1.5, -2.0, 10.0))
+    assert record.get() == (1.5, -2.0, 10.0)
+    record.put([3.0, 4.0, 20.0, 99.0])
+    assert record.get() == (3.0, 4.0, 20.0)
+    assert record.sequence() != seq
+    assert task_share.RecordShare('i', 2).fields is None
+
+
+def test_record_share_read_is_whole():
+    simhal.install()
+    task_share = importlib.import_module('task_share')
+    record = task_share.RecordShare('i', 3)
+    record.put((1, 2, 3))
+
+    class _Interrupted(list):
+        '''!A buffer into which a new record is published, as an ISR
+            would, while the first item is being copied.
+        '''
+        def __setitem__(self, idx, value):
+            if idx == 0 and not hasattr(self, 'done'):
+                self.done = True
+                record.put((4, 5, 6))
+            super().__setitem__(idx, value)
+
+    # The copy which started before the new record is made again
+    buf = _Interrupted([0, 0, 0])
+    seq = record.read_into(buf)
+    assert buf == [4, 5, 6]
+    assert seq == record.sequence()
+
+
+def test_record_share_wakes():
+    board = simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_share = importlib.import_module('task_share')
+    task_list = cotask.TaskList()
+    record = task_share.RecordShare('i', 2)
+    seen = []
+
+    def reader_fun():
+        while True:
+            seen.append(record.get())
+            yield record.wait_change()
+
+    reader = cotask.Task(reader_fun, priority=1)
+    task_list.append(reader)
+    reader.go()
+    assert task_list.pri_sched()
+    assert not task_list.pri_sched()
+    board.clock.now = 1000
+    record.put((8, 9))
+    assert task_list.pri_sched()
+    assert seen == [(0, 0), (8, 9)]
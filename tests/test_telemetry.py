@@ -0,0 +1,109 @@
+'''!@file       test_telemetry.py
+    Tests of the binary record format in @c telemetry.py, packing records as
+    the microcontroller does and decoding them as the PC does.
+'''
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+import telemetry
+
+
+def _records(*rows):
+    '''!Packs records into one block of bytes.
+        @param rows     Tuples of (channel, time, ticks, duty, error)
+        @return         A @c bytearray holding the records in order
+    '''
+    buf = bytearray(len(rows)*telemetry.RECORD_SIZE)
+    for idx, row in enumerate(rows):
+        telemetry.pack_into(buf, idx*telemetry.RECORD_SIZE, *row)
+    return buf
+
+
+def _rows(records):
+    '''!Turns decoded records back into tuples to compare with.
+    '''
+    return [(int(rec['channel']), int(rec['time']), int(rec['ticks']),
+             int(rec['duty']), int(rec['error'])) for rec in records]
+
+
+_ROWS = ((1, 10, 1234, 55, -20), (2, 10, -70000, -100, 65536),
+         (1, 20, 1300, 50, 0))
+
+
+def test_round_trip():
+    data = _records(*_ROWS)
+    assert len(data) == 3*telemetry.RECORD_SIZE
+    assert data[:2] == b'\xa5\x5a'
+    records, used = telemetry.decode(bytes(data))
+    assert _rows(records) == list(_ROWS)
+    assert used == len(data)
+
+
+def test_time_wraps():
+    records, _ = telemetry.decode(_records((3, -1, 0, 0, 0)))
+    assert _rows(records) == [(3, 0xFFFFFFFF, 0, 0, 0)]
+
+
+def test_crc_failure():
+    data = _records(*_ROWS)
+
+    # A damaged byte in the middle record loses only that record
+    data[telemetry.RECORD_SIZE + 5] ^= 0x10
+    records, used = telemetry.decode(data)
+    assert _rows(records) == [_ROWS[0], _ROWS[2]]
+    assert used == len(data)
+
+    # So does a damaged CRC
+    data = _records(*_ROWS)
+    data[2*telemetry.RECORD_SIZE - 1] ^= 0x01
+    records, _ = telemetry.decode(data)
+    assert _rows(records) == [_ROWS[0], _ROWS[2]]
+
+
+def test_resync_after_junk():
+    # Text, a lone sync word and a cut-off record come before good records
+    cut = _records(_ROWS[1])[:telemetry.RECORD_SIZE - 3]
+    data = b'Hello\n\xa5\x5a' + bytes(cut) + bytes(_records(*_ROWS)) \
+        + b'Done!\n'
+    records, used = telemetry.decode(data)
+    assert _rows(records) == list(_ROWS)
+    assert used == len(data) - len(b'Done!\n')
+
+
+def test_partial_record_kept():
+    data = bytes(_records(*_ROWS))
+    split = telemetry.RECORD_SIZE + 7
+    records, used = telemetry.decode(data[:split])
+    assert _rows(records) == [_ROWS[0]]
+    assert used == telemetry.RECORD_SIZE
+
+    # The rest of the record arrives with the unused bytes kept from before
+    records, used = telemetry.decode(data[used:split] + data[split:])
+    assert _rows(records) == list(_ROWS[1:])
+
+
+def test_no_records():
+    records, used = telemetry.decode(b'just some text, no records\n')
+    assert len(records) == 0
+    assert used == len(b'just some text, no records\n') \
+        - telemetry.RECORD_SIZE + 1
+    records, used = telemetry.decode(b'abc')
+    assert len(records) == 0
+    assert used == 0
+
+
+def test_crc16_check_value():
+    # The standard check value of CRC-16/CCITT-FALSE
+    assert telemetry.crc16(b'xx123456789', 2, 9) == 0x29B1
+    assert telemetry.crc16(b'', 0, 0) == 0xFFFF
+
+
+def test_pack_at_offset():
+    buf = bytearray(b'\xee'*(telemetry.RECORD_SIZE + 6))
+    telemetry.pack_into(buf, 3, 4, 1000, -5, 12, 7)
+    assert buf[:3] == b'\xee'*3 and buf[-3:] == b'\xee'*3
+    records, used = telemetry.decode(buf)
+    assert _rows(records) == [(4, 1000, -5, 12, 7)]
+    assert used == 3 + telemetry.RECORD_SIZE
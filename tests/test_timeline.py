@@ -0,0 +1,114 @@
+'''!@file       test_timeline.py
+    Tests of the task timeline recorder and its dump formats in
+    @c timeline.py.
+'''
+
+import importlib
+import io
+
+import pytest
+
+import simhal
+import timeline
+
+
+def _dump(recorder, binary):
+    '''!Dumps a timeline and loads it back.
+        @return     The list of events from @c timeline.load()
+    '''
+    stream = io.BytesIO() if binary else io.StringIO()
+    recorder.dump(stream, binary=binary)
+    data = stream.getvalue()
+    return timeline.load(data if binary else data.encode())
+
+
+def test_names_with_commas():
+    recorder = timeline.Timeline(size=8)
+    first = recorder.add_task('Motor 1, inner loop')
+    second = recorder.add_task('Plain')
+    recorder.record(first, timeline.START, 100)
+    recorder.record(first, timeline.END, 150)
+    recorder.record(second, timeline.START, 160)
+    expected = [(0, 'Motor 1, inner loop', 'start'),
+                (50, 'Motor 1, inner loop', 'end'), (60, 'Plain', 'start')]
+    assert _dump(recorder, binary=False) == expected
+    assert _dump(recorder, binary=True) == expected
+
+
+@pytest.mark.parametrize('binary', (False, True))
+def test_ring_keeps_newest(binary):
+    recorder = timeline.Timeline(size=3)
+    task = recorder.add_task('Task')
+    for num in range(5):
+        recorder.record(task, timeline.START if num % 2 == 0
+                        else timeline.END, 100*num)
+    assert recorder.count == 5
+    assert _dump(recorder, binary) == [(0, 'Task', 'start'),
+                                       (100, 'Task', 'end'),
+                                       (200, 'Task', 'start')]
+    recorder.clear()
+    assert _dump(recorder, binary) == []
+
+
+def test_times_unwrapped():
+    # The tick counter wraps around at 2**30 between the two events
+    recorder = timeline.Timeline(size=4)
+    task = recorder.add_task('Task')
+    recorder.record(task, timeline.START, (1 << 30) - 10)
+    recorder.record(task, timeline.END, 5)
+    assert _dump(recorder, binary=True) == [(0, 'Task', 'start'),
+                                            (15, 'Task', 'end')]
+
+
+def test_too_many_tasks():
+    recorder = timeline.Timeline(size=4)
+    for num in range(256):
+        assert recorder.add_task(str(num)) == num
+    with pytest.raises(ValueError):
+        recorder.add_task('One too many')
+
+
+def test_to_chrome():
+    trace = timeline.to_chrome([(0, 'A', 'ready'), (10, 'A', 'start'),
+                                (15, 'B', 'late'), (40, 'A', 'end'),
+                                (50, 'B', 'end')])['traceEvents']
+    rows = {event['args']['name']: event['tid'] for event in trace
+            if event['name'] == 'thread_name'}
+    assert rows == {'A': 1, 'B': 2}
+
+    # A run is a bar from its start to its end; an end with no start, as
+    # when the start was overwritten, is left out
+    bars = [event for event in trace if event['ph'] == 'X']
+    assert bars == [{'name': 'A', 'ph': 'X', 'pid': 1, 'tid': 1, 'ts': 10,
+                     'dur': 30}]
+    marks = [(event['name'], event['tid'], event['ts']) for event in trace
+             if event['ph'] == 'i']
+    assert marks == [('ready', 1, 0), ('late', 2, 15)]
+
+
+def test_scheduler_records():
+    board = simhal.install()
+    cotask = importlib.import_module('cotask')
+    task_list = cotask.TaskList()
+
+    def task_fun():
+        while True:
+            board.clock.now += 300
+            yield 0
+
+    task_list.append(cotask.Task(task_fun, name='Timed', priority=1,
+                                 period=10))
+    recorder = task_list.record_timeline(size=20, late_us=1000)
+    for now in (10001, 22000):
+        board.clock.now = now
+        while task_list.pri_sched():
+            pass
+    task_list.stop_timeline()
+    board.clock.now = 30001
+    assert task_list.pri_sched()
+
+    # The second release, 2 ms after it was due, is logged as late
+    assert _dump(recorder, binary=False) == [
+        (0, 'Timed', 'ready'), (0, 'Timed', 'start'), (300, 'Timed', 'end'),
+        (11999, 'Timed', 'late'), (11999, 'Timed', 'start'),
+        (12299, 'Timed', 'end')]